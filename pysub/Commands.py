@@ -3,12 +3,16 @@ from util import *
 
 class SubmarineCommand():
     """Base class for player commands"""
+    __slots__ = ('turn_number', 'sub_id')
+
     def __init__(self, turn_number, sub_id):
         self.turn_number = turn_number
         self.sub_id = sub_id
 
 class PingCommand(SubmarineCommand):
     """Command to use sonar"""
+    __slots__ = ()
+
     def __init__(self, turn_number, sub_id):
         super(PingCommand, self).__init__(turn_number, sub_id)
 
@@ -17,6 +21,8 @@ class PingCommand(SubmarineCommand):
 
 class SleepCommand(SubmarineCommand):
     """Command to sleep this turn and charge two modules"""
+    __slots__ = ('equip1', 'equip2')
+
     def __init__(self, turn_number, sub_id, equip1, equip2):
         super(SleepCommand, self).__init__(turn_number, sub_id)
         self.equip1 = equip1
@@ -27,6 +33,8 @@ class SleepCommand(SubmarineCommand):
 
 class MoveCommand(SubmarineCommand):
     """Command to move this turn and charge one module"""
+    __slots__ = ('direction', 'equip')
+
     def __init__(self, turn_number, sub_id, direction, equip):
         super(MoveCommand, self).__init__(turn_number, sub_id)
         self.direction = direction
@@ -37,6 +45,8 @@ class MoveCommand(SubmarineCommand):
 
 class FireCommand(SubmarineCommand):
     """Command to fire a torpedo"""
+    __slots__ = ('destination',)
+
     def __init__(self, turn_number, sub_id, destination):
         super(FireCommand, self).__init__(turn_number, sub_id)
         self.destination = destination
@@ -1,10 +1,29 @@
 """This module defines a simple submarine in python"""
+import argparse
 import traceback
 import random
-import sys
+import os
+import time
+import numpy as np
 import server_message
 import socket_manager
-from util import Coordinate, Direction, Equipment, MapSquare
+import targeting
+import trace_log
+from trace_log import DEBUG, TraceLog
+from message_parser import MessageParser
+from turn_stats import TurnStats
+from turn_profiler import TurnProfiler, CPROFILE, MODES, parse_turns
+from util import Coordinate, Direction, Equipment
+from game_map import GameMap
+from tiled_map import TiledMap, DEFAULT_MAX_TILES
+from reachability import ReachabilityIndex
+from pathfinding import PathFinder, ALL_PAIRS_LIMIT
+from speculation import Speculator
+from planner import AnytimePlanner
+from rollout import GameSnapshot, RolloutEngine, encode_command
+from occupancy import OccupancyBelief
+from threat_map import ThreatMap
+from spatial_index import SpatialIndex
 from submarine import Submarine
 
 
@@ -12,56 +31,126 @@ DEFAULT_USERNAME = "PySub"
 DEFAULT_SERVER_ADDRESS = "localhost"
 #DEFAULT_SERVER_ADDRESS = "127.0.0.1"
 DEFAULT_SERVER_PORT = 9555
+DEFAULT_PROFILE_DIR = "profiles"
 ALL_DIRECTIONS = [Direction.NORTH, Direction.EAST, Direction.SOUTH, Direction.WEST]
+ROLLOUT_TARGETS = 3
+#expected enemy hits a torpedo needs before it's fired on belief alone
+BELIEF_FIRE_THRESHOLD = 0.6
+#random squares considered when picking a destination with the belief, and how far around
+#each one enemies are counted
+DESTINATION_CANDIDATES = 4
+DANGER_RADIUS = 3
+#maps at least this big with objects this sparse are searched through the spatial index
+SPATIAL_INDEX_MIN_AREA = 40000
+SPARSE_OBJECT_RATIO = 64
+#maps at least this big are kept in memory-mapped tiles once enable_tiled_map is called
+TILED_MAP_MIN_AREA = 4000000
 
 
 class PySub():
     """This is a sample skeleton sub in python"""
-    verbose = False
-    socket_manager = None
-    game_map = dict()
-    spotted = list()
-    detonations = list()
-    torpedo_hits = list()
-    mine_hits = list()
-    my_sub = Submarine(0)
-    random_destination = None
-    map_width = 0
-    map_height = 0
-    turn_number = 0
-
-    def __init__(self, username, server_address, server_port, verbose):
+    path_table_limit = ALL_PAIRS_LIMIT
+    #heuristic knobs, swept by tournament.py. A sub pings once its sonar range beats
+    #min_ping_range plus a random 0 to ping_spread, and charges sonar sonar_charge_percent of the time
+    min_ping_range = 1
+    ping_spread = 6
+    sonar_charge_percent = 33
+
+    def __init__(self, username, server_address, server_port, verbose, manager=None):
         self.username = username
         self.server_address = server_address
         self.server_port = server_port
         self.verbose = verbose
-        self.socket_manager = socket_manager.SocketManager(server_address, server_port, verbose)
+        if manager is None:
+            manager = socket_manager.SocketManager(server_address, server_port, verbose)
+        self.socket_manager = manager
+        #the manager's trace is shared so messages and decisions land in one log
+        self.trace = getattr(manager, "trace", trace_log.DISABLED)
+        #the log enable_trace started, which close() stops. A shared one is left running
+        self.started_trace = None
+        #every bit of game state lives on the instance, so several bots can share a process
+        #and nothing carries over from one bot to the next
+        self.map_width = 0
+        self.map_height = 0
+        self.turn_number = 0
+        self.stats = None
+        self.stats_path = None
+        self.profiler = None
+        self.speculator = None
+        self.planner = None
+        self.rollouts = None
+        self.use_belief = False
+        self.belief = None
+        self.use_threat = False
+        self.threat = None
+        self.tiled_map = None
+        self.game_map = dict()
+        self.spotted = list()
+        self.detonations = list()
+        self.torpedo_hits = list()
+        self.mine_hits = list()
+        self.discovered = list()
+        self.pings = list()
+        self.shots = list()
+        self._object_index = None
+        self._object_index_key = None
+        self.my_sub = Submarine(0)
+        self.subs = {self.my_sub.sub_id: self.my_sub}
+        self.destinations = dict()
+        #where decisions draw their random numbers, the random module unless a planner swaps in its own
+        self.random = random
+        self.parser = MessageParser()
+        self.turn_handlers = {
+            "B": self.handle_begin_turn_message,
+            "S": self.handle_sonar_detection_message,
+            "D": self.handle_detonation_message,
+            "T": self.handle_torpedo_hit_message,
+            "O": self.handle_discovered_object_message,
+            "I": self.handle_info_message,
+            "H": self.handle_player_score_message,
+        }
 
     def login(self):
         """Logs in to server"""
         self.socket_manager.connect()
         self.configure(server_message.GameConfigMessage(self.socket_manager.receive_message(), self.socket_manager))
 
-        self.my_sub.location = self.random_square(None)
-        self.socket_manager.send_message("J|{0}|{1}|{2}".format(self.username, self.my_sub.get_x(), self.my_sub.get_y()))
+        self.socket_manager.send_message(self.join_message())
 
         response = self.socket_manager.receive_message()
         if response != "J|{0}".format(self.username):
             raise IOError("Failed to join. Server response: {0}.".format(response))
 
+    def join_message(self):
+        """Picks starting squares for every sub and returns the J message asking for them"""
+        locations = list()
+        for sub in self.subs.values():
+            sub.location = self.random_square(None)
+            locations.append(str(sub.location))
+        return "J|{0}|{1}".format(self.username, "|".join(locations))
+
+    @property
+    def random_destination(self):
+        """my_sub's current destination"""
+        return self.destinations.get(self.my_sub.sub_id)
+
+    @random_destination.setter
+    def random_destination(self, destination):
+        self.destinations[self.my_sub.sub_id] = destination
 
     def configure(self, message):
         """Configures the game"""
         self.turn_number = 0
         self.map_width = message.map_width
         self.map_height = message.map_height
-        self.my_sub = Submarine(0)
+        subs_per_player = 1
 
         #initialize game map
-        for y_val in range(1, self.map_height + 1):
-            for x_val in range(1, self.map_width + 1):
-                coord = Coordinate(x_val, y_val)
-                self.game_map[coord] = MapSquare(coord.x, coord.y)
+        if isinstance(self.game_map, GameMap):
+            self.game_map.close()
+        self.game_map = self.create_map()
+        self.reachability = ReachabilityIndex(self.game_map)
+        self.pathfinder = PathFinder(self.game_map)
 
         print("Joining as player:   {0}".format(self.username))
         print("Server Host:Port:    {0}:{1}".format(self.server_address, self.server_port))
@@ -72,64 +161,224 @@ class PySub():
         for setting in message.custom_settings:
             print("Customized Setting:      {0}".format(setting))
             if setting.setting_name == "SubsPerPlayer":
-                raise ValueError("More than one sub per player is not currently supported")
+                subs_per_player = int(setting.values[0])
+                if subs_per_player < 1:
+                    raise ValueError("Invalid SubsPerPlayer setting: {0}".format(subs_per_player))
             elif setting.setting_name == "Obstacle":
-                coord = Coordinate(setting.values[0], setting.values[1])
-                self.game_map[coord].blocked = True
+                coord = Coordinate(int(setting.values[0]), int(setting.values[1]))
+                self.game_map.set_blocked(coord)
+
+        self.subs = dict((sub_id, Submarine(sub_id)) for sub_id in range(subs_per_player))
+        self.my_sub = self.subs[0]
+        self.destinations = dict()
+        #nothing from an earlier game carries into this one
+        for observations in (self.spotted, self.detonations, self.torpedo_hits, self.mine_hits,
+                             self.discovered, self.pings, self.shots):
+            observations.clear()
+        self._object_index = self._object_index_key = None
+        self.belief = OccupancyBelief(self.game_map) if self.use_belief else None
+        self.threat = ThreatMap(self.map_width, self.map_height) if self.use_threat else None
+
+        #obstacles are fixed from here on, so small maps get an all-pairs next-hop table
+        self.pathfinder.precompute(self.path_table_limit)
+
+    def create_map(self):
+        """returns an empty map of the configured size, tiled if it's big enough and tiling is on"""
+        if self.tiled_map is None or self.map_width * self.map_height < self.tiled_map["min_area"]:
+            return GameMap(self.map_width, self.map_height)
+        if self.use_belief or self.use_threat or self.speculator is not None or self.rollouts is not None:
+            raise ValueError("The belief, threat map, speculation and rollouts need the whole map in memory")
+        return TiledMap(self.map_width, self.map_height, self.tiled_map["directory"],
+                        max_tiles=self.tiled_map["max_tiles"])
+
+    def require_whole_map(self, feature):
+        """raises ValueError if tiling is on, which feature can't work with"""
+        if self.tiled_map is not None or isinstance(self.game_map, TiledMap):
+            raise ValueError("{0} needs the whole map in memory, not a tiled map".format(feature))
+
+    def enable_tiled_map(self, directory=None, min_area=TILED_MAP_MIN_AREA, max_tiles=DEFAULT_MAX_TILES):
+        """Keeps maps of at least min_area squares in memory-mapped tiles under directory, a temporary
+        one by default, with at most max_tiles tiles resident"""
+        if self.use_belief or self.use_threat or self.speculator is not None or self.rollouts is not None:
+            raise ValueError("The tiled map can't be combined with the belief, threat map, speculation or rollouts")
+        self.tiled_map = {"directory": directory, "min_area": min_area, "max_tiles": max_tiles}
+
+    def enable_belief(self):
+        """Tracks where enemies probably are across turns and uses it to aim and pick destinations"""
+        self.require_whole_map("The belief")
+        self.use_belief = True
+        if isinstance(self.game_map, GameMap):
+            self.belief = OccupancyBelief(self.game_map)
+
+    def enable_threat(self):
+        """Tracks where enemy fire is likely to land and steers around it when moving and aiming"""
+        self.require_whole_map("The threat map")
+        self.use_threat = True
+        if isinstance(self.game_map, GameMap):
+            self.threat = ThreatMap(self.map_width, self.map_height)
+
+    def enable_stats(self, path=None):
+        """Turns on per-turn instrumentation. Stats are written to path when the game finishes"""
+        self.stats = TurnStats()
+        self.stats_path = path
+
+    def enable_profiling(self, directory, turns=None, threshold=None, mode=CPROFILE):
+        """Profiles the decisions of turns first to last, and of any other turn slower than threshold
+        seconds, writing a .prof and a .folded file per captured turn to directory"""
+        if self.profiler is not None:
+            self.profiler.close()
+        self.profiler = TurnProfiler(directory, turns, threshold, mode, trace=self.trace)
+
+    def enable_speculation(self):
+        """Precomputes likely next-turn data on a background thread while waiting for the server"""
+        self.require_whole_map("Speculation")
+        if self.speculator is None:
+            self.speculator = Speculator(self)
+        self.speculator.start()
+
+    def enable_trace(self, output, level=DEBUG, sample_every=1):
+        """Traces messages and decisions at level and above to output, a path or stream, through a
+        buffered background writer. Only one in sample_every records below WARNING is kept"""
+        if self.started_trace is not None:
+            self.started_trace.close()
+        self.trace = self.started_trace = TraceLog(output, level, sample_every).start()
+        if hasattr(self.socket_manager, "trace"):
+            self.socket_manager.trace = self.trace
+
+    def enable_planner(self, budget=None):
+        """Chooses commands with the experimental anytime lookahead planner, spending at most budget
+        seconds a turn. It doesn't play better than the heuristic yet, see planner.py"""
+        self.planner = AnytimePlanner(self) if budget is None else AnytimePlanner(self, budget)
+
+    def enable_rollouts(self, processes=None, budget=None):
+        """Scores commands on hard turns with Monte Carlo rollouts across a pool of processes,
+        spending at most budget seconds a turn"""
+        self.require_whole_map("Rollouts")
+        self.rollouts = RolloutEngine(processes) if budget is None else RolloutEngine(processes, budget=budget)
+        self.rollouts.start()
+
+    def close(self):
+        """Stops any background threads and worker processes. Call once the bot won't play again"""
+        if self.speculator is not None:
+            self.speculator.stop()
+        if self.rollouts is not None:
+            self.rollouts.close()
+        if isinstance(self.game_map, GameMap):
+            self.game_map.close()
+        if self.profiler is not None:
+            self.profiler.close()
+        if self.started_trace is not None:
+            self.started_trace.close()
+        self.trace.flush()
 
     def play(self):
         """Receives and handles messages"""
+        if self.stats is not None:
+            self.play_instrumented()
+            return
         message = self.socket_manager.receive_message()
         while message is not None:
-            if message.startswith("B"): #Begin Turn
-                self.handle_begin_turn_message(server_message.BeginTurnMessage(message))
-            elif message.startswith("S|"): #Sonar Detection
-                self.handle_sonar_detection_message(server_message.SonarDetectionMessage(message))
-            elif message.startswith("D|"): #Detonation
-                self.handle_detonation_message(server_message.DetonationMessage(message))
-            elif message.startswith("T|"): #Torpedo Hit
-                self.handle_torpedo_hit_message(server_message.TorpedoHitMessage(message))
-            elif message.startswith("O|"): #Discovered object
-                self.handle_discovered_object_message(server_message.DiscoveredObjectMessage(message))
-            elif message.startswith("I|"): #Sub info
-                self.handle_info_message(server_message.SubmarineInfoMessage(message))
-            elif message.startswith("H|"): #player score
-                self.handle_player_score_message(server_message.PlayerScoreMessage(message))
-            elif message.startswith("F|"): #game finished
+            if message.startswith("F|"): #game finished
                 self.handle_game_finished_message(server_message.GameFinishedMessage(message, self.socket_manager))
                 break
-            else:
-                print("error in message: {0}".format(message))
+            elif not self.handle_turn_message(message):
                 break
             message = self.socket_manager.receive_message()
 
+    def play_instrumented(self):
+        """play() that records per-phase timings and message counts in self.stats"""
+        stats = self.stats
+        clock = time.perf_counter
+        manager = self.socket_manager
+        send_messages = manager.send_messages
+
+        def timed_send_messages(messages):
+            start = clock()
+            send_messages(messages)
+            stats.add("send", clock() - start)
+            for message in messages:
+                message = str(message)
+                stats.count_message("send", message[:1], len(message) + 1)
+
+        manager.send_messages = timed_send_messages
+        try:
+            start = clock()
+            message = manager.receive_message()
+            stats.add("receive", clock() - start)
+            while message is not None:
+                kind = message[:1]
+                stats.count_message("recv", kind, len(message) + 1)
+                if kind == "B" or kind == "F":
+                    stats.end_turn()
+                if message.startswith("F|"): #game finished
+                    self.handle_game_finished_message(server_message.GameFinishedMessage(message, manager))
+                    break
+                handler = self.turn_handlers.get(kind)
+                if handler is None:
+                    print("error in message: {0}".format(message))
+                    break
+                start = clock()
+                parsed = self.parser.parse(message)
+                parsed_at = clock()
+                stats.add("parse", parsed_at - start)
+                send_before = stats.current["send"]
+                handler(parsed)
+                stats.add("decide", clock() - parsed_at - (stats.current["send"] - send_before))
+
+                start = clock()
+                message = manager.receive_message()
+                stats.add("receive", clock() - start)
+        finally:
+            del manager.send_messages
+
+    def handle_turn_message(self, message):
+        """Dispatches a single in-game message. Returns False if the message wasn't understood"""
+        handler = self.turn_handlers.get(message[:1])
+        if handler is None:
+            print("error in message: {0}".format(message))
+            return False
+        handler(self.parser.parse(message))
+        return True
+
     def check_turn_number(self, message):
         """Validates that the turn number matches the received turn number"""
-        if message.turn_number is not self.turn_number:
+        if message.turn_number != self.turn_number:
             raise RuntimeError("Expected turn number: {0} does not match message turn number {1}" \
             .format(self.turn_number, message.turn_number))
 
 
     def handle_begin_turn_message(self, message):
         """Handles a begin turn message"""
-        self.turn_number = int(message.get_part(1))
-        if self.verbose:
-            input("Press Enter to continue...")
-        self.issue_command(self.my_sub) #logic goes here
+        self.turn_number = message.turn_number
+        if self.trace.level <= DEBUG:
+            self.trace.record(DEBUG, "turn", "begin {0}", self.turn_number)
+        if self.speculator is not None:
+            self.speculator.prime()
+        if self.belief is not None:
+            self.update_belief()
+        if self.threat is not None:
+            self.update_threat()
+        if self.profiler is None:
+            self.issue_commands() #logic goes here
+        else:
+            self.profiler.run(self.turn_number, self.issue_commands)
 
         #Clear all info so it can be repopulated by turn results method.
-        for coord, square in self.game_map.items():
-            square.reset()
-        self.spotted = list()
-        self.detonations = list()
-        self.torpedo_hits = list()
+        #the lists are reused rather than reallocated every turn
+        self.game_map.reset()
+        self.spotted.clear()
+        self.detonations.clear()
+        self.torpedo_hits.clear()
+        self.discovered.clear()
+        if self.speculator is not None:
+            self.speculator.speculate()
 
     def handle_sonar_detection_message(self, message):
         """handles sonar detection message"""
         self.check_turn_number(message)
         self.spotted.append(message)
-        if verbose:
-            print("Sub(s) spotted: \n{0}".format(self.spotted))
+        if self.trace.level <= DEBUG:
+            self.trace.record(DEBUG, "spotted", "{0}", message.location)
 
     def handle_detonation_message(self, message):
         """handles detonation message"""
@@ -144,16 +393,42 @@ class PySub():
     def handle_discovered_object_message(self, message):
         """handles discovered object message"""
         self.check_turn_number(message)
-        square = self.game_map[message.location]
-        if square and not square.blocked:
-            square.object_size += message.size
-            square.foreign_object_size += message.size
+        if self.game_map.is_open(message.location):
+            self.game_map.add_object(message.location, message.size, message.size)
+            self.discovered.append(message.location)
 
     def handle_info_message(self, message):
-        """handles sub info messages"""
+        """handles sub info messages, routing them to the sub they describe"""
         self.check_turn_number(message)
-        self.my_sub.update(message)
-        self.game_map[self.my_sub.location].foreign_object_size -= self.my_sub.size
+        sub = self.subs.get(message.sub_id)
+        if sub is None:
+            sub = self.subs[message.sub_id] = Submarine(message.sub_id)
+        sub.update(message)
+        if not sub.dead:
+            self.game_map.add_object(sub.location, 0, -sub.size)
+
+    def update_belief(self):
+        """Folds the last turn's sightings, detonations and our pings into the occupancy belief"""
+        self.belief.update(self.foreign_discoveries(), [message.location for message in self.spotted],
+                           [message.location for message in self.detonations], self.pings)
+        self.pings.clear()
+
+    def update_threat(self):
+        """Folds the last turn's enemy detonations and sightings into the threat map"""
+        friends = set(sub.location for sub in self.subs.values())
+        #detonations of our own torpedoes and hits on our own subs say nothing about the enemy
+        detonations = [(message.location, message.radius) for message in self.detonations
+                       if message.location not in self.shots]
+        enemies = self.foreign_discoveries() + [message.location for message in self.spotted] + \
+            [message.location for message in self.torpedo_hits if message.location not in friends]
+        self.threat.update(detonations, enemies)
+        self.shots.clear()
+
+    def foreign_discoveries(self):
+        """returns the squares sonar found foreign objects on last turn"""
+        foreign = self.game_map.foreign_object_size
+        #our own subs show up in sonar results too, but handle_info_message took them back off
+        return [coord for coord in self.discovered if foreign[coord.y - 1, coord.x - 1] > 0]
 
     def handle_player_score_message(self, message):
         """handles player score message"""
@@ -164,67 +439,217 @@ class PySub():
         print("Game finished")
         for result in message.player_results:
             print("    {0} score: {1}".format(result.player_name, result.player_score))
+        #the rollout pool and other workers stay up for the next game, close() stops them
+        self.trace.flush()
+        if self.stats is not None and self.stats_path:
+            self.stats.export(self.stats_path)
+
+    def issue_commands(self):
+        """Decides every live sub's command in one pass and sends them in a single write"""
+        claimed = set()
+        commands = list()
+        live = [sub for sub in self.subs.values() if not sub.dead]
+        if self.planner is not None:
+            self.planner.start_turn(len(live))
+        for sub in live:
+            #read ahead the tiles the sub's torpedo and sonar windows will touch
+            self.game_map.prefetch(sub.location, max(sub.torpedo_range, sub.sonar_range) + targeting.BLAST_RADIUS)
+            command = self.choose_command(sub, claimed)
+            if self.belief is not None or self.threat is not None:
+                encoded = encode_command(command)
+                if encoded[0] == "P" and self.belief is not None:
+                    self.pings.append((sub.location, sub.sonar_range))
+                elif encoded[0] == "F" and self.threat is not None:
+                    self.shots.append(command.destination)
+            commands.append(command)
+        if commands:
+            self.socket_manager.send_messages(commands)
 
     def issue_command(self, sub):
-        """Fancy AI logic for the sub. Lifted wholesale from Dudly Jr"""
+        """Decides and sends the command for one sub"""
+        self.socket_manager.send_message(self.choose_command(sub))
+
+    def choose_command(self, sub, claimed=None):
+        """Returns the command for one sub, from the planner if it's enabled.
+        Targets in claimed are left alone, and the chosen target is added to it"""
+        if self.rollouts is not None and self.is_hard_turn(sub):
+            return self.rollout_command(sub, claimed)
+        if self.planner is not None:
+            return self.planner.choose(sub, claimed)
+        return self.heuristic_command(sub, claimed)
+
+    def is_hard_turn(self, sub):
+        """returns true if there's an enemy about, so the turn is worth rolling out"""
+        return bool(self.spotted or self.detonations or self.torpedo_hits) or \
+            (sub.torpedo_range > targeting.BLAST_RADIUS and bool(self.rank_torpedo_targets(sub)))
+
+    def rollout_command(self, sub, claimed=None):
+        """Picks the command with the best mean rollout score, falling back on the heuristic if none finished"""
+        commands = [sub.move(self.turn_number, str(direction), str(equip))
+                    for direction, _ in self.game_map.open_neighbors(sub.location)
+                    for equip in (Equipment.SONAR, Equipment.TORPEDO)]
+        if sub.sonar_range > 0:
+            commands.append(sub.ping(self.turn_number))
+        for target, _ in self.safe_torpedo_targets(sub, claimed)[:ROLLOUT_TARGETS]:
+            commands.append(sub.fire_torpedo(self.turn_number, target))
+
+        #the turn's budget is shared between our live subs
+        live = sum(1 for other in self.subs.values() if not other.dead)
+        deadline = time.monotonic() + self.rollouts.budget / max(1, live)
+        scores = self.rollouts.evaluate(GameSnapshot.from_bot(self, sub), commands, deadline)
+        if not scores:
+            return self.heuristic_command(sub, claimed)
+        command = max(scores, key=lambda candidate: scores[candidate][0])
+        if self.trace.level <= DEBUG:
+            self.trace.record(DEBUG, "rollout", "{0}", dict((str(key), value) for key, value in scores.items()))
+        kind = encode_command(command)[0]
+        if kind != "M":
+            self.destinations[sub.sub_id] = None
+        if kind == "F" and claimed is not None:
+            claimed.add(command.destination)
+        return command
+
+    def heuristic_command(self, sub, claimed=None):
+        """Fancy AI logic for the sub. Lifted wholesale from Dudly Jr.
+        Targets in claimed are left alone, and the chosen target is added to it"""
 
         #shoot things if possible
-        target = self.get_torpedo_target(sub)
+        target = self.get_torpedo_target(sub, claimed)
         if target is not None:
-            self.socket_manager.send_message(sub.fire_torpedo(self.turn_number, target))
-            self.random_destination = None
-            return
+            if claimed is not None:
+                claimed.add(target)
+            self.destinations[sub.sub_id] = None
+            return sub.fire_torpedo(self.turn_number, target)
 
         #maybe ping
-        if sub.max_sonar_charge or (not self.spotted and sub.torpedo_range >= sub.sonar_range) and sub.sonar_range > 1 + random.randint(0, 6):
-            self.socket_manager.send_message(sub.ping(self.turn_number))
-            self.random_destination = None
-            return
+        if sub.max_sonar_charge or (not self.spotted and sub.torpedo_range >= sub.sonar_range) and sub.sonar_range > self.min_ping_range + self.random.randint(0, self.ping_spread):
+            self.destinations[sub.sub_id] = None
+            return sub.ping(self.turn_number)
 
         #maybe new destination
-        if self.random_destination is None or self.random_destination == sub.location:
-            self.random_destination = self.random_square(sub.location)
-            if self.verbose:
-                print("New random destination: {0}".format(self.random_destination))
+        destination = self.destinations.get(sub.sub_id)
+        if destination is None or destination == sub.location:
+            destination = self.destinations[sub.sub_id] = self.choose_destination(sub)
+            if self.trace.level <= DEBUG:
+                self.trace.record(DEBUG, "destination", "sub {0}: {1}", sub.sub_id, destination)
 
-        charge = Equipment.SONAR if sub.max_torpedo_charge or sub.torpedo_range >= sub.sonar_range or random.randint(0, 100) < 33 else Equipment.TORPEDO
-        direction = self.get_direction_toward(sub.location, self.random_destination)
-        self.socket_manager.send_message(sub.move(self.turn_number, str(direction), str(charge)))
+        charge = Equipment.SONAR if sub.max_torpedo_charge or sub.torpedo_range >= sub.sonar_range or self.random.randint(0, 100) < self.sonar_charge_percent else Equipment.TORPEDO
+        direction = self.get_direction_toward(sub.location, destination)
+        return sub.move(self.turn_number, str(direction), str(charge))
 
     def get_direction_toward(self, start, destination):
-        """Gets the direction to get from location to destination"""
-        if start == destination or not self.game_map[start] or not self.game_map[destination]:
+        """Gets the first step of a shortest path from start to destination"""
+        if start == destination or start not in self.game_map or destination not in self.game_map:
             raise ValueError("Invalid direction coordinates {0} - {1}".format(start, destination))
 
-        directions = list()
-
-        if destination.x < start.x:
-            directions.append(Direction.WEST)
-        if destination.x > start.x:
-            directions.append(Direction.EAST)
-        if destination.y < start.y:
-            directions.append(Direction.NORTH)
-        if destination.y > start.y:
-            directions.append(Direction.SOUTH)
-
-        direction = random.choice(directions)
-        if self.game_map.get(start.shifted(direction)) and not self.game_map[start.shifted(direction)].blocked:
+        direction = self.pathfinder.next_direction(start, destination)
+        if direction is not None:
+            if self.threat is not None and not self.threat.is_quiet(start, 1):
+                return self.safer_direction(start, destination, direction)
             return direction
 
-        directions.extend(ALL_DIRECTIONS)
-        random.shuffle(directions)
-        for rand_direction in directions:
-            if self.game_map.get(start.shifted(direction)) and not self.game_map[start.shifted(rand_direction)].blocked:
-                return rand_direction
+        #destination is walled off, so wander instead
+        neighbors = self.game_map.open_neighbors(start)
+        if neighbors:
+            return self.random.choice(neighbors)[0]
 
         #in theory unreachable
         raise ValueError("yo you can't move anywhere from {0}".format(start))
 
-    def get_torpedo_target(self, sub):
-        """Get a target to shoot"""
-        if sub.torpedo_range < 2:
+    def safer_direction(self, start, destination, direction):
+        """returns direction, or the least threatened step from start that gets as much closer to
+        destination as direction does. Steps around obstacles are left to the path finder"""
+        step = start.shifted(direction)
+        distance = abs(step.x - destination.x) + abs(step.y - destination.y)
+        if distance >= abs(start.x - destination.x) + abs(start.y - destination.y):
+            return direction
+        around = self.threat.neighborhood(start, 1)
+        best, least = direction, around[1 + step.y - start.y, 1 + step.x - start.x]
+        for other, square in self.game_map.open_neighbors(start):
+            threat = around[1 + square.y - start.y, 1 + square.x - start.x]
+            if threat < least and abs(square.x - destination.x) + abs(square.y - destination.y) <= distance:
+                best, least = other, threat
+        return best
+
+    def get_torpedo_target(self, sub, claimed=None):
+        """Get a target to shoot, picking among the ones with the best expected blast value.
+        Skips claimed targets and targets whose blast would reach another of our subs"""
+        targets = self.safe_torpedo_targets(sub, claimed)
+        if not targets and self.belief is not None and sub.torpedo_range > targeting.BLAST_RADIUS:
+            #nothing in sight, so try where enemies probably are
+            field = self.reachability.field(sub.location, sub.torpedo_range)
+            targets = self.safe_torpedo_targets(sub, claimed, targeting.rank_belief_targets(
+                self.belief, field, sub.torpedo_range, BELIEF_FIRE_THRESHOLD))
+        if not targets:
             return
 
+        best_value = targets[0][1]
+        best = [coord for coord, value in targets if value == best_value]
+        if self.threat is not None and len(best) > 1:
+            #among equally good targets, go for the ones where the enemy has been most active
+            threat = self.threat.values(best).tolist()
+            most = max(threat)
+            best = [coord for coord, value in zip(best, threat) if value == most]
+        if self.trace.level <= DEBUG:
+            self.trace.record(DEBUG, "targets", "{0}", targets)
+
+        return self.random.choice(best)
+
+    def safe_torpedo_targets(self, sub, claimed=None, targets=None):
+        """Returns targets, rank_torpedo_targets by default, without claimed targets and targets whose
+        blast would reach another of our subs"""
+        if targets is None:
+            targets = self.rank_torpedo_targets(sub)
+        friends = [other.location for other in self.subs.values() if other is not sub and not other.dead]
+        if friends and self.is_sparse(self.object_index()):
+            friend_index = SpatialIndex()
+            for friend in friends:
+                friend_index.insert(friend)
+            return [(coord, value) for coord, value in targets if (not claimed or coord not in claimed) and
+                    not friend_index.any_within(coord, targeting.BLAST_RADIUS)]
+        if claimed or friends:
+            targets = [(coord, value) for coord, value in targets
+                       if (not claimed or coord not in claimed) and
+                       all(self.get_blast_distance(coord, friend) > targeting.BLAST_RADIUS for friend in friends)]
+        return targets
+
+    def rank_torpedo_targets(self, sub):
+        """Returns [(coordinate, expected blast value)] for every valid target in range, best first"""
+        if sub.torpedo_range < 2:
+            return list()
+        field = self.reachability.field(sub.location, sub.torpedo_range)
+        index = self.object_index()
+        if self.is_sparse(index):
+            return targeting.rank_indexed_targets(index, field, sub.torpedo_range)
+        return targeting.rank_torpedo_targets(self.game_map, field, sub.location, sub.torpedo_range)
+
+    def is_sparse(self, index):
+        """returns true if the map is big and the index holds few enough objects that querying it beats scanning"""
+        area = self.map_width * self.map_height
+        return area >= SPATIAL_INDEX_MIN_AREA and len(index) * SPARSE_OBJECT_RATIO < area
+
+    def object_index(self):
+        """returns a SpatialIndex of this turn's squares holding foreign objects, with
+        (foreign object size, only foreign objects there) payloads. Rebuilt when the map changes"""
+        key = (self.game_map.generation, self.game_map.dirty_count())
+        if self._object_index_key != key:
+            index = SpatialIndex()
+            cells = self.game_map.touched_cells()
+            objects, foreign = self.game_map.objects_at(cells)
+            found = foreign > 0
+            rows, cols = np.divmod(cells[found], self.map_width)
+            for row, col, size, total in zip(rows.tolist(), cols.tolist(), foreign[found].tolist(), objects[found].tolist()):
+                index.insert(Coordinate(col + 1, row + 1), (size, size == total))
+            self._object_index, self._object_index_key = index, key
+        return self._object_index
+
+    def get_torpedo_target_reference(self, sub):
+        """Lists every valid target by checking each square in range one at a time, the way
+        get_torpedo_target used to. Kept as the reference for rank_torpedo_targets. The old
+        get_torpedo_target chose uniformly among these, the new one picks among the best valued"""
+        if sub.torpedo_range < 2:
+            return list()
+
         largest_size = 1
         targets = list()
         in_range = self.squares_in_range_of(sub.location, sub.torpedo_range)
@@ -233,14 +658,7 @@ class PySub():
                 square = self.game_map[coord]
                 if square.foreign_object_size >= largest_size and square.foreign_object_size == square.object_size:
                     targets.append(coord)
-
-        if not targets:
-            return
-
-        if self.verbose:
-            print("Targets found: \n{0}".format(targets))
-
-        return random.choice(targets)
+        return targets
 
     def get_blast_distance(self, from_coord, to_coord):
         """returns a blast distance"""
@@ -251,48 +669,81 @@ class PySub():
         return max(x_diff, y_diff)
 
     def squares_in_range_of(self, location, torpedo_range):
-        """Finds all squares in range of the provided location"""
-        if not self.game_map[location]:
+        """Finds all squares in range of the provided location.
+        The result is cached by the reachability index, so don't modify it"""
+        if location not in self.game_map:
             raise ValueError("location {0} is invalid".format(location))
-        destinations = dict()
-        if torpedo_range > 0:
-            self.add_destinations(destinations, location, 1, torpedo_range)
-        return destinations
-
-    def add_destinations(self, input_destinations, coord, distance, torpedo_range):
-        """recursively finds all valid destinations from squares"""
-        next_potential_destinations = list()
-        for direction in ALL_DIRECTIONS:
-            temp_destination = coord.shifted(direction)
-            if self.game_map.get(temp_destination) and not self.game_map[temp_destination].blocked:
-                previous_distance = input_destinations.get(temp_destination)
-                if not previous_distance or distance < previous_distance:
-                    input_destinations[temp_destination] = distance
-                    if not self.game_map[temp_destination]:
-                        next_potential_destinations.append(temp_destination)
-
-        if distance < torpedo_range:
-            for potential in next_potential_destinations:
-                self.add_destinations(input_destinations, potential, distance + 1, torpedo_range)
-
+        if torpedo_range < 1:
+            return dict()
+        return self.reachability.squares_in_range(location, torpedo_range)
+
+    def choose_destination(self, sub):
+        """returns where sub should head next. With the belief it's the least crowded of a few random squares.
+        Heading for likely enemies was tried and lost more than it won"""
+        if self.belief is None:
+            return self.random_square(sub.location)
+        candidates = [self.random_square(sub.location) for _ in range(DESTINATION_CANDIDATES)]
+        danger = self.belief.box_sums(candidates, DANGER_RADIUS)
+        return candidates[int(danger.argmin())]
 
     def random_square(self, location):
-        """Get a random square on the map"""
-        while True:
-            x_val = random.randint(1, self.map_width)
-            y_val = random.randint(1, self.map_height)
-            location = Coordinate(x_val, y_val)
-            if self.game_map.get(location) and not self.game_map[location].blocked:
-                return location
+        """Get a random open square on the map other than location"""
+        return self.game_map.random_open_square(location, self.random)
+
+def turn_range(text):
+    """argparse type for --profile-turns"""
+    try:
+        return parse_turns(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def parse_args(args=None):
+    """Parses command line options. The profiling options default to their PYSUB_PROFILE_* variables"""
+    parser = argparse.ArgumentParser(description="PySub sample submarine")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print every message sent and received")
+    parser.add_argument("--profile-dir", default=os.environ.get("PYSUB_PROFILE_DIR"),
+                        help="write turn-<n>.prof and turn-<n>.folded profiles here, {0} by default".format(DEFAULT_PROFILE_DIR))
+    parser.add_argument("--profile-turns", type=turn_range, default=os.environ.get("PYSUB_PROFILE_TURNS") or None,
+                        help="profile turn N or turns FIRST-LAST")
+    parser.add_argument("--profile-threshold-ms", type=float, default=os.environ.get("PYSUB_PROFILE_THRESHOLD_MS"),
+                        help="sample any turn still deciding after this many milliseconds")
+    parser.add_argument("--profile-mode", choices=MODES, default=os.environ.get("PYSUB_PROFILE_MODE", CPROFILE),
+                        help="how --profile-turns are profiled")
+    return parser.parse_args(args)
+
 
 if __name__ == '__main__':
-    if '--help' in sys.argv or '-h' in sys.argv:
-        print("Usage will go here")
-    verbose = '--verbose' or '-v' in sys.argv
+    options = parse_args()
+    verbose = options.verbose
     if verbose:
         print("Running in verbose mode")
 
     bot = PySub(DEFAULT_USERNAME, DEFAULT_SERVER_ADDRESS, DEFAULT_SERVER_PORT, verbose)
+    if options.profile_turns or options.profile_threshold_ms is not None:
+        bot.enable_profiling(options.profile_dir or DEFAULT_PROFILE_DIR,
+                             options.profile_turns,
+                             None if options.profile_threshold_ms is None else float(options.profile_threshold_ms) / 1000,
+                             options.profile_mode)
+    if os.environ.get("PYSUB_STATS"):
+        bot.enable_stats(os.environ["PYSUB_STATS"])
+    if os.environ.get("PYSUB_SPECULATE"):
+        bot.enable_speculation()
+    if os.environ.get("PYSUB_PLANNER_BUDGET"):
+        bot.enable_planner(float(os.environ["PYSUB_PLANNER_BUDGET"]))
+    if os.environ.get("PYSUB_ROLLOUT_PROCESSES"):
+        bot.enable_rollouts(int(os.environ["PYSUB_ROLLOUT_PROCESSES"]))
+    if os.environ.get("PYSUB_TILED_MAP"):
+        bot.enable_tiled_map(os.environ["PYSUB_TILED_MAP"])
+    if os.environ.get("PYSUB_BELIEF"):
+        bot.enable_belief()
+    if os.environ.get("PYSUB_THREAT"):
+        bot.enable_threat()
+    if os.environ.get("PYSUB_TRANSCRIPT"):
+        bot.socket_manager.start_recording(os.environ["PYSUB_TRANSCRIPT"])
+    if os.environ.get("PYSUB_TRACE"):
+        bot.enable_trace(os.environ["PYSUB_TRACE"], trace_log.parse_level(os.environ.get("PYSUB_TRACE_LEVEL", "debug")),
+                         int(os.environ.get("PYSUB_TRACE_SAMPLE", "1")))
 
     try:
         bot.login()
@@ -301,5 +752,7 @@ if __name__ == '__main__':
         print("ERROR: {0}".format(error))
         print(traceback.print_exc())
     finally:
+        bot.close()
         bot.socket_manager.disconnect()
+        bot.trace.close()
 
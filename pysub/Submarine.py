@@ -2,20 +2,25 @@
 from commands import PingCommand, MoveCommand, FireCommand
 from util import Coordinate
 
+#where a sub is before the server has told us, shared since coordinates are immutable
+NOWHERE = Coordinate(0, 0)
+
 class Submarine():
     """Generic submarine"""
-    location = Coordinate(0, 0)
-    dead = False
-    active = True
-    max_sonar_charge = False
-    max_torpedo_charge = False
-    size = 100
-    shield_count = 3
-    sonar_range = 0
-    torpedo_range = 0
+    __slots__ = ('sub_id', 'location', 'dead', 'active', 'max_sonar_charge', 'max_torpedo_charge', 'size',
+                 'shield_count', 'sonar_range', 'torpedo_range')
 
     def __init__(self, sub_id):
         self.sub_id = sub_id
+        self.location = NOWHERE
+        self.dead = False
+        self.active = True
+        self.max_sonar_charge = False
+        self.max_torpedo_charge = False
+        self.size = 100
+        self.shield_count = 3
+        self.sonar_range = 0
+        self.torpedo_range = 0
 
     def update(self, info_message):
         """updates this sub's attributes based on a SubmarineInfoMessage"""
@@ -23,6 +23,14 @@ class Equipment(Enum):
     def __str__(self):
         return self.value
 
+#(x, y) step for each direction, so shifting is one lookup instead of an if-chain
+DIRECTION_DELTAS = {
+    Direction.NORTH: (0, -1),
+    Direction.EAST: (1, 0),
+    Direction.SOUTH: (0, 1),
+    Direction.WEST: (-1, 0),
+}
+
 class Coordinate(namedtuple('Coordinate', ['x', 'y'])):
     """Represents a map coordinate"""
     __slots__ = ()
@@ -30,14 +38,10 @@ class Coordinate(namedtuple('Coordinate', ['x', 'y'])):
         return "{0}|{1}".format(self.x, self.y)
     def shifted(self, direction):
         """Returns a new coordinate shifted in the given direction"""
-        if direction == Direction.NORTH:
-            return Coordinate(self.x, (self.y-1))
-        elif direction == Direction.EAST:
-            return Coordinate((self.x+1), self.y)
-        elif direction == Direction.SOUTH:
-            return Coordinate(self.x, (self.y + 1))
-        elif direction == Direction.WEST:
-            return Coordinate((self.x-1), self.y)
+        delta = DIRECTION_DELTAS.get(direction)
+        if delta is None:
+            return None
+        return Coordinate(self.x + delta[0], self.y + delta[1])
 
 class MapSquare(Coordinate):
     """Represents a square on the map"""
@@ -0,0 +1,78 @@
+"""Asyncio version of the PySub login/play loop so one process can drive many bots"""
+import asyncio
+import sys
+import traceback
+import server_message
+from async_socket_manager import AsyncSocketManager, BufferedLines
+from PySub import PySub, DEFAULT_USERNAME, DEFAULT_SERVER_ADDRESS, DEFAULT_SERVER_PORT
+
+
+class AsyncPySub(PySub):
+    """PySub driven by an asyncio event loop. Strategy hooks are shared with PySub"""
+
+    def __init__(self, username, server_address, server_port, verbose):
+        super(AsyncPySub, self).__init__(username, server_address, server_port, verbose,
+                                         AsyncSocketManager(server_address, server_port, verbose))
+
+    async def receive_with_followers(self, count_index):
+        """Receives a message plus the follow-up lines whose count is in part count_index"""
+        message = await self.socket_manager.receive_message()
+        parts = message.split("|")
+        count = int(parts[count_index]) if len(parts) > count_index and parts[count_index].isdigit() else 0
+        followers = [await self.socket_manager.receive_message() for _ in range(count)]
+        return message, BufferedLines(followers)
+
+    async def login(self):
+        """Logs in to server"""
+        await self.socket_manager.connect()
+        message, settings = await self.receive_with_followers(5)
+        self.configure(server_message.GameConfigMessage(message, settings))
+
+        self.socket_manager.send_message(self.join_message())
+        await self.socket_manager.drain()
+
+        response = await self.socket_manager.receive_message()
+        if response != "J|{0}".format(self.username):
+            raise IOError("Failed to join. Server response: {0}.".format(response))
+
+    async def play(self):
+        """Receives and handles messages"""
+        message = await self.socket_manager.receive_message()
+        while message is not None:
+            if message.startswith("F|"): #game finished
+                parts = message.split("|")
+                count = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 0
+                results = [await self.socket_manager.receive_message() for _ in range(count)]
+                self.handle_game_finished_message(server_message.GameFinishedMessage(message, BufferedLines(results)))
+                break
+            elif not self.handle_turn_message(message):
+                break
+            await self.socket_manager.drain()
+            message = await self.socket_manager.receive_message()
+
+    async def run(self):
+        """Logs in, plays a game and disconnects, reporting errors the same way PySub.py does.
+        Background workers are stopped however the game ends, cancellation included"""
+        try:
+            await self.login()
+            await self.play()
+        except (ValueError, RuntimeError, IOError) as error:
+            print("ERROR: {0}: {1}".format(self.username, error))
+            traceback.print_exc()
+        finally:
+            try:
+                self.close()
+            finally:
+                await self.socket_manager.disconnect()
+
+
+async def run_bots(bots):
+    """Runs every bot concurrently on the current event loop"""
+    await asyncio.gather(*(bot.run() for bot in bots))
+
+
+if __name__ == '__main__':
+    bot_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    bots = [AsyncPySub("{0}{1}".format(DEFAULT_USERNAME, idx), DEFAULT_SERVER_ADDRESS, DEFAULT_SERVER_PORT, False)
+            for idx in range(bot_count)]
+    asyncio.run(run_bots(bots))
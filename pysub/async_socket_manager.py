@@ -0,0 +1,102 @@
+"""Module to handle asyncio socket connections and messaging"""
+import asyncio
+from socket_manager import encode_messages
+from trace_log import TraceLog, DISABLED, DEBUG
+
+STREAM_LIMIT = 65536
+
+class AsyncSocketManager():
+    """Handles a socket connection on an asyncio event loop"""
+    reader = None
+    writer = None
+
+    def __init__(self, server_address, server_port, verbose, trace=None):
+        self.server_address = server_address
+        self.server_port = server_port
+        self.verbose = verbose
+        if trace is None:
+            trace = TraceLog.console() if verbose else DISABLED
+        self.trace = trace
+
+    def is_connected(self):
+        """Returns true if currently connected to a socket"""
+        return self.writer is not None
+
+    async def connect(self):
+        """Connects to the socket"""
+        if self.is_connected():
+            raise IOError("Already Connected")
+        if not self.server_address.strip():
+            raise ValueError("Empty server address")
+        if self.server_port < 1:
+            raise ValueError("Invalid server port: {0}".format(self.server_port))
+
+        self.reader, self.writer = await asyncio.open_connection(
+            self.server_address, self.server_port, limit=STREAM_LIMIT)
+
+    async def disconnect(self):
+        """Disconnects and closes the socket"""
+        if self.writer is not None:
+            writer = self.writer
+            self.reader = None
+            self.writer = None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    def send_message(self, message):
+        """Queues a message on the stream. Call drain() to wait for it to be flushed.
+
+        This stays synchronous so the existing handle_*_message and issue_command code,
+        which calls send_message directly, works unchanged."""
+        self.send_messages((message,))
+
+    def send_messages(self, messages):
+        """Queues several messages as a single write"""
+        byte_message = encode_messages(messages)
+        if self.is_connected():
+            if self.trace.level <= DEBUG:
+                self.trace.record(DEBUG, "send", "{0}", byte_message.decode('utf-8').rstrip("\n"))
+            self.writer.write(byte_message)
+        else:
+            raise IOError("Not Connected")
+
+    async def drain(self):
+        """Waits until queued messages have been handed to the transport"""
+        if self.is_connected():
+            await self.writer.drain()
+
+    async def receive_message(self):
+        """Receives a message via socket"""
+        if self.is_connected():
+            #readline hands back the partial remainder (or b'') once the connection closes
+            message = (await self.reader.readline()).decode('utf-8').strip()
+            if self.trace.level <= DEBUG:
+                self.trace.record(DEBUG, "recv", message)
+            return message
+        else:
+            raise IOError("Not Connected")
+
+    async def receive_messages(self, count):
+        """Yields the next count messages"""
+        for _ in range(count):
+            yield await self.receive_message()
+
+
+class BufferedLines():
+    """Serves lines that were already received to message classes that pull follow-up lines,
+    like GameConfigMessage and GameFinishedMessage"""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.position = 0
+
+    def receive_message(self):
+        """Returns the next buffered line"""
+        if self.position >= len(self.lines):
+            raise IOError("No more buffered messages")
+        message = self.lines[self.position]
+        self.position += 1
+        return message
@@ -0,0 +1,351 @@
+"""Microbenchmarks for the client hot paths.
+
+Measures socket framing, message parsing, map construction, the per-turn reset and belief
+update, torpedo range search, target selection and pathfinding across map sizes, obstacle
+densities and torpedo ranges, plus the memory held per message, command and sub and how much
+the heap grows per game. Results are written as JSON and can be compared against a stored baseline:
+
+    python benchmark.py --output baseline.json
+    python benchmark.py --baseline baseline.json --threshold 0.25
+
+The exit status is 1 if any benchmark got slower than the baseline by more than the threshold.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import platform
+import random
+import socket
+import sys
+import threading
+import time
+import tracemalloc
+import numpy as np
+import server_message
+from message_parser import MessageParser, GameConfig, GameSetting, SAMPLE_TURN
+from occupancy import OccupancyBelief
+from socket_manager import SocketManager
+from submarine import Submarine
+from commands import PingCommand, MoveCommand, FireCommand
+from util import Coordinate
+from PySub import PySub
+
+MAP_SIZES = (20, 200, 2000)
+QUICK_MAP_SIZES = (20, 200)
+DENSITIES = (0.0, 0.1, 0.3)
+TORPEDO_RANGES = (2, 6, 12)
+MIN_SAMPLE_SECONDS = 0.05
+REPEATS = 3
+#squares a typical turn's sonar, detonation and info messages touch
+TOUCHED_SQUARES = 16
+#objects built per allocation sample, and games and turns played to measure per game growth
+MEMORY_SAMPLES = 2000
+MEMORY_GAME_SIZE = 20
+MEMORY_TURNS = 100
+
+
+def measure(function, setup=None, max_calls=100000):
+    """Returns the best seconds per call of function over REPEATS samples.
+
+    Each sample makes enough calls to last MIN_SAMPLE_SECONDS. setup, if given, runs before
+    every call and is not timed."""
+    clock = time.perf_counter
+    best = None
+    calls = 1
+    for _ in range(REPEATS):
+        while True:
+            elapsed = 0.0
+            for _ in range(calls):
+                if setup is not None:
+                    setup()
+                start = clock()
+                function()
+                elapsed += clock() - start
+            if elapsed >= MIN_SAMPLE_SECONDS or calls >= max_calls:
+                break
+            calls = min(max_calls, calls * 4)
+        per_call = elapsed / calls
+        best = per_call if best is None else min(best, per_call)
+    return best
+
+
+def allocated(build):
+    """Returns the traced bytes held per object by a list of MEMORY_SAMPLES objects from build"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        held = [build() for _ in range(MEMORY_SAMPLES)]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    #the list holding them isn't part of the objects
+    return max(0, after - before - sys.getsizeof(held)) / len(held)
+
+
+def config_message(size, density, seed=0):
+    """returns a GameConfig record for a square map with obstacles at the given density"""
+    rng = np.random.default_rng(seed)
+    cells = rng.choice(size * size, int(size * size * density), replace=False)
+    settings = [GameSetting("Obstacle", [str(cell % size + 1), str(cell // size + 1)]) for cell in cells.tolist()]
+    return GameConfig("bench", "Benchmark", size, size, len(settings), settings)
+
+
+def quietly(function, *args):
+    """calls function with stdout discarded"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args)
+
+
+class DiscardingSocketManager(SocketManager):
+    """SocketManager that drops whatever is sent instead of needing a connection"""
+
+    def send_messages(self, messages):
+        pass
+
+
+class BenchmarkBot(PySub):
+    """PySub that never touches the network"""
+
+    def __init__(self):
+        super(BenchmarkBot, self).__init__("bench", "localhost", 1, False, DiscardingSocketManager("localhost", 1, False))
+
+
+def make_bot(size, density, seed=0):
+    """returns a configured bot with a few foreign objects on the map"""
+    bot = BenchmarkBot()
+    quietly(bot.configure, config_message(size, density, seed))
+    random.seed(seed)
+    bot.my_sub.location = bot.random_square(None)
+    for _ in range(max(4, size * size // 400)):
+        square = bot.game_map[bot.random_square(None)]
+        square.object_size += 100
+        square.foreign_object_size += 100
+    return bot
+
+
+def bench_framing(results, quick):
+    """SocketManager.receive_message over a local socket pair"""
+    lines = ("\n".join(SAMPLE_TURN) + "\n").encode('utf-8')
+    batches = 200 if quick else 2000
+    payload = lines * batches
+    count = len(SAMPLE_TURN) * batches
+
+    def run():
+        reader, writer = socket.socketpair()
+        manager = SocketManager("localhost", 1, False)
+        manager.socket = reader
+        sender = threading.Thread(target=writer.sendall, args=(payload,))
+        sender.start()
+        for _ in range(count):
+            manager.receive_message()
+        sender.join()
+        reader.close()
+        writer.close()
+
+    seconds = measure(run, max_calls=20)
+    results.append(result("receive_message", {"messages": count}, seconds / count))
+
+
+def bench_parsing(results, quick):
+    """server_message classes against MessageParser, per message type"""
+    classes = {
+        "B": server_message.BeginTurnMessage,
+        "S": server_message.SonarDetectionMessage,
+        "D": server_message.DetonationMessage,
+        "T": server_message.TorpedoHitMessage,
+        "O": server_message.DiscoveredObjectMessage,
+        "I": server_message.SubmarineInfoMessage,
+        "H": server_message.PlayerScoreMessage,
+    }
+    parser = MessageParser()
+    samples = dict((line[0], line) for line in SAMPLE_TURN)
+    for kind, line in samples.items():
+        results.append(result("parse_server_message", {"type": kind}, measure(lambda: classes[kind](line))))
+        results.append(result("parse_message_parser", {"type": kind}, measure(lambda: parser.parse(line))))
+
+
+def bench_map(results, sizes):
+    """configure, the per-turn reset, the occupancy belief update, squares_in_range_of, get_torpedo_target and get_direction_toward"""
+    for size in sizes:
+        for density in DENSITIES:
+            params = {"size": size, "density": density}
+            message = config_message(size, density)
+            bot = BenchmarkBot()
+            results.append(result("configure", params, measure(lambda: quietly(bot.configure, message), max_calls=50)))
+
+            bot = make_bot(size, density)
+            touched = [bot.random_square(None) for _ in range(TOUCHED_SQUARES)]
+
+            def touch():
+                for coord in touched:
+                    bot.game_map.add_object(coord, 100, 100)
+            results.append(result("turn_reset", params, measure(bot.game_map.reset, setup=touch)))
+            results.append(result("turn_reset_full", params, measure(lambda: bot.game_map.reset(full=True))))
+            belief = OccupancyBelief(bot.game_map)
+            results.append(result("belief_update", params, measure(lambda: belief.update(touched, (), (), ()))))
+
+            bot = make_bot(size, density)
+            origins = [bot.random_square(None) for _ in range(64)]
+            for torpedo_range in TORPEDO_RANGES:
+                ranged = dict(params, range=torpedo_range)
+                cycle = itertools.cycle(origins)
+                results.append(result("squares_in_range_of_cold", ranged, measure(
+                    lambda: bot.squares_in_range_of(next(cycle), torpedo_range), setup=bot.reachability.clear)))
+                results.append(result("squares_in_range_of_warm", ranged, measure(
+                    lambda: bot.squares_in_range_of(origins[0], torpedo_range))))
+
+                sub = Submarine(0)
+                sub.location = origins[0]
+                sub.torpedo_range = torpedo_range
+                results.append(result("get_torpedo_target", ranged, measure(lambda: bot.get_torpedo_target(sub))))
+
+            pairs = [(bot.random_square(None), bot.random_square(None)) for _ in range(64)]
+            #walled in squares have no move to make at all
+            pairs = [(start, end) for start, end in pairs if start != end and bot.game_map.open_neighbors(start)]
+            cycle = itertools.cycle(pairs)
+            results.append(result("get_direction_toward", params, measure(
+                lambda: bot.get_direction_toward(*next(cycle)), max_calls=2000)))
+
+
+def play_game(bot, turns):
+    """configures bot for a small game and feeds it turns of sample results"""
+    quietly(bot.configure, config_message(MEMORY_GAME_SIZE, 0.1))
+    bot.join_message()
+    for turn in range(1, turns + 1):
+        for line in SAMPLE_TURN:
+            parts = line.split("|")
+            parts[1] = str(turn)
+            bot.handle_turn_message("|".join(parts))
+
+
+def bench_memory(results, quick):
+    """bytes held per server message, parsed record, command and sub, and heap growth per game"""
+    classes = {
+        "B": server_message.BeginTurnMessage,
+        "S": server_message.SonarDetectionMessage,
+        "D": server_message.DetonationMessage,
+        "T": server_message.TorpedoHitMessage,
+        "O": server_message.DiscoveredObjectMessage,
+        "I": server_message.SubmarineInfoMessage,
+        "H": server_message.PlayerScoreMessage,
+    }
+    parser = MessageParser()
+    samples = dict((line[0], line) for line in SAMPLE_TURN)
+    for kind, line in samples.items():
+        results.append(memory_result("server_message_bytes", {"type": kind}, allocated(lambda: classes[kind](line))))
+        results.append(memory_result("message_parser_bytes", {"type": kind}, allocated(lambda: parser.parse(line))))
+    target = Coordinate(3, 4)
+    for name, build in (("P", lambda: PingCommand(42, 0)), ("M", lambda: MoveCommand(42, 0, "N", "Sonar")),
+                        ("F", lambda: FireCommand(42, 0, target))):
+        results.append(memory_result("command_bytes", {"type": name}, allocated(build)))
+    results.append(memory_result("submarine_bytes", {}, allocated(lambda: Submarine(0))))
+
+    #the first game warms caches and interned objects, so growth is measured after it
+    games = 3 if quick else 10
+    bot = BenchmarkBot()
+    tracemalloc.start()
+    try:
+        play_game(bot, MEMORY_TURNS)
+        first = tracemalloc.get_traced_memory()[0]
+        for _ in range(games - 1):
+            play_game(bot, MEMORY_TURNS)
+        last = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    params = {"size": MEMORY_GAME_SIZE, "turns": MEMORY_TURNS}
+    results.append(memory_result("game_bytes", params, first))
+    results.append(memory_result("growth_per_game_bytes", params, (last - first) / (games - 1)))
+
+
+def result(name, params, seconds):
+    """returns one benchmark result"""
+    return {"name": name, "params": params, "seconds_per_call": seconds}
+
+
+def memory_result(name, params, size):
+    """returns one memory result"""
+    return {"name": name, "params": params, "bytes": size}
+
+
+def measured(entry):
+    """returns the seconds or bytes a result measured"""
+    return entry["seconds_per_call"] if "seconds_per_call" in entry else entry["bytes"]
+
+
+def describe(value, in_bytes):
+    """returns a measured value formatted for printing"""
+    if in_bytes:
+        return "{0:12.1f} B".format(value)
+    return "{0:12.3f} us".format(value * 1e6)
+
+
+def result_key(entry):
+    """returns the key matching a result to its baseline"""
+    return "{0}[{1}]".format(entry["name"], ",".join(
+        "{0}={1}".format(key, value) for key, value in sorted(entry["params"].items())))
+
+
+def compare(results, baseline, threshold):
+    """returns [(key, baseline value, current value, true if bytes)] for results slower or bigger than
+    baseline by threshold"""
+    previous = dict((result_key(entry), measured(entry)) for entry in baseline["results"])
+    regressions = list()
+    for entry in results:
+        before = previous.get(result_key(entry))
+        if before and measured(entry) > before * (1 + threshold):
+            regressions.append((result_key(entry), before, measured(entry), "bytes" in entry))
+    return regressions
+
+
+def run(quick=False, only=None):
+    """runs the suite and returns the results document"""
+    sizes = QUICK_MAP_SIZES if quick else MAP_SIZES
+    suites = {
+        "framing": lambda results: bench_framing(results, quick),
+        "parsing": lambda results: bench_parsing(results, quick),
+        "map": lambda results: bench_map(results, sizes),
+        "memory": lambda results: bench_memory(results, quick),
+    }
+    results = list()
+    for name, suite in suites.items():
+        if only is None or name in only:
+            suite(results)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def main(args=None):
+    """command line entry point"""
+    parser = argparse.ArgumentParser(description="PySub hot path benchmarks")
+    parser.add_argument("--quick", action="store_true", help="skip the 2000x2000 maps")
+    parser.add_argument("--only", nargs="+", choices=("framing", "parsing", "map", "memory"))
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against results previously written with --output")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 is 25%%")
+    options = parser.parse_args(args)
+
+    document = run(options.quick, options.only)
+    for entry in document["results"]:
+        print("{0:70} {1}".format(result_key(entry), describe(measured(entry), "bytes" in entry)))
+    if options.output:
+        with open(options.output, "w") as output:
+            json.dump(document, output, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            regressions = compare(document["results"], json.load(baseline), options.threshold)
+        for key, before, after, in_bytes in regressions:
+            print("REGRESSION {0}: {1} -> {2}".format(key, describe(before, in_bytes), describe(after, in_bytes)))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""Grid backed game map.
+
+The map is stored as a struct of NumPy arrays indexed [y - 1, x - 1] instead of one MapSquare
+object per cell. game_map[coord] and game_map.get(coord) still hand back square-like views so
+strategy code written against the old dict of MapSquares keeps working.
+
+Squares whose object layers change are remembered so the per-turn reset only clears those.
+Write through the square views or add_object; code writing to the arrays directly should call
+mark_dirty, or reset(full=True).
+
+Hot loops get their coordinates from coordinate(), which interns one Coordinate per square, and
+step around the map with open_neighbors(), a per-square table of the open squares next door.
+Both are filled lazily, since most games only ever visit a small part of a big map, and the
+neighbour table is dropped whenever an obstacle changes. Either table is emptied once it holds
+cache_limit squares, which a whole-map GameMap never reaches but a TiledMap does.
+"""
+import random
+import numpy as np
+from util import Coordinate, DIRECTION_DELTAS
+
+DIRTY_FILL_RATIO = 64
+
+
+class GameMap():
+    """Struct of arrays game map with blocked, object_size and foreign_object_size layers"""
+
+    def __init__(self, width, height):
+        if width < 1 or height < 1:
+            raise ValueError("Invalid map size {0}x{1}".format(width, height))
+        self.width = width
+        self.height = height
+        self._create_layers()
+        #bumped whenever an obstacle changes so derived data knows to rebuild
+        self.obstacle_version = 0
+        #flat indices of squares whose object layers changed since the last reset
+        self._dirty = list()
+        #bumped by every reset, so (generation, dirty_count()) identifies the object layers' state
+        self.generation = 0
+        #interned coordinates and open neighbour tuples, keyed by flat index
+        self._coordinates = dict()
+        self._neighbors = dict()
+        self.cache_limit = width * height
+        self._open_cells = None
+        self._neighbors_version = 0
+
+    def _create_layers(self):
+        self.blocked = np.zeros((self.height, self.width), dtype=bool)
+        self.object_size = np.zeros((self.height, self.width), dtype=np.int32)
+        self.foreign_object_size = np.zeros((self.height, self.width), dtype=np.int32)
+        self._object_flat = self.object_size.reshape(-1)
+        self._foreign_flat = self.foreign_object_size.reshape(-1)
+
+    def __len__(self):
+        return self.width * self.height
+
+    def __contains__(self, coord):
+        return 1 <= coord[0] <= self.width and 1 <= coord[1] <= self.height
+
+    def __iter__(self):
+        for y_val in range(1, self.height + 1):
+            for x_val in range(1, self.width + 1):
+                yield Coordinate(x_val, y_val)
+
+    def __getitem__(self, coord):
+        if coord not in self:
+            raise KeyError(coord)
+        return GridSquare(self, coord[0], coord[1])
+
+    def get(self, coord, default=None):
+        """returns a view of the square at coord, or default if it's off the map"""
+        if coord not in self:
+            return default
+        return GridSquare(self, coord[0], coord[1])
+
+    def keys(self):
+        """returns every coordinate on the map"""
+        return iter(self)
+
+    def values(self):
+        """returns a view of every square on the map"""
+        return (GridSquare(self, coord.x, coord.y) for coord in self)
+
+    def items(self):
+        """returns (coordinate, square view) pairs for every square on the map"""
+        return ((coord, GridSquare(self, coord.x, coord.y)) for coord in self)
+
+    def is_open(self, coord):
+        """returns true if coord is on the map and not blocked"""
+        return coord in self and not self.blocked[coord[1] - 1, coord[0] - 1]
+
+    def coordinate(self, x, y):
+        """returns the shared Coordinate for the on-map square x, y"""
+        cell = (y - 1) * self.width + x - 1
+        coord = self._coordinates.get(cell)
+        if coord is None:
+            if len(self._coordinates) >= self.cache_limit:
+                self._coordinates.clear()
+            coord = self._coordinates[cell] = Coordinate(x, y)
+        return coord
+
+    def _check_obstacles(self):
+        if self._neighbors_version != self.obstacle_version:
+            self._neighbors_version = self.obstacle_version
+            self._neighbors.clear()
+            self._open_cells = None
+
+    def open_neighbors(self, coord):
+        """returns ((direction, coordinate), ...) for the open squares next to the on-map square coord"""
+        self._check_obstacles()
+        x, y = coord[0], coord[1]
+        cell = (y - 1) * self.width + x - 1
+        neighbors = self._neighbors.get(cell)
+        if neighbors is None:
+            if len(self._neighbors) >= self.cache_limit:
+                self._neighbors.clear()
+            neighbors = self._neighbors[cell] = tuple(
+                (direction, self.coordinate(x + dx, y + dy)) for direction, (dx, dy) in DIRECTION_DELTAS.items()
+                if 1 <= x + dx <= self.width and 1 <= y + dy <= self.height and not self.blocked[y + dy - 1, x + dx - 1])
+        return neighbors
+
+    def open_cells(self):
+        """returns the flat indices, row * width + column, of every open square"""
+        self._check_obstacles()
+        if self._open_cells is None:
+            self._open_cells = np.flatnonzero(~self.blocked.reshape(-1)).astype(np.int32)
+        return self._open_cells
+
+    def open_count(self):
+        """returns how many squares are open"""
+        return len(self.open_cells())
+
+    def random_open_square(self, exclude=None, rng=random):
+        """returns a random open square other than exclude, drawn from rng"""
+        cells = self.open_cells()
+        if len(cells) == 0 or (len(cells) == 1 and exclude is not None and self.is_open(exclude)):
+            raise ValueError("No open square to pick other than {0}".format(exclude))
+        while True:
+            row, col = divmod(int(cells[rng.randrange(len(cells))]), self.width)
+            square = self.coordinate(col + 1, row + 1)
+            if square != exclude:
+                return square
+
+    def padded_passable(self):
+        """returns the open squares as bytes over the map padded with a blocked border, so square
+        x, y is byte y * (width + 2) + x"""
+        return np.pad(~self.blocked, 1, constant_values=False).view(np.uint8).tobytes()
+
+    def objects_at(self, cells):
+        """returns (object sizes, foreign object sizes) arrays at flat indices, row * width + column"""
+        return self._object_flat[cells], self._foreign_flat[cells]
+
+    def prefetch(self, location, radius):
+        """Hints that the squares within radius of location are about to be read. The whole map is
+        in memory, so there's nothing to do"""
+
+    def close(self):
+        """Releases the map's storage. Nothing to release for an in-memory map"""
+
+    def set_blocked(self, coord, blocked=True):
+        """marks the square at coord as blocked or not"""
+        if coord not in self:
+            raise KeyError(coord)
+        self.blocked[coord[1] - 1, coord[0] - 1] = blocked
+        self.obstacle_version += 1
+
+    def add_object(self, coord, size, foreign_size):
+        """adds to the object layers of the square at coord"""
+        row, col = coord[1] - 1, coord[0] - 1
+        self.object_size[row, col] += size
+        self.foreign_object_size[row, col] += foreign_size
+        self._dirty.append(row * self.width + col)
+
+    def mark_dirty(self, x, y):
+        """remembers that the object layers at x, y changed"""
+        self._dirty.append((y - 1) * self.width + x - 1)
+
+    def dirty_count(self):
+        """returns how many square updates the next reset has to undo"""
+        return len(self._dirty)
+
+    def touched_cells(self):
+        """returns the flat indices, row * width + column, of the squares touched since the last reset"""
+        return np.unique(np.fromiter(self._dirty, np.intp, len(self._dirty)))
+
+    def reset(self, full=False):
+        """Clears the per-turn object layers, touching only the squares that changed"""
+        dirty = self._dirty
+        #filling is so cheap per square that it wins unless the dirty set is a small fraction
+        if full or len(dirty) * DIRTY_FILL_RATIO > len(self._object_flat):
+            self.object_size.fill(0)
+            self.foreign_object_size.fill(0)
+        elif dirty:
+            cells = np.fromiter(dirty, np.intp, len(dirty))
+            self._object_flat[cells] = 0
+            self._foreign_flat[cells] = 0
+        dirty.clear()
+        self.generation += 1
+
+
+class GridSquare():
+    """View of one square of a GameMap that behaves like a MapSquare"""
+    __slots__ = ('game_map', 'x', 'y')
+
+    def __init__(self, game_map, x, y):
+        self.game_map = game_map
+        self.x = x
+        self.y = y
+
+    def __repr__(self):
+        return "GridSquare(x={0}, y={1})".format(self.x, self.y)
+
+    def __str__(self):
+        return "{0}|{1}".format(self.x, self.y)
+
+    @property
+    def coordinate(self):
+        """returns the Coordinate of this square"""
+        return Coordinate(self.x, self.y)
+
+    @property
+    def blocked(self):
+        """true if the square holds an obstacle"""
+        return bool(self.game_map.blocked[self.y - 1, self.x - 1])
+
+    @blocked.setter
+    def blocked(self, value):
+        self.game_map.set_blocked((self.x, self.y), value)
+
+    @property
+    def object_size(self):
+        """total size of the objects seen on this square this turn"""
+        return int(self.game_map.object_size[self.y - 1, self.x - 1])
+
+    @object_size.setter
+    def object_size(self, value):
+        self.game_map.object_size[self.y - 1, self.x - 1] = value
+        self.game_map.mark_dirty(self.x, self.y)
+
+    @property
+    def foreign_object_size(self):
+        """size of the objects seen on this square that aren't ours"""
+        return int(self.game_map.foreign_object_size[self.y - 1, self.x - 1])
+
+    @foreign_object_size.setter
+    def foreign_object_size(self, value):
+        self.game_map.foreign_object_size[self.y - 1, self.x - 1] = value
+        self.game_map.mark_dirty(self.x, self.y)
+
+    def is_empty(self):
+        """Returns true if the map square has no obstacle and is not occupied"""
+        return not self.blocked and self.object_size == 0
+
+    def reset(self):
+        """Resets the map square so it can be updated later"""
+        self.object_size = 0
+        self.foreign_object_size = 0
@@ -0,0 +1,262 @@
+"""A small, deterministic stand-in for the game server rules.
+
+The simulation speaks the same line protocol PySub and server_message understand but knows
+nothing about sockets, so it can sit behind local_server or be driven in-process.
+
+Rules in a nutshell:
+    * Subs move one square per turn N/E/S/W. Moving off the map or into an obstacle is a no-op.
+    * Moving charges one piece of equipment, sleeping charges two. Charge equals range.
+    * Pinging reports every object within Chebyshev sonar range to the pinger (O messages)
+      and tells everyone else where the ping happened (S messages). Sonar charge resets.
+    * Torpedos travel at most torpedo range squares around obstacles and detonate with a
+      Chebyshev blast radius of 1: 2 damage at the centre, 1 damage around it (D and T messages).
+      Torpedo charge resets.
+    * Damage comes off shields. A sub with negative shields is dead.
+    * Players score one point per point of damage dealt to other players' subs.
+    * The game ends after max_turns or once at most one player has a live sub.
+"""
+import random
+from collections import deque
+from util import Coordinate, Direction
+
+SERVER_VERSION = "PySub-Local-1.0"
+MAX_SONAR_RANGE = 8
+MAX_TORPEDO_RANGE = 8
+SUB_SIZE = 100
+START_SHIELDS = 3
+START_TORPEDOS = 10
+BLAST_RADIUS = 1
+DIRECT_HIT_DAMAGE = 2
+NEAR_MISS_DAMAGE = 1
+SONAR = "Sonar"
+TORPEDO = "Torpedo"
+
+
+def chebyshev(from_coord, to_coord):
+    """returns the Chebyshev (blast) distance between two coordinates"""
+    return max(abs(from_coord.x - to_coord.x), abs(from_coord.y - to_coord.y))
+
+
+class SimulatedSub():
+    """Server side state of one submarine"""
+
+    def __init__(self, sub_id, location):
+        self.sub_id = sub_id
+        self.location = location
+        self.size = SUB_SIZE
+        self.shield_count = START_SHIELDS
+        self.torpedo_count = START_TORPEDOS
+        self.sonar_range = 0
+        self.torpedo_range = 0
+        self.reactor_damage = 0
+        self.dead = False
+
+    def charge(self, equip):
+        """charges the named equipment by one"""
+        if equip == SONAR:
+            self.sonar_range = min(MAX_SONAR_RANGE, self.sonar_range + 1)
+        elif equip == TORPEDO:
+            self.torpedo_range = min(MAX_TORPEDO_RANGE, self.torpedo_range + 1)
+
+    def info_line(self, turn_number):
+        """returns the I message describing this sub"""
+        line = "I|{0}|{1}|{2}|{3}|{4}|shields={5}|size={6}|torpedos={7}|sonar_range={8}|" \
+            "torpedo_range={9}|reactor_damage={10}|dead={11}".format(
+                turn_number, self.sub_id, self.location.x, self.location.y, 0 if self.dead else 1,
+                self.shield_count, self.size, self.torpedo_count, self.sonar_range,
+                self.torpedo_range, self.reactor_damage, 1 if self.dead else 0)
+        #flags are only sent while set, clients treat any value as true
+        if self.sonar_range >= MAX_SONAR_RANGE:
+            line += "|max_sonar=true"
+        if self.torpedo_range >= MAX_TORPEDO_RANGE:
+            line += "|max_torpedo=true"
+        return line
+
+
+class SimulatedPlayer():
+    """A player and their subs"""
+
+    def __init__(self, name, subs):
+        self.name = name
+        self.subs = subs
+        self.score = 0
+
+    def is_alive(self):
+        """returns true if any of this player's subs are still alive"""
+        return any(not sub.dead for sub in self.subs)
+
+
+class GameSimulation():
+    """Seedable game rules engine producing server protocol lines"""
+
+    def __init__(self, map_width=20, map_height=20, obstacle_density=0.05, seed=None,
+                 max_turns=200, title="Local Game", subs_per_player=1):
+        if map_width < 1 or map_height < 1:
+            raise ValueError("Invalid map size {0}x{1}".format(map_width, map_height))
+        if not 0 <= obstacle_density < 1:
+            raise ValueError("Invalid obstacle density {0}, expected at least 0 and below 1".format(obstacle_density))
+        self.map_width = map_width
+        self.map_height = map_height
+        self.max_turns = max_turns
+        self.title = title
+        self.subs_per_player = subs_per_player
+        self.random = random.Random(seed)
+        self.turn_number = 0
+        self.players = list()
+        self.obstacles = set()
+        #leave every sub of a player a square of its own
+        obstacle_count = min(int(map_width * map_height * obstacle_density),
+                             max(0, map_width * map_height - subs_per_player))
+        while len(self.obstacles) < obstacle_count:
+            self.obstacles.add(Coordinate(self.random.randint(1, map_width), self.random.randint(1, map_height)))
+
+    def config_lines(self):
+        """returns the C message and its V settings"""
+        settings = ["V|Obstacle|{0}".format(coord) for coord in sorted(self.obstacles)]
+        if self.subs_per_player != 1:
+            settings.insert(0, "V|SubsPerPlayer|{0}".format(self.subs_per_player))
+        return ["C|{0}|{1}|{2}|{3}|{4}".format(SERVER_VERSION, self.title, self.map_width,
+                                              self.map_height, len(settings))] + settings
+
+    def is_open(self, coord):
+        """returns true if the coordinate is on the map and not an obstacle"""
+        return 1 <= coord.x <= self.map_width and 1 <= coord.y <= self.map_height \
+            and coord not in self.obstacles
+
+    def random_open_square(self):
+        """returns a random square a sub could occupy"""
+        while True:
+            coord = Coordinate(self.random.randint(1, self.map_width), self.random.randint(1, self.map_height))
+            if self.is_open(coord):
+                return coord
+
+    def join(self, message):
+        """Adds a player from a J|name|x|y[|x|y...] message and returns (player, response)"""
+        parts = message.strip().split("|")
+        if len(parts) < 2 or parts[0] != "J" or not parts[1]:
+            raise ValueError("Invalid join message: {0}".format(message))
+        subs = list()
+        for sub_id in range(self.subs_per_player):
+            location = None
+            x_idx = 2 + 2 * sub_id
+            if len(parts) > x_idx + 1 and parts[x_idx].isdigit() and parts[x_idx + 1].isdigit():
+                location = Coordinate(int(parts[x_idx]), int(parts[x_idx + 1]))
+            if location is None or not self.is_open(location):
+                location = self.random_open_square()
+            subs.append(SimulatedSub(sub_id, location))
+        player = SimulatedPlayer(parts[1], subs)
+        self.players.append(player)
+        return player, "J|{0}".format(player.name)
+
+    def begin_turn(self):
+        """Advances the turn counter and returns the B message"""
+        self.turn_number += 1
+        return "B|{0}".format(self.turn_number)
+
+    def is_finished(self):
+        """returns true once the game is over"""
+        if self.turn_number >= self.max_turns:
+            return True
+        alive = sum(1 for player in self.players if player.is_alive())
+        return alive == 0 or (len(self.players) > 1 and alive <= 1)
+
+    def play_turn(self, commands):
+        """Applies one turn of commands and returns the result lines per player.
+
+        commands maps each player to the list of command lines it sent this turn.
+        Malformed commands, commands for the wrong turn and commands for dead subs are ignored."""
+        turn = self.turn_number
+        moves, pings, shots = list(), list(), list()
+        for player in self.players:
+            subs = {sub.sub_id: sub for sub in player.subs}
+            for line in commands.get(player, ()):
+                parts = line.strip().split("|")
+                if len(parts) < 3 or parts[1] != str(turn) or not parts[2].isdigit():
+                    continue
+                sub = subs.get(int(parts[2]))
+                if sub is None or sub.dead:
+                    continue
+                if parts[0] == "M" and len(parts) >= 5:
+                    moves.append((sub, parts[3], parts[4]))
+                elif parts[0] == "S" and len(parts) >= 5:
+                    sub.charge(parts[3])
+                    sub.charge(parts[4])
+                elif parts[0] == "P":
+                    pings.append((player, sub))
+                elif parts[0] == "F" and len(parts) >= 5 and parts[3].isdigit() and parts[4].isdigit():
+                    shots.append((player, sub, Coordinate(int(parts[3]), int(parts[4]))))
+
+        for sub, direction, equip in moves:
+            try:
+                destination = sub.location.shifted(Direction(direction))
+            except ValueError:
+                continue
+            if self.is_open(destination):
+                sub.location = destination
+            sub.charge(equip)
+
+        results = {player: list() for player in self.players}
+        detonations, hits = list(), {player: list() for player in self.players}
+        for player, sub, target in shots:
+            if sub.torpedo_count < 1 or not self.is_open(target) \
+                    or self.path_distance(sub.location, target, sub.torpedo_range) is None:
+                continue
+            sub.torpedo_count -= 1
+            sub.torpedo_range = 0
+            detonations.append("D|{0}|{1}|{2}".format(turn, target, BLAST_RADIUS))
+            for victim_player in self.players:
+                for victim in victim_player.subs:
+                    distance = chebyshev(victim.location, target)
+                    if victim.dead or distance > BLAST_RADIUS:
+                        continue
+                    damage = DIRECT_HIT_DAMAGE if distance == 0 else NEAR_MISS_DAMAGE
+                    victim.shield_count -= damage
+                    victim.dead = victim.shield_count < 0
+                    hits[player].append("T|{0}|{1}|{2}".format(turn, victim.location, damage))
+                    if victim_player is not player:
+                        player.score += damage
+
+        sonar = list()
+        for player, sub in pings:
+            sonar.append((player, "S|{0}|{1}".format(turn, sub.location)))
+            for other_player in self.players:
+                for other in other_player.subs:
+                    if not other.dead and chebyshev(sub.location, other.location) <= sub.sonar_range:
+                        results[player].append("O|{0}|{1}|{2}".format(turn, other.location, other.size))
+            sub.sonar_range = 0
+
+        for player in self.players:
+            lines = [line for pinger, line in sonar if pinger is not player]
+            lines.extend(detonations)
+            lines.extend(hits[player])
+            lines.extend(results[player])
+            lines.extend(sub.info_line(turn) for sub in player.subs)
+            lines.append("H|{0}|{1}".format(turn, player.score))
+            results[player] = lines
+        return results
+
+    def path_distance(self, start, destination, max_distance):
+        """returns the obstacle-aware path length between squares, or None if it's over max_distance"""
+        if start == destination:
+            return 0
+        seen = {start}
+        frontier = deque([(start, 0)])
+        while frontier:
+            coord, distance = frontier.popleft()
+            if distance >= max_distance:
+                continue
+            for direction in Direction:
+                neighbor = coord.shifted(direction)
+                if neighbor in seen or not self.is_open(neighbor):
+                    continue
+                if neighbor == destination:
+                    return distance + 1
+                seen.add(neighbor)
+                frontier.append((neighbor, distance + 1))
+        return None
+
+    def result_lines(self, game_state="Finished"):
+        """returns the F message and one P message per player"""
+        lines = ["F|{0}|{1}|{2}".format(len(self.players), self.turn_number, game_state)]
+        lines.extend("P|{0}|{1}".format(player.name, player.score) for player in self.players)
+        return lines
@@ -0,0 +1,279 @@
+"""Local stand-in game server for offline benchmarking and testing.
+
+Runs GameSimulation games over the normal line protocol on localhost. Clients are grouped into
+games of --players as they connect, and many games run side by side on one event loop.
+Per turn the server measures how long each client took to answer a B message, which gives an
+end to end view of client latency and throughput.
+
+    python local_server.py --players 2 --games 10 --seed 7
+    python local_server.py --players 50 --games 1 --bots 50 --width 200 --height 200
+"""
+import argparse
+import asyncio
+import time
+from game_simulation import GameSimulation
+from PySub import DEFAULT_SERVER_PORT
+
+
+class LocalConnection():
+    """A connected client and the player it joined as"""
+
+    def __init__(self, reader, writer, player):
+        self.reader = reader
+        self.writer = writer
+        self.player = player
+        self.closed = False
+        self.latencies = list()
+
+    def send_lines(self, lines):
+        """Queues lines on the stream"""
+        if not self.closed:
+            self.writer.write("".join(line + "\n" for line in lines).encode('utf-8'))
+
+    async def read_commands(self, turn_number, timeout):
+        """Reads one command per live sub for this turn, dropping stale ones from earlier turns"""
+        commands = list()
+        wanted = sum(1 for sub in self.player.subs if not sub.dead)
+        deadline = time.perf_counter() + timeout
+        while not self.closed and len(commands) < wanted:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if not line:
+                self.closed = True
+                break
+            line = line.decode('utf-8').strip()
+            parts = line.split("|")
+            if len(parts) > 1 and parts[1].isdigit() and int(parts[1]) < turn_number:
+                continue
+            commands.append(line)
+        return commands
+
+    async def close(self):
+        """Flushes and closes the stream"""
+        if not self.closed:
+            self.closed = True
+            try:
+                await self.writer.drain()
+            except ConnectionError:
+                pass
+        self.writer.close()
+
+
+class LocalGame():
+    """A game that fills up with connections and then runs to completion"""
+
+    def __init__(self, game_id, simulation, player_count, turn_timeout, verbose):
+        self.game_id = game_id
+        self.simulation = simulation
+        self.player_count = player_count
+        self.turn_timeout = turn_timeout
+        self.verbose = verbose
+        self.seats_taken = 0
+        self.connections = list()
+        self.turn_times = list()
+
+    def is_full(self):
+        """returns true when every seat is taken"""
+        return len(self.connections) >= self.player_count
+
+    async def run(self):
+        """Plays the game and returns its summary"""
+        #play in name order so results don't depend on who connected first
+        self.connections.sort(key=lambda connection: connection.player.name)
+        self.simulation.players.sort(key=lambda player: player.name)
+        while not self.simulation.is_finished():
+            begin = self.simulation.begin_turn()
+            turn_number = self.simulation.turn_number
+            for connection in self.connections:
+                connection.send_lines([begin])
+            turn_start = time.perf_counter()
+            answers = await asyncio.gather(*(self.timed_commands(connection, turn_number, turn_start)
+                                             for connection in self.connections))
+            commands = {connection.player: lines for connection, lines in zip(self.connections, answers)}
+            results = self.simulation.play_turn(commands)
+            for connection in self.connections:
+                connection.send_lines(results[connection.player])
+            self.turn_times.append(time.perf_counter() - turn_start)
+            if all(connection.closed for connection in self.connections):
+                break
+
+        for connection in self.connections:
+            connection.send_lines(self.simulation.result_lines())
+        await asyncio.gather(*(connection.close() for connection in self.connections))
+        return self.summary()
+
+    async def timed_commands(self, connection, turn_number, turn_start):
+        """Reads a connection's commands and records how long the client took"""
+        commands = await connection.read_commands(turn_number, self.turn_timeout)
+        if commands:
+            connection.latencies.append(time.perf_counter() - turn_start)
+        return commands
+
+    def summary(self):
+        """returns timing and score figures for the game"""
+        latencies = sorted(latency for connection in self.connections for latency in connection.latencies)
+        elapsed = sum(self.turn_times)
+        return {
+            "game_id": self.game_id,
+            "turns": self.simulation.turn_number,
+            "turns_per_second": self.simulation.turn_number / elapsed if elapsed else 0.0,
+            "latency_mean_ms": 1000.0 * sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p50_ms": 1000.0 * percentile(latencies, 0.50),
+            "latency_p99_ms": 1000.0 * percentile(latencies, 0.99),
+            "latency_max_ms": 1000.0 * latencies[-1] if latencies else 0.0,
+            "scores": {player.name: player.score for player in self.simulation.players},
+        }
+
+
+def percentile(ordered, fraction):
+    """returns the given percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class LocalServer():
+    """Accepts clients and runs local games"""
+
+    def __init__(self, host="localhost", port=DEFAULT_SERVER_PORT, players_per_game=2, map_width=20,
+                 map_height=20, obstacle_density=0.05, seed=None, max_turns=200, turn_timeout=5.0,
+                 max_games=None, verbose=False, subs_per_player=1):
+        self.host = host
+        self.port = port
+        self.players_per_game = players_per_game
+        self.map_width = map_width
+        self.map_height = map_height
+        self.obstacle_density = obstacle_density
+        self.seed = seed
+        self.max_turns = max_turns
+        self.turn_timeout = turn_timeout
+        self.max_games = max_games
+        self.verbose = verbose
+        self.subs_per_player = subs_per_player
+        self.server = None
+        #games with seats still free, oldest first
+        self.filling = list()
+        self.games_started = 0
+        self.summaries = list()
+        self.done = None
+
+    def new_game(self):
+        """Creates the next game, seeded from the server seed and the game number"""
+        game_id = self.games_started
+        self.games_started += 1
+        seed = None if self.seed is None else self.seed + game_id
+        simulation = GameSimulation(self.map_width, self.map_height, self.obstacle_density, seed,
+                                    self.max_turns, "Local Game {0}".format(game_id), self.subs_per_player)
+        return LocalGame(game_id, simulation, self.players_per_game, self.turn_timeout, self.verbose)
+
+    async def start(self):
+        """Starts listening"""
+        self.done = asyncio.Event()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port)
+
+    async def stop(self):
+        """Stops listening"""
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle_client(self, reader, writer):
+        """Seats a client in the oldest game with a free seat, and runs the game once it's full"""
+        if not self.filling:
+            if self.max_games is not None and self.games_started >= self.max_games:
+                writer.close()
+                return
+            self.filling.append(self.new_game())
+        #take the seat now, other clients may connect while this one is joining
+        game = self.filling[0]
+        game.seats_taken += 1
+        if game.seats_taken >= game.player_count:
+            self.filling.remove(game)
+
+        writer.write("".join(line + "\n" for line in game.simulation.config_lines()).encode('utf-8'))
+        try:
+            join = await asyncio.wait_for(reader.readline(), self.turn_timeout)
+            player, response = game.simulation.join(join.decode('utf-8'))
+        except (asyncio.TimeoutError, ValueError) as error:
+            print("Rejected client: {0}".format(error))
+            writer.close()
+            #free the seat for the next client, the game still waits for all its players
+            game.seats_taken -= 1
+            if game not in self.filling:
+                self.filling.insert(0, game)
+            return
+        connection = LocalConnection(reader, writer, player)
+        connection.send_lines([response])
+        game.connections.append(connection)
+        if not game.is_full():
+            return
+
+        summary = await game.run()
+        self.summaries.append(summary)
+        if self.verbose:
+            print(summary)
+        else:
+            print("Game {0}: {1} turns, {2:.1f} turns/s, latency mean {3:.2f}ms p99 {4:.2f}ms".format(
+                summary["game_id"], summary["turns"], summary["turns_per_second"],
+                summary["latency_mean_ms"], summary["latency_p99_ms"]))
+        if self.max_games is not None and len(self.summaries) >= self.max_games:
+            self.done.set()
+
+
+async def serve(options):
+    """Runs the server, and optionally a set of in-process bots, until the requested games finish"""
+    server = LocalServer(options.host, options.port, options.players, options.width, options.height,
+                         options.obstacles, options.seed, options.turns, options.timeout,
+                         options.games, options.verbose, options.subs)
+    await server.start()
+    print("Local server listening on {0}:{1}".format(options.host, options.port))
+    bots = None
+    if options.bots:
+        from async_pysub import AsyncPySub, run_bots
+        bots = asyncio.ensure_future(run_bots([AsyncPySub("Bot{0}".format(idx), options.host, options.port, False)
+                                               for idx in range(options.bots)]))
+    try:
+        await server.done.wait()
+        if bots is not None:
+            await bots
+    finally:
+        await server.stop()
+    return server.summaries
+
+
+def obstacle_density(text):
+    """argparse type for a fraction of squares blocked, at least 0 and below 1"""
+    try:
+        density = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid fraction: {0}".format(text))
+    if not 0 <= density < 1:
+        raise argparse.ArgumentTypeError("{0} is not at least 0 and below 1".format(text))
+    return density
+
+
+def parse_args(args=None):
+    """Parses command line options"""
+    parser = argparse.ArgumentParser(description="Local PySub game server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=DEFAULT_SERVER_PORT)
+    parser.add_argument("--players", type=int, default=2, help="players per game")
+    parser.add_argument("--games", type=int, default=None, help="stop after this many games")
+    parser.add_argument("--width", type=int, default=20)
+    parser.add_argument("--height", type=int, default=20)
+    parser.add_argument("--obstacles", type=obstacle_density, default=0.05, help="fraction of squares blocked")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--subs", type=int, default=1, help="subs per player")
+    parser.add_argument("--turns", type=int, default=200, help="maximum turns per game")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds to wait for a command")
+    parser.add_argument("--bots", type=int, default=0, help="AsyncPySub bots to run in this process")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    asyncio.run(serve(parse_args()))
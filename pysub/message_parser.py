@@ -0,0 +1,378 @@
+"""Table-driven server message parser.
+
+Lines are dispatched on their first character to a parse function that splits the line once
+and builds a small __slots__ record, or a plain tuple of the same fields in slot order when
+the parser is created with use_tuples=True. Records carry the same attribute names as the
+server_message classes, so handle_*_message code works with either.
+
+Run this module to compare parser throughput with the server_message classes.
+"""
+import sys
+import timeit
+from util import Coordinate
+
+
+class Record():
+    """Base class for parsed messages"""
+    __slots__ = ()
+    kind = None
+
+    def __repr__(self):
+        return "{0}({1})".format(type(self).__name__, ", ".join(
+            "{0}={1!r}".format(name, getattr(self, name)) for name in self.__slots__))
+
+    def as_tuple(self):
+        """returns the record's fields in slot order"""
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class GameConfig(Record):
+    """C message. custom_settings is filled in by whoever reads the V messages that follow"""
+    __slots__ = ('server_version', 'game_title', 'map_width', 'map_height', 'settings_count', 'custom_settings')
+    kind = "C"
+
+    def __init__(self, server_version, game_title, map_width, map_height, settings_count, custom_settings):
+        self.server_version = server_version
+        self.game_title = game_title
+        self.map_width = map_width
+        self.map_height = map_height
+        self.settings_count = settings_count
+        self.custom_settings = custom_settings
+
+
+class GameSetting(Record):
+    """V message"""
+    __slots__ = ('setting_name', 'values')
+    kind = "V"
+
+    def __init__(self, setting_name, values):
+        self.setting_name = setting_name
+        self.values = values
+
+
+class Joined(Record):
+    """J message acknowledging a join"""
+    __slots__ = ('player_name',)
+    kind = "J"
+
+    def __init__(self, player_name):
+        self.player_name = player_name
+
+
+class BeginTurn(Record):
+    """B message"""
+    __slots__ = ('turn_number',)
+    kind = "B"
+
+    def __init__(self, turn_number):
+        self.turn_number = turn_number
+
+
+class SonarDetection(Record):
+    """S message"""
+    __slots__ = ('turn_number', 'location')
+    kind = "S"
+
+    def __init__(self, turn_number, location):
+        self.turn_number = turn_number
+        self.location = location
+
+
+class Detonation(Record):
+    """D message"""
+    __slots__ = ('turn_number', 'location', 'radius')
+    kind = "D"
+
+    def __init__(self, turn_number, location, radius):
+        self.turn_number = turn_number
+        self.location = location
+        self.radius = radius
+
+
+class TorpedoHit(Record):
+    """T message"""
+    __slots__ = ('turn_number', 'location', 'damage')
+    kind = "T"
+
+    def __init__(self, turn_number, location, damage):
+        self.turn_number = turn_number
+        self.location = location
+        self.damage = damage
+
+
+class DiscoveredObject(Record):
+    """O message"""
+    __slots__ = ('turn_number', 'location', 'size')
+    kind = "O"
+
+    def __init__(self, turn_number, location, size):
+        self.turn_number = turn_number
+        self.location = location
+        self.size = size
+
+
+class SubmarineInfo(Record):
+    """I message"""
+    __slots__ = ('turn_number', 'sub_id', 'location', 'active', 'dead', 'shield_count', 'size',
+                 'torpedo_count', 'sonar_range', 'torpedo_range', 'max_sonar_charge',
+                 'max_torpedo_charge', 'reactor_damage')
+    kind = "I"
+
+    def __init__(self, turn_number, sub_id, location, active, dead=False, shield_count=0, size=0,
+                 torpedo_count=0, sonar_range=0, torpedo_range=0, max_sonar_charge=False,
+                 max_torpedo_charge=False, reactor_damage=0):
+        self.turn_number = turn_number
+        self.sub_id = sub_id
+        self.location = location
+        self.active = active
+        self.dead = dead
+        self.shield_count = shield_count
+        self.size = size
+        self.torpedo_count = torpedo_count
+        self.sonar_range = sonar_range
+        self.torpedo_range = torpedo_range
+        self.max_sonar_charge = max_sonar_charge
+        self.max_torpedo_charge = max_torpedo_charge
+        self.reactor_damage = reactor_damage
+
+
+class PlayerScore(Record):
+    """H message"""
+    __slots__ = ('turn_number', 'score')
+    kind = "H"
+
+    def __init__(self, turn_number, score):
+        self.turn_number = turn_number
+        self.score = score
+
+
+class GameFinished(Record):
+    """F message. player_results is filled in by whoever reads the P messages that follow"""
+    __slots__ = ('player_count', 'turn_count', 'game_state', 'player_results')
+    kind = "F"
+
+    def __init__(self, player_count, turn_count, game_state, player_results):
+        self.player_count = player_count
+        self.turn_count = turn_count
+        self.game_state = game_state
+        self.player_results = player_results
+
+
+class PlayerResult(Record):
+    """P message"""
+    __slots__ = ('player_name', 'player_score')
+    kind = "P"
+
+    def __init__(self, player_name, player_score):
+        self.player_name = player_name
+        self.player_score = player_score
+
+
+def parse_bool(value):
+    """parses a flag sent as true/false or 1/0"""
+    return value == "1" or value.lower() == "true"
+
+
+#I| key=value fields: key -> (index into the SubmarineInfo fields, converter)
+INFO_FIELDS = SubmarineInfo.__slots__
+INFO_KEYS = {
+    "shields": (INFO_FIELDS.index('shield_count'), int),
+    "size": (INFO_FIELDS.index('size'), int),
+    "torpedos": (INFO_FIELDS.index('torpedo_count'), int),
+    "sonar_range": (INFO_FIELDS.index('sonar_range'), int),
+    "max_sonar": (INFO_FIELDS.index('max_sonar_charge'), parse_bool),
+    "torpedo_range": (INFO_FIELDS.index('torpedo_range'), int),
+    "max_torpedo": (INFO_FIELDS.index('max_torpedo_charge'), parse_bool),
+    "reactor_damage": (INFO_FIELDS.index('reactor_damage'), int),
+    "dead": (INFO_FIELDS.index('dead'), parse_bool),
+}
+INFO_DEFAULTS = (None, None, None, False, False, 0, 0, 0, 0, 0, False, False, 0)
+
+
+def split(line, prefix, min_part_count, message_type):
+    """splits a line, validating it the same way ServerMessage does"""
+    parts = line.split("|")
+    if len(parts) < min_part_count or parts[0] != prefix:
+        raise ValueError("Invalid {0} message: {1}".format(message_type, line))
+    return parts
+
+
+def parse_game_config(line):
+    """C|version|title|width|height|settings"""
+    parts = split(line, "C", 6, "game config")
+    return (parts[1], parts[2], int(parts[3]), int(parts[4]), int(parts[5]), list())
+
+
+def parse_game_setting(line):
+    """V|name|values..."""
+    parts = split(line, "V", 3, "game setting")
+    return (parts[1], parts[2:])
+
+
+def parse_joined(line):
+    """J|name"""
+    return (split(line, "J", 2, "join")[1],)
+
+
+def parse_begin_turn(line):
+    """B|turn"""
+    return (int(split(line, "B", 2, "begin turn")[1]),)
+
+
+def parse_sonar_detection(line):
+    """S|turn|x|y"""
+    parts = split(line, "S", 4, "sonar detection")
+    return (int(parts[1]), Coordinate(int(parts[2]), int(parts[3])))
+
+
+def parse_detonation(line):
+    """D|turn|x|y|radius"""
+    parts = split(line, "D", 5, "detonation")
+    return (int(parts[1]), Coordinate(int(parts[2]), int(parts[3])), int(parts[4]))
+
+
+def parse_torpedo_hit(line):
+    """T|turn|x|y|damage"""
+    parts = split(line, "T", 5, "torpedo hit")
+    return (int(parts[1]), Coordinate(int(parts[2]), int(parts[3])), int(parts[4]))
+
+
+def parse_discovered_object(line):
+    """O|turn|x|y|size"""
+    parts = split(line, "O", 5, "discovered object")
+    return (int(parts[1]), Coordinate(int(parts[2]), int(parts[3])), int(parts[4]))
+
+
+def parse_submarine_info(line):
+    """I|turn|sub_id|x|y|active|key=value..."""
+    parts = split(line, "I", 6, "submarine info")
+    fields = list(INFO_DEFAULTS)
+    fields[0] = int(parts[1])
+    fields[1] = int(parts[2])
+    fields[2] = Coordinate(int(parts[3]), int(parts[4]))
+    fields[3] = parts[5] == "1"
+    for part in parts[6:]:
+        key, equals, value = part.partition('=')
+        if not equals:
+            raise ValueError("invalid submarine info message: {0}".format(line))
+        handler = INFO_KEYS.get(key)
+        if handler is not None:
+            fields[handler[0]] = handler[1](value)
+    return tuple(fields)
+
+
+def parse_player_score(line):
+    """H|turn|score"""
+    parts = split(line, "H", 3, "player score")
+    return (int(parts[1]), parts[2])
+
+
+def parse_game_finished(line):
+    """F|players|turns|state"""
+    parts = split(line, "F", 4, "game finished")
+    return (int(parts[1]), int(parts[2]), parts[3], list())
+
+
+def parse_player_result(line):
+    """P|name|score"""
+    parts = split(line, "P", 3, "player result")
+    return (parts[1], int(parts[2]))
+
+
+PARSE_TABLE = {
+    "C": (parse_game_config, GameConfig),
+    "V": (parse_game_setting, GameSetting),
+    "J": (parse_joined, Joined),
+    "B": (parse_begin_turn, BeginTurn),
+    "S": (parse_sonar_detection, SonarDetection),
+    "D": (parse_detonation, Detonation),
+    "T": (parse_torpedo_hit, TorpedoHit),
+    "O": (parse_discovered_object, DiscoveredObject),
+    "I": (parse_submarine_info, SubmarineInfo),
+    "H": (parse_player_score, PlayerScore),
+    "F": (parse_game_finished, GameFinished),
+    "P": (parse_player_result, PlayerResult),
+}
+
+
+class MessageParser():
+    """Parses server lines into records, or tuples, through PARSE_TABLE"""
+
+    def __init__(self, use_tuples=False):
+        self.use_tuples = use_tuples
+        if use_tuples:
+            self._table = dict((kind, parse) for kind, (parse, _) in PARSE_TABLE.items())
+        else:
+            self._table = dict((kind, self._record_builder(parse, record))
+                               for kind, (parse, record) in PARSE_TABLE.items())
+
+    @staticmethod
+    def _record_builder(parse, record):
+        """returns a function parsing a line straight into a record"""
+        def build(line):
+            return record(*parse(line))
+        return build
+
+    def parse(self, line):
+        """parses one line"""
+        parse = self._table.get(line[:1])
+        if parse is None:
+            raise ValueError("Unknown message: {0}".format(line))
+        return parse(line)
+
+    def parse_batch(self, lines):
+        """parses every line of a batch, such as one turn's results"""
+        table = self._table
+        parsed = list()
+        for line in lines:
+            parse = table.get(line[:1])
+            if parse is None:
+                raise ValueError("Unknown message: {0}".format(line))
+            parsed.append(parse(line))
+        return parsed
+
+
+SAMPLE_TURN = [
+    "B|42",
+    "S|42|7|9",
+    "D|42|3|4|1",
+    "T|42|3|4|2",
+    "O|42|5|6|100",
+    "O|42|8|8|100",
+    "I|42|0|5|6|1|shields=3|size=100|torpedos=8|sonar_range=2|torpedo_range=4|reactor_damage=0|dead=0",
+    "H|42|6",
+]
+
+
+def compare_throughput(lines=None, number=2000):
+    """Returns messages per second for the server_message classes, records and tuples"""
+    import server_message
+    lines = SAMPLE_TURN if lines is None else lines
+    classes = {
+        "B": server_message.BeginTurnMessage,
+        "S": server_message.SonarDetectionMessage,
+        "D": server_message.DetonationMessage,
+        "T": server_message.TorpedoHitMessage,
+        "O": server_message.DiscoveredObjectMessage,
+        "I": server_message.SubmarineInfoMessage,
+        "H": server_message.PlayerScoreMessage,
+    }
+
+    def parse_with_classes():
+        for line in lines:
+            classes[line[0]](line)
+
+    records = MessageParser()
+    tuples = MessageParser(use_tuples=True)
+    timings = {
+        "server_message": timeit.timeit(parse_with_classes, number=number),
+        "records": timeit.timeit(lambda: records.parse_batch(lines), number=number),
+        "tuples": timeit.timeit(lambda: tuples.parse_batch(lines), number=number),
+    }
+    return dict((name, len(lines) * number / elapsed) for name, elapsed in timings.items())
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for name, rate in compare_throughput(number=iterations).items():
+        print("{0:16} {1:12.0f} messages/s".format(name, rate))
@@ -0,0 +1,111 @@
+"""Enemy occupancy belief.
+
+OccupancyBelief keeps a float grid, indexed [y - 1, x - 1] like GameMap, holding roughly how
+likely each square is to hold an enemy. Each turn it:
+    * diffuses the grid one step with a 5-point kernel, since subs move one square a turn, and
+      decays it, since old sightings get less trustworthy
+    * clears the sonar range of each of our pings, where nothing was there to be found
+    * raises the squares of new foreign objects, sonar pings and detonations
+
+Diffusion and decay are one vectorized pass over the map, and everything else is a sparse
+update costing one slice or fancy index per observation, so there are no Python loops over
+the map. Queries are bulk NumPy reads.
+"""
+import numpy as np
+
+DEFAULT_DECAY = 0.85
+#share of a square's belief that moves to its neighbours each turn
+DEFAULT_DIFFUSION = 0.5
+DETECTED = 1.0
+#someone pinging from a square is nearly as good as seeing them there
+SPOTTED = 0.9
+#a detonation means someone thought something was there
+DETONATION = 0.3
+
+
+class OccupancyBelief():
+    """Decaying, diffusing probability grid of where enemies are"""
+
+    def __init__(self, game_map, decay=DEFAULT_DECAY, diffusion=DEFAULT_DIFFUSION):
+        self.game_map = game_map
+        self.decay = decay
+        self.diffusion = diffusion
+        self.grid = np.zeros((game_map.height, game_map.width), dtype=np.float32)
+        #padded scratch space for the diffusion pass and the open-neighbour counts it divides by
+        self._padded = np.zeros((game_map.height + 2, game_map.width + 2), dtype=np.float32)
+        self._obstacle_version = None
+        self._open = None
+        self._spread = None
+        self._keep = None
+
+    def _refresh_obstacles(self):
+        if self._obstacle_version == self.game_map.obstacle_version:
+            return
+        self._obstacle_version = self.game_map.obstacle_version
+        self._open = (~self.game_map.blocked).astype(np.float32)
+        padded = np.pad(self._open, 1)
+        neighbors = padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+        #each open square hands its diffused share out evenly to its open neighbours and keeps
+        #the rest. Squares with no open neighbour keep everything
+        moving = self._open * (neighbors > 0)
+        self._spread = (moving * self.diffusion / np.maximum(neighbors, 1)).astype(np.float32)
+        self._keep = (self._open - moving * self.diffusion).astype(np.float32)
+        self.grid *= self._open
+
+    def advance(self):
+        """Moves belief one turn forward: diffuse to open neighbours, then decay"""
+        self._refresh_obstacles()
+        grid, padded = self.grid, self._padded
+        np.multiply(grid, self._spread, out=padded[1:-1, 1:-1])
+        incoming = padded[:-2, 1:-1] + padded[2:, 1:-1] + padded[1:-1, :-2] + padded[1:-1, 2:]
+        incoming *= self._open
+        grid *= self._keep
+        grid += incoming
+        grid *= self.decay
+
+    def clear_box(self, location, radius):
+        """marks the Chebyshev box of radius around location as empty"""
+        self.grid[max(0, location.y - 1 - radius):location.y + radius,
+                  max(0, location.x - 1 - radius):location.x + radius] = 0
+
+    def raise_squares(self, coords, value):
+        """raises the belief at each of a list of open coordinates to at least value"""
+        if not coords:
+            return
+        xs = np.fromiter((coord.x - 1 for coord in coords), np.intp, len(coords))
+        ys = np.fromiter((coord.y - 1 for coord in coords), np.intp, len(coords))
+        np.maximum.at(self.grid, (ys, xs), value)
+
+    def raise_box(self, location, radius, value):
+        """raises the belief across the Chebyshev box of radius around location to at least value"""
+        rows = slice(max(0, location.y - 1 - radius), location.y + radius)
+        cols = slice(max(0, location.x - 1 - radius), location.x + radius)
+        box = self.grid[rows, cols]
+        np.maximum(box, value * self._open[rows, cols], out=box)
+
+    def update(self, detected, spotted, detonations, pings, blast_radius=1):
+        """Advances a turn and folds in the turn's observations.
+
+        detected are squares holding foreign objects, spotted are squares someone pinged from,
+        detonations are blast centres and pings are (location, sonar range) of our own pings"""
+        self.advance()
+        for location, sonar_range in pings:
+            self.clear_box(location, sonar_range)
+        self.raise_squares(detected, DETECTED)
+        self.raise_squares(spotted, SPOTTED)
+        for location in detonations:
+            self.raise_box(location, blast_radius, DETONATION)
+
+    def box_sums(self, coords, radius):
+        """returns the total belief within the Chebyshev box of radius around each coordinate as an array"""
+        grid = self.grid
+        return np.array([grid[max(0, coord.y - 1 - radius):coord.y + radius,
+                              max(0, coord.x - 1 - radius):coord.x + radius].sum() for coord in coords])
+
+    def window(self, x_min, y_min, rows, cols):
+        """returns a view of the belief over a window whose top left square is x_min, y_min"""
+        return self.grid[y_min - 1:y_min - 1 + rows, x_min - 1:x_min - 1 + cols]
+
+    def clear(self):
+        """Forgets everything"""
+        self.grid.fill(0)
@@ -0,0 +1,166 @@
+"""Obstacle-aware pathfinding over a GameMap.
+
+Squares are addressed by their index into the map padded with a blocked border, so square
+(x, y) is cell y * stride + x and neighbours never need a bounds check.
+
+next_direction answers "which way is one true shortest-path step toward destination":
+    * If precompute() built an all-pairs next-hop table (small maps only) it's a table lookup.
+    * Otherwise A* runs on demand and the route is remembered per destination, so later
+      steps along the same route are a dict lookup.
+"""
+from collections import OrderedDict, deque
+import heapq
+from util import Direction
+
+DIRECTIONS = (Direction.NORTH, Direction.EAST, Direction.SOUTH, Direction.WEST)
+ALL_PAIRS_LIMIT = 1024
+DEFAULT_ROUTE_CACHE_SIZE = 64
+NO_ROUTE = 255
+
+
+class PathFinder():
+    """A* search with a per-destination route cache and an optional all-pairs next-hop table"""
+
+    def __init__(self, game_map, route_cache_size=DEFAULT_ROUTE_CACHE_SIZE):
+        self.game_map = game_map
+        self.route_cache_size = route_cache_size
+        self.stride = game_map.width + 2
+        self._offsets = (-self.stride, 1, self.stride, -1)
+        self._obstacle_version = None
+        self._passable = None
+        self._routes = OrderedDict()
+        self._table = None
+        self._table_ids = None
+
+    def cell(self, coord):
+        """returns the padded cell index of a coordinate"""
+        return coord[1] * self.stride + coord[0]
+
+    def passable(self):
+        """returns the padded open-square layer as bytes, rebuilding it if obstacles changed"""
+        if self._obstacle_version != self.game_map.obstacle_version:
+            self._passable = self.game_map.padded_passable()
+            self._obstacle_version = self.game_map.obstacle_version
+            self._routes.clear()
+            self._table = None
+            self._table_ids = None
+        return self._passable
+
+    def find_path(self, start, destination):
+        """Runs A* and returns the list of Directions from start to destination, or None if unreachable"""
+        cells = self._search(self.cell(start), self.cell(destination))
+        if cells is None:
+            return None
+        return [DIRECTIONS[self._offsets.index(nxt - cur)] for cur, nxt in zip(cells, cells[1:])]
+
+    def next_direction(self, start, destination):
+        """returns the first Direction of a shortest path from start to destination, or None"""
+        passable = self.passable()
+        start_cell, goal = self.cell(start), self.cell(destination)
+        if start_cell == goal or not passable[goal]:
+            return None
+
+        if self._table is not None:
+            start_id = self._table_ids.get(start_cell)
+            if start_id is None:
+                return None
+            step = self._table[self._table_ids[goal]][start_id]
+            return None if step == NO_ROUTE else DIRECTIONS[step]
+
+        route = self._routes.get(goal)
+        if route is not None:
+            self._routes.move_to_end(goal)
+            step = route.get(start_cell)
+            if step is not None:
+                return DIRECTIONS[step]
+        cells = self._search(start_cell, goal)
+        if cells is None:
+            return None
+        self.remember_route(cells)
+        return DIRECTIONS[self._routes[goal][start_cell]]
+
+    def knows_route(self, start, destination):
+        """returns true if next_direction can answer without searching"""
+        if self._table is not None:
+            return True
+        route = self._routes.get(self.cell(destination))
+        return route is not None and self.cell(start) in route
+
+    def search_cells(self, start, destination, passable):
+        """Runs A* over a passable layer from passable() without touching any cache, so it is
+        safe to call from another thread. Returns the padded cell path or None"""
+        return self._search(self.cell(start), self.cell(destination), passable)
+
+    def remember_route(self, cells):
+        """adds a padded cell path, such as one from search_cells, to the route cache"""
+        goal = cells[-1]
+        route = self._routes.get(goal)
+        if route is None:
+            route = self._routes[goal] = dict()
+            if len(self._routes) > self.route_cache_size:
+                self._routes.popitem(last=False)
+        for cur, nxt in zip(cells, cells[1:]):
+            route[cur] = self._offsets.index(nxt - cur)
+
+    def _search(self, start_cell, goal, passable=None):
+        """A* over padded cells with a Manhattan heuristic. Returns the cell path or None"""
+        if passable is None:
+            passable = self.passable()
+        if not passable[goal]:
+            return None
+        stride, offsets = self.stride, self._offsets
+        goal_y, goal_x = divmod(goal, stride)
+        came_from = {start_cell: None}
+        cost = {start_cell: 0}
+        #ties go to the deeper node, which keeps A* from fanning out across open water
+        heap = [(0, 0, start_cell)]
+        while heap:
+            _, depth, cell = heapq.heappop(heap)
+            if cell == goal:
+                path = list()
+                while cell is not None:
+                    path.append(cell)
+                    cell = came_from[cell]
+                path.reverse()
+                return path
+            steps = -depth
+            if steps > cost[cell]:
+                continue
+            steps += 1
+            for offset in offsets:
+                neighbor = cell + offset
+                if passable[neighbor] and steps < cost.get(neighbor, steps + 1):
+                    cost[neighbor] = steps
+                    came_from[neighbor] = cell
+                    row, col = divmod(neighbor, stride)
+                    heapq.heappush(heap, (steps + abs(row - goal_y) + abs(col - goal_x), -steps, neighbor))
+        return None
+
+    def precompute(self, max_cells=ALL_PAIRS_LIMIT):
+        """Builds the all-pairs next-hop table if the map has at most max_cells open squares.
+        Returns true if the table was built"""
+        if self.game_map.open_count() > max_cells:
+            return False
+        passable = self.passable()
+        open_cells = [cell for cell, is_open in enumerate(passable) if is_open]
+
+        ids = dict((cell, idx) for idx, cell in enumerate(open_cells))
+        #toward[offset] is the direction index that undoes a step by offset
+        toward = dict((offset, self._offsets.index(-offset)) for offset in self._offsets)
+        table = list()
+        for goal in open_cells:
+            row = bytearray([NO_ROUTE]) * len(open_cells)
+            seen = {goal}
+            frontier = deque([goal])
+            while frontier:
+                cell = frontier.popleft()
+                for offset in self._offsets:
+                    neighbor = cell + offset
+                    if passable[neighbor] and neighbor not in seen:
+                        seen.add(neighbor)
+                        row[ids[neighbor]] = toward[offset]
+                        frontier.append(neighbor)
+            table.append(bytes(row))
+        self._table = table
+        self._table_ids = ids
+        return True
@@ -0,0 +1,253 @@
+"""Deadline-aware anytime planner.
+
+AnytimePlanner stands in for the Dudly Jr heuristic in PySub.choose_command. It looks ahead
+over the sub's own fire, ping and move options with iterative deepening: a search of depth 1,
+then 2 and so on until the turn's time budget runs out. The first action of the best plan
+from the deepest search that finished is sent. The heuristic's command is worked out first,
+so there is an answer ready even if the budget runs out before depth 1 does. It's worked out
+on copies of the bot's state with the planner's own random numbers, so a turn only changes
+what the command it sends changes.
+
+Only our own sub is modelled. Objects seen this turn are assumed to stay where they are, so
+firing from a square is worth the best blast value reachable from it. Moving toward the sub's
+destination and charging equipment are worth a little, and ping is worth more the longer its
+range, up to the torpedo range, and the less we can currently see.
+
+Progress toward the destination is measured in path steps, not straight-line distance, so
+walls count. The path finder's route is followed up to WAYPOINT_STEPS squares ahead and a BFS
+distance field from that waypoint covers every square the search can reach. Squares closer
+to the waypoint are closer to the destination along the route.
+
+The deadline is checked before every node and before every distance field the search builds.
+The heuristic's fallback is worked out first and its time comes out of the same budget.
+
+The planner is experimental and off unless PySub.enable_planner is called. Over 200 seeded
+tournament.py games against the plain heuristic it only draws level, and most of its moves are
+the heuristic's own, since with a smaller HEURISTIC_BONUS the search loses more than it wins.
+Compare with python tournament.py --grid planner_budget=0.02 before relying on it.
+"""
+import random
+import time
+import targeting
+from commands import FireCommand, PingCommand, MoveCommand
+from util import Direction, Equipment
+
+DEFAULT_TURN_BUDGET = 0.05
+DEFAULT_MAX_DEPTH = 6
+#the budget is cut short by this much to leave time for encoding and sending
+SEND_MARGIN = 0.002
+DISCOUNT = 0.8
+FIRE_WEIGHT = 1.0
+PING_WEIGHT = 4.0
+CHARGE_WEIGHT = 2.0
+PROGRESS_WEIGHT = 3.0
+#extra for whatever the heuristic would have done, so the search only overrules it for a clear gain
+HEURISTIC_BONUS = 5.0
+#charge past this is assumed not to help
+RANGE_CAP = 8
+#how far along the path finder's route progress is measured to
+WAYPOINT_STEPS = 8
+EQUIPMENT = (Equipment.SONAR, Equipment.TORPEDO)
+
+
+class BudgetExpired(Exception):
+    """Raised inside a search when the time budget runs out"""
+
+
+class AnytimePlanner():
+    """Iterative deepening lookahead over one sub's actions under a per-turn time budget"""
+
+    def __init__(self, bot, budget=DEFAULT_TURN_BUDGET, max_depth=DEFAULT_MAX_DEPTH, seed=None):
+        self.bot = bot
+        #seeded from the random module when no seed is given, so a seeded game still replays the same
+        self.random = random.Random(random.getrandbits(64) if seed is None else seed)
+        self.budget = budget
+        self.max_depth = max_depth
+        self.turn_number = None
+        self.turn_deadline = 0.0
+        self.remaining = 0
+        self.deadline = 0.0
+        self.depth_reached = 0
+        self.nodes = 0
+        self.favoured = None
+        self.destination = None
+        self.progress = None
+        self.any_seen = False
+        self._potential = dict()
+        self._memo = dict()
+
+    def start_turn(self, sub_count):
+        """Starts the clock for a turn in which sub_count subs need commands"""
+        self.turn_number = self.bot.turn_number
+        self.turn_deadline = time.perf_counter() + self.budget - SEND_MARGIN
+        self.remaining = max(1, sub_count)
+        self._potential.clear()
+
+    def choose(self, sub, claimed=None):
+        """Returns the best command found for sub before its share of the turn's budget ran out.
+        Targets in claimed are left alone, and the chosen target is added to it"""
+        bot = self.bot
+        if self.turn_number != bot.turn_number:
+            self.start_turn(1)
+        now = time.perf_counter()
+        self.deadline = now + max(0.0, self.turn_deadline - now) / self.remaining
+        self.remaining = max(1, self.remaining - 1)
+
+        fallback, self.destination = self._fallback(sub, claimed)
+        self.favoured = self.action_of(fallback)
+        self.nodes = 0
+        self.depth_reached = 0
+
+        best = None
+        #values are memoised per depth, so shallower searches speed up the deeper ones
+        self._memo.clear()
+        self.progress = None
+        try:
+            self._check_deadline()
+            self.progress = self._progress_field(sub)
+            self._check_deadline()
+            targets = bot.safe_torpedo_targets(sub, claimed) if sub.torpedo_range > targeting.BLAST_RADIUS else list()
+            self.any_seen = bool(targets) or bool(bot.spotted)
+            for depth in range(1, self.max_depth + 1):
+                best = self._root(sub, targets, depth)
+                self.depth_reached = depth
+        except BudgetExpired:
+            pass
+
+        action = self.favoured if best is None else best
+        if action[0] == "F":
+            if claimed is not None:
+                claimed.add(action[1])
+            bot.destinations[sub.sub_id] = None
+            return sub.fire_torpedo(bot.turn_number, action[1])
+        if action[0] == "P":
+            bot.destinations[sub.sub_id] = None
+            return sub.ping(bot.turn_number)
+        bot.destinations[sub.sub_id] = self.destination
+        return sub.move(bot.turn_number, str(action[1]), str(action[2]))
+
+    def _fallback(self, sub, claimed):
+        """returns the heuristic's command for sub and the destination it heads for. It runs against
+        copies of claimed and the destinations and draws from the planner's own random numbers,
+        so nothing changes unless the planner goes on to send it"""
+        bot = self.bot
+        destinations, source = bot.destinations, bot.random
+        bot.destinations, bot.random = dict(destinations), self.random
+        try:
+            command = bot.heuristic_command(sub, None if claimed is None else set(claimed))
+            return command, bot.destinations.get(sub.sub_id)
+        finally:
+            bot.destinations, bot.random = destinations, source
+
+    @staticmethod
+    def action_of(command):
+        """returns the planner's action tuple for a command"""
+        if isinstance(command, FireCommand):
+            return ("F", command.destination)
+        if isinstance(command, PingCommand):
+            return ("P",)
+        if isinstance(command, MoveCommand):
+            return ("M", Direction(command.direction), Equipment(command.equip))
+        raise ValueError("Unknown command {0}".format(command))
+
+    def _check_deadline(self):
+        if time.perf_counter() > self.deadline:
+            raise BudgetExpired()
+
+    def _progress_field(self, sub):
+        """returns a DistanceField from a waypoint on the route to the destination covering every
+        square the search can reach, or None if there's no destination or no route to it"""
+        destination = self.destination
+        if destination is None or destination == sub.location:
+            return None
+        pathfinder = self.bot.pathfinder
+        waypoint, steps = sub.location, 0
+        while steps < WAYPOINT_STEPS and waypoint != destination:
+            direction = pathfinder.next_direction(waypoint, destination)
+            if direction is None:
+                break
+            waypoint, steps = waypoint.shifted(direction), steps + 1
+        if steps == 0:
+            return None
+        return self.bot.reachability.field(waypoint, steps + self.max_depth + 1)
+
+    def _root(self, sub, targets, depth):
+        """returns the best first action for a search of the given depth"""
+        self._check_deadline()
+        location = sub.location
+        sonar, torpedo = min(sub.sonar_range, RANGE_CAP), min(sub.torpedo_range, RANGE_CAP)
+        best, best_value = None, None
+        options = list(self._options(location, sonar, torpedo, root=True))
+        if targets:
+            #fire at the best target we're allowed to hit, preferring the heuristic's pick on a tie
+            top = targets[0][1]
+            target = self.favoured[1] if self.favoured[0] == "F" and self.favoured[1] in \
+                [coord for coord, value in targets if value == top] else targets[0][0]
+            options.append((("F", target), FIRE_WEIGHT * top, (location, sonar, 0)))
+        for action, reward, state in options:
+            value = reward + DISCOUNT * self._value(state, depth - 1)
+            if action == self.favoured:
+                value += HEURISTIC_BONUS
+            if best_value is None or value > best_value:
+                best, best_value = action, value
+        return best
+
+    def _value(self, state, depth):
+        """returns the best discounted value reachable from state within depth actions"""
+        self.nodes += 1
+        self._check_deadline()
+        location, sonar, torpedo = state
+        leaf = CHARGE_WEIGHT * (sonar + torpedo) / RANGE_CAP - PROGRESS_WEIGHT * self._distance(location)
+        if depth == 0:
+            return leaf
+        key = (state, depth)
+        value = self._memo.get(key)
+        if value is None:
+            value = max((reward + DISCOUNT * self._value(next_state, depth - 1)
+                         for _, reward, next_state in self._options(location, sonar, torpedo, root=False)),
+                        default=leaf)
+            self._memo[key] = value
+        return value
+
+    def _options(self, location, sonar, torpedo, root):
+        """yields (action, reward, next state) for one step from a state. Root fire options come from _root"""
+        if not root and torpedo > targeting.BLAST_RADIUS:
+            potential = self._fire_potential(location, torpedo)
+            if potential > 0:
+                yield ("F", None), FIRE_WEIGHT * potential, (location, sonar, 0)
+        if sonar > 0:
+            #a ping only pays off if there's a torpedo to fire at what it finds
+            yield ("P",), PING_WEIGHT * min(sonar, torpedo) * (0.25 if self.any_seen else 1.0), (location, 0, torpedo)
+        distance = self._distance(location)
+        for direction, square in self.bot.game_map.open_neighbors(location):
+            progress = PROGRESS_WEIGHT * (distance - self._distance(square))
+            for equip in EQUIPMENT:
+                if equip is Equipment.SONAR:
+                    charged = (square, min(sonar + 1, RANGE_CAP), torpedo)
+                else:
+                    charged = (square, sonar, min(torpedo + 1, RANGE_CAP))
+                yield ("M", direction, equip), progress, charged
+
+    def _distance(self, location):
+        """returns the path steps from location to the progress waypoint, 0 without one"""
+        field = self.progress
+        if field is None:
+            return 0
+        row, col = location.y - field.y_min, location.x - field.x_min
+        rows, cols = field.distance.shape
+        if 0 <= row < rows and 0 <= col < cols and field.distance[row, col] >= 0:
+            return int(field.distance[row, col])
+        return field.max_range + 1
+
+    def _fire_potential(self, location, torpedo):
+        """returns the best blast value a torpedo of the given range could reach from location this turn"""
+        key = (location, torpedo)
+        potential = self._potential.get(key)
+        if potential is None:
+            #a new distance field is the expensive part of a node
+            self._check_deadline()
+            bot = self.bot
+            field = bot.reachability.field(location, torpedo)
+            targets = targeting.rank_torpedo_targets(bot.game_map, field, location, torpedo)
+            potential = self._potential[key] = targets[0][1] if targets else 0
+        return potential
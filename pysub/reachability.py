@@ -0,0 +1,154 @@
+"""Obstacle-aware reachability for torpedos.
+
+Distance fields are computed with an iterative, level by level BFS over the blocked layer of a
+GameMap and cached per origin with LRU eviction. A path of length r never leaves the Chebyshev
+box of radius r around its origin, so each search only looks at that window of the map.
+Cached fields are dropped when the map's obstacle_version changes.
+"""
+from collections import OrderedDict
+import numpy as np
+from util import Coordinate
+
+DEFAULT_CACHE_SIZE = 256
+
+
+class DistanceField():
+    """BFS distances from one origin, up to max_range, over a window of the map"""
+
+    def __init__(self, origin, max_range, x_min, y_min, distance, order, level_ends, stride):
+        self.origin = origin
+        self.max_range = max_range
+        self.x_min = x_min
+        self.y_min = y_min
+        #distance[y - y_min, x - x_min] is the path length or -1 if unreachable within max_range
+        self.distance = distance
+        self._order = order
+        self._level_ends = level_ends
+        self._stride = stride
+        self._ranges = dict()
+        self._target_masks = dict()
+
+    def squares_within(self, max_range):
+        """returns {coordinate: distance} for squares 1 to max_range steps away. The dict is cached, don't modify it"""
+        max_range = min(max_range, self.max_range)
+        squares = self._ranges.get(max_range)
+        if squares is None:
+            squares = dict()
+            stride, x_base, y_base = self._stride, self.x_min - 1, self.y_min - 1
+            start = 0
+            for distance in range(1, max_range + 1):
+                end = self._level_ends[distance] if distance < len(self._level_ends) else len(self._order)
+                for cell in self._order[start:end]:
+                    row, col = divmod(cell, stride)
+                    squares[Coordinate(x_base + col, y_base + row)] = distance
+                start = end
+            self._ranges[max_range] = squares
+        return squares
+
+    def mask_within(self, max_range):
+        """returns a boolean array over the window, true for squares 1 to max_range steps away"""
+        return (self.distance > 0) & (self.distance <= max_range)
+
+    def target_mask(self, max_range, blast_radius):
+        """returns a boolean array over the window, true for squares 1 to max_range steps away that
+        are outside blast_radius of the origin. The array is cached, don't modify it"""
+        key = (min(max_range, self.max_range), blast_radius)
+        mask = self._target_masks.get(key)
+        if mask is None:
+            rows, cols = self.distance.shape
+            ys, xs = np.ogrid[self.y_min:self.y_min + rows, self.x_min:self.x_min + cols]
+            safe = np.maximum(np.abs(xs - self.origin.x), np.abs(ys - self.origin.y)) > blast_radius
+            mask = self._target_masks[key] = self.mask_within(key[0]) & safe
+        return mask
+
+
+def distance_field(blocked, origin, max_range):
+    """Runs a BFS from origin over the blocked layer and returns a DistanceField"""
+    height, width = blocked.shape
+    x_min, x_max = max(1, origin.x - max_range), min(width, origin.x + max_range)
+    y_min, y_max = max(1, origin.y - max_range), min(height, origin.y + max_range)
+    window = blocked[y_min - 1:y_max, x_min - 1:x_max]
+    rows, cols = window.shape
+
+    #pad with a blocked border so neighbours never need a bounds check
+    stride = cols + 2
+    passable = np.pad(~window, 1, constant_values=False).view(np.uint8).tobytes()
+    distance = [-1] * len(passable)
+    offsets = (-stride, 1, stride, -1)
+    start = (origin.y - y_min + 1) * stride + (origin.x - x_min + 1)
+    distance[start] = 0
+    order = list()
+    level_ends = [0]
+    frontier = [start]
+    for level in range(1, max_range + 1):
+        next_frontier = list()
+        for cell in frontier:
+            for offset in offsets:
+                neighbor = cell + offset
+                if passable[neighbor] and distance[neighbor] < 0:
+                    distance[neighbor] = level
+                    next_frontier.append(neighbor)
+        if not next_frontier:
+            break
+        order.extend(next_frontier)
+        level_ends.append(len(order))
+        frontier = next_frontier
+
+    grid = np.array(distance, dtype=np.int32).reshape(rows + 2, stride)[1:-1, 1:-1]
+    return DistanceField(origin, max_range, x_min, y_min, grid, order, level_ends, stride)
+
+
+class ReachabilityIndex():
+    """LRU cache of distance fields over a GameMap's obstacle layer"""
+
+    def __init__(self, game_map, cache_size=DEFAULT_CACHE_SIZE):
+        self.game_map = game_map
+        self.cache_size = cache_size
+        self._fields = OrderedDict()
+        self._obstacle_version = game_map.obstacle_version
+
+    def field(self, origin, max_range):
+        """returns a DistanceField from origin covering at least max_range steps"""
+        if self._obstacle_version != self.game_map.obstacle_version:
+            self.clear()
+        field = self._fields.get(origin)
+        if field is not None and field.max_range >= max_range:
+            self._fields.move_to_end(origin)
+            return field
+        if origin not in self.game_map:
+            raise ValueError("location {0} is invalid".format(origin))
+        field = distance_field(self.game_map.blocked, origin, max_range)
+        self._fields[origin] = field
+        self._fields.move_to_end(origin)
+        if len(self._fields) > self.cache_size:
+            self._fields.popitem(last=False)
+        return field
+
+    def add(self, field, obstacle_version):
+        """adds a field computed elsewhere, such as a background thread, if the obstacles it saw are still current"""
+        if obstacle_version != self.game_map.obstacle_version:
+            return False
+        if self._obstacle_version != obstacle_version:
+            self.clear()
+        cached = self._fields.get(field.origin)
+        if cached is None or cached.max_range < field.max_range:
+            self._fields[field.origin] = field
+        self._fields.move_to_end(field.origin)
+        if len(self._fields) > self.cache_size:
+            self._fields.popitem(last=False)
+        return True
+
+    def squares_in_range(self, origin, max_range):
+        """returns {coordinate: distance} for open squares 1 to max_range steps from origin"""
+        return self.field(origin, max_range).squares_within(max_range)
+
+    def covers(self, origin, max_range):
+        """returns true if a cached field already covers max_range steps from origin"""
+        field = self._fields.get(origin)
+        return field is not None and field.max_range >= max_range \
+            and self._obstacle_version == self.game_map.obstacle_version
+
+    def clear(self):
+        """Drops every cached field"""
+        self._fields.clear()
+        self._obstacle_version = self.game_map.obstacle_version
@@ -0,0 +1,305 @@
+"""Parallel Monte Carlo rollout evaluation.
+
+GameSnapshot is a compact copy of what one sub knows at the start of a turn: the obstacle and
+foreign object layers as NumPy arrays plus a few tuples for the sub, sonar pings and
+detonations. RolloutEngine publishes the layers into one multiprocessing shared memory block
+and farms chunks of rollouts out to a persistent process pool. Each job only carries the
+small tuples, and workers read the layers straight from shared memory.
+
+A rollout plays a candidate command and then a random default policy for a few turns against
+enemies placed on the foreign objects and sonar pings we saw. The enemies wander at random
+and now and then fire at us. The score is discounted damage dealt minus damage taken, with a
+little credit for pings that find something. evaluate() collects whatever chunks finish
+before its deadline and returns the mean score per command.
+
+start() brings every worker up before the first hard turn needs them. The workers are
+started by a fork server, or spawned where there isn't one, rather than forked from the bot,
+which by then may be running trace, speculation and profiler threads.
+"""
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+import numpy as np
+from commands import FireCommand, PingCommand, MoveCommand
+
+DEFAULT_ROLLOUTS = 2000
+DEFAULT_HORIZON = 6
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_TURN_BUDGET = 0.1
+DISCOUNT = 0.9
+BLAST_RADIUS = 1
+DIRECT_HIT_DAMAGE = 2
+NEAR_MISS_DAMAGE = 1
+DAMAGE_TAKEN_WEIGHT = 1.5
+PING_FIND_WEIGHT = 0.25
+ENEMY_FIRE_CHANCE = 0.15
+#enemies near a recent detonation are assumed to be shooting at something
+DETONATION_FIRE_CHANCE = 0.4
+ENEMY_TORPEDO_RANGE = 6
+MAX_CHARGE = 8
+MOVES = {"N": (0, -1), "E": (1, 0), "S": (0, 1), "W": (-1, 0)}
+EQUIPMENT = ("Sonar", "Torpedo")
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+#long enough that every worker picks up one of start()'s warm up jobs
+WARM_UP_SECONDS = 0.05
+
+
+def encode_command(command):
+    """returns a command as a small picklable tuple"""
+    if isinstance(command, FireCommand):
+        return ("F", command.destination.x, command.destination.y)
+    if isinstance(command, PingCommand):
+        return ("P",)
+    if isinstance(command, MoveCommand):
+        return ("M", str(command.direction), str(command.equip))
+    raise ValueError("Unknown command {0}".format(command))
+
+
+class GameSnapshot():
+    """What one sub knows at the start of a turn, in a form that's cheap to copy and share"""
+    __slots__ = ('turn_number', 'blocked', 'foreign', 'sub', 'spotted', 'detonations', 'obstacle_version')
+
+    def __init__(self, turn_number, blocked, foreign, sub, spotted, detonations, obstacle_version=0):
+        self.turn_number = turn_number
+        self.blocked = blocked
+        self.foreign = foreign
+        #(x, y, sonar range, torpedo range, shields)
+        self.sub = sub
+        self.spotted = spotted
+        self.detonations = detonations
+        self.obstacle_version = obstacle_version
+
+    @classmethod
+    def from_bot(cls, bot, sub):
+        """returns a snapshot of bot's view of the game for one of its subs. The layers are not copied"""
+        return cls(bot.turn_number, bot.game_map.blocked, bot.game_map.foreign_object_size,
+                   (sub.location.x, sub.location.y, sub.sonar_range, sub.torpedo_range, sub.shield_count),
+                   tuple((message.location.x, message.location.y) for message in bot.spotted),
+                   tuple((message.location.x, message.location.y) for message in bot.detonations),
+                   bot.game_map.obstacle_version)
+
+    def copy(self):
+        """returns a snapshot with its own copies of the layers"""
+        return GameSnapshot(self.turn_number, self.blocked.copy(), self.foreign.copy(), self.sub,
+                            self.spotted, self.detonations, self.obstacle_version)
+
+
+def _attach(name):
+    """attaches to the engine's shared memory block.
+    Pool workers share the engine's resource tracker, so the block stays registered to the engine"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError: #track needs Python 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+#worker side cache of the attached block, so it's attached once per process and game
+_attached = dict()
+
+
+def _layers(name, height, width):
+    block = _attached.get(name)
+    if block is None:
+        for old in _attached.values():
+            old.close()
+        _attached.clear()
+        block = _attached[name] = _attach(name)
+    blocked = np.ndarray((height, width), dtype=np.bool_, buffer=block.buf)
+    foreign = np.ndarray((height, width), dtype=np.int32, buffer=block.buf, offset=height * width)
+    return blocked, foreign
+
+
+def _warm_up(seconds):
+    """keeps a freshly started worker busy for a moment and returns its pid"""
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def _rollout_chunk(job):
+    """runs rollouts for every candidate and returns [(total score, rollouts)] in candidate order"""
+    name, height, width, sub, spotted, detonations, candidates, rollouts, horizon, seed, deadline = job
+    blocked, foreign = _layers(name, height, width)
+    x, y = sub[0], sub[1]
+    #enemies that could matter are within reach of where we'll be over the horizon
+    reach = horizon + ENEMY_TORPEDO_RANGE
+    y_min, x_min = max(1, y - reach), max(1, x - reach)
+    window = foreign[y_min - 1:y + reach, x_min - 1:x + reach]
+    rows, cols = np.nonzero(window > 0)
+    enemies = [(int(x_min + col), int(y_min + row)) for row, col in zip(rows, cols) if (x_min + col, y_min + row) != (x, y)]
+    enemies.extend(coord for coord in spotted if coord not in enemies)
+
+    def open_square(square_x, square_y):
+        return 1 <= square_x <= width and 1 <= square_y <= height and not blocked[square_y - 1, square_x - 1]
+
+    rng = random.Random(seed)
+    results = [[0.0, 0] for _ in candidates]
+    for count in range(rollouts):
+        if count % 16 == 0 and time.monotonic() > deadline:
+            break
+        for idx, candidate in enumerate(candidates):
+            results[idx][0] += _rollout(rng, open_square, sub, enemies, detonations, candidate, horizon)
+            results[idx][1] += 1
+    return results
+
+
+def _blast(target_x, target_y, victims):
+    """returns the damage a blast at target does to each victim"""
+    damage = list()
+    for vx, vy in victims:
+        distance = max(abs(vx - target_x), abs(vy - target_y))
+        damage.append(DIRECT_HIT_DAMAGE if distance == 0 else NEAR_MISS_DAMAGE if distance <= BLAST_RADIUS else 0)
+    return damage
+
+
+def _rollout(rng, open_square, sub, enemies, detonations, first, horizon):
+    """plays first and then a random policy for horizon turns, returning the discounted score"""
+    x, y, sonar, torpedo, shields = sub
+    enemies = [list(enemy) for enemy in enemies]
+    health = [3] * len(enemies)
+    danger = any(max(abs(dx - x), abs(dy - y)) <= ENEMY_TORPEDO_RANGE for dx, dy in detonations)
+    score, weight = 0.0, 1.0
+    for step in range(horizon):
+        action = first if step == 0 else None
+        if action is None:
+            #default policy: shoot at anything in reach that won't hit us, otherwise wander
+            live = [enemy for enemy, hp in zip(enemies, health) if hp >= 0]
+            shots = [enemy for enemy in live if 2 <= torpedo and abs(enemy[0] - x) + abs(enemy[1] - y) <= torpedo
+                     and max(abs(enemy[0] - x), abs(enemy[1] - y)) > BLAST_RADIUS]
+            if shots:
+                target = rng.choice(shots)
+                action = ("F", target[0], target[1])
+            elif sonar >= 4 and rng.random() < 0.2:
+                action = ("P",)
+            else:
+                action = ("M", rng.choice("NESW"), rng.choice(EQUIPMENT))
+
+        kind = action[0]
+        if kind == "F":
+            if torpedo >= 2 and abs(action[1] - x) + abs(action[2] - y) <= torpedo:
+                for idx, damage in enumerate(_blast(action[1], action[2], enemies)):
+                    if damage and health[idx] >= 0:
+                        health[idx] -= damage
+                        score += weight * damage
+                own = _blast(action[1], action[2], ((x, y),))[0]
+                shields -= own
+                score -= weight * DAMAGE_TAKEN_WEIGHT * own
+                torpedo = 0
+        elif kind == "P":
+            found = sum(1 for (ex, ey), hp in zip(enemies, health)
+                        if hp >= 0 and max(abs(ex - x), abs(ey - y)) <= sonar)
+            score += weight * PING_FIND_WEIGHT * found
+            sonar = 0
+        else:
+            dx, dy = MOVES[action[1]]
+            if open_square(x + dx, y + dy):
+                x, y = x + dx, y + dy
+            if action[2] == "Sonar":
+                sonar = min(MAX_CHARGE, sonar + 1)
+            else:
+                torpedo = min(MAX_CHARGE, torpedo + 1)
+
+        chance = DETONATION_FIRE_CHANCE if danger and step == 0 else ENEMY_FIRE_CHANCE
+        for enemy, hp in zip(enemies, health):
+            if hp < 0:
+                continue
+            dx, dy = MOVES[rng.choice("NESW")]
+            if open_square(enemy[0] + dx, enemy[1] + dy):
+                enemy[0] += dx
+                enemy[1] += dy
+            if abs(enemy[0] - x) + abs(enemy[1] - y) <= ENEMY_TORPEDO_RANGE and rng.random() < chance:
+                damage = DIRECT_HIT_DAMAGE if rng.random() < 0.5 else NEAR_MISS_DAMAGE
+                shields -= damage
+                score -= weight * DAMAGE_TAKEN_WEIGHT * damage
+        if shields < 0:
+            break
+        weight *= DISCOUNT
+    return score
+
+
+class RolloutEngine():
+    """Scores candidate commands with rollouts spread across a persistent process pool"""
+
+    def __init__(self, processes=None, rollouts=DEFAULT_ROLLOUTS, horizon=DEFAULT_HORIZON,
+                 chunk_size=DEFAULT_CHUNK_SIZE, budget=DEFAULT_TURN_BUDGET):
+        self.processes = processes
+        self.rollouts = rollouts
+        self.horizon = horizon
+        self.chunk_size = chunk_size
+        self.budget = budget
+        self.pool = None
+        self.block = None
+        self.shape = None
+        self._obstacle_version = None
+        self._seed = random.Random()
+        self.completed = 0
+
+    def start(self):
+        """Starts the worker processes and waits until every one of them is up"""
+        if self.pool is None:
+            processes = self.processes or os.cpu_count() or 1
+            self.pool = ProcessPoolExecutor(max_workers=processes,
+                                            mp_context=multiprocessing.get_context(START_METHOD))
+            wait([self.pool.submit(_warm_up, WARM_UP_SECONDS) for _ in range(processes)])
+
+    def close(self):
+        """Stops the workers and frees the shared memory"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+            self.shape = None
+
+    def publish(self, snapshot):
+        """Copies a snapshot's layers into shared memory for the workers"""
+        height, width = snapshot.blocked.shape
+        if self.shape != (height, width):
+            if self.block is not None:
+                self.block.close()
+                self.block.unlink()
+            self.block = shared_memory.SharedMemory(create=True, size=height * width * 5)
+            self.shape = (height, width)
+            self._obstacle_version = None
+        buffer = self.block.buf
+        if self._obstacle_version != snapshot.obstacle_version:
+            np.ndarray((height, width), dtype=np.bool_, buffer=buffer)[:] = snapshot.blocked
+            self._obstacle_version = snapshot.obstacle_version
+        np.ndarray((height, width), dtype=np.int32, buffer=buffer, offset=height * width)[:] = snapshot.foreign
+
+    def evaluate(self, snapshot, commands, deadline=None):
+        """Returns {command: (mean score, rollouts)} for the commands whose rollouts finished by deadline.
+        deadline is a time.monotonic() value and defaults to budget seconds from now"""
+        if not commands:
+            return dict()
+        if deadline is None:
+            deadline = time.monotonic() + self.budget
+        self.start()
+        self.publish(snapshot)
+        height, width = self.shape
+        candidates = [encode_command(command) for command in commands]
+        jobs = list()
+        remaining = self.rollouts
+        while remaining > 0:
+            count = min(self.chunk_size, remaining)
+            remaining -= count
+            jobs.append((self.block.name, height, width, snapshot.sub, snapshot.spotted, snapshot.detonations,
+                         candidates, count, self.horizon, self._seed.getrandbits(32), deadline))
+        futures = [self.pool.submit(_rollout_chunk, job) for job in jobs]
+        done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+        for future in not_done:
+            future.cancel()
+
+        totals = [[0.0, 0] for _ in candidates]
+        for future in done:
+            if future.cancelled() or future.exception() is not None:
+                continue
+            for total, chunk in zip(totals, future.result()):
+                total[0] += chunk[0]
+                total[1] += chunk[1]
+        self.completed = sum(count for _, count in totals)
+        return dict((command, (total / count, count)) for command, (total, count) in zip(commands, totals) if count)
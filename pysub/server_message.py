@@ -1,128 +1,156 @@
-"""Methods for managing server messages"""
+"""Methods for managing server messages
+
+Messages use __slots__ and only keep their parsed fields, not the split line, so a long run
+of games doesn't pile up per-message dicts and part lists.
+"""
+from message_parser import parse_bool
 from util import Coordinate
 
+def split_message(prefix, message_type, min_part_count, message):
+    """returns the parts of a message, raising ValueError if it isn't a valid message of its type"""
+    if message is None or not message.startswith(prefix):
+        raise ValueError("Invalid {0} message: {1}".format(message_type, message))
+    parts = message.split("|")
+    if len(parts) < min_part_count:
+        raise ValueError("Invalid {0} message: {1}".format(message_type, message))
+    return parts
+
 class ServerMessage:
     """Base class of server messages"""
+    __slots__ = ('part_count',)
 
-    def __init__(self, prefix, message_type, min_part_count, message):
-        self.parts = message.split("|") if message is not None else list()
-        if not message.startswith(prefix) or len(self.parts) < min_part_count:
-            raise ValueError("Invalid {0} message: {1}".format(message_type, message))
-        self.part_count = len(self.parts)
-
-    def get_part(self, idx):
-        """returns part at index"""
-        return self.parts[idx]
+    def __init__(self, parts):
+        self.part_count = len(parts)
 
 class GameSettingMessage(ServerMessage):
     """Messages for game settings"""
+    __slots__ = ('setting_name', 'values')
     prefix = "V"
     message_type = "game setting"
     min_part_count = 3
-    values = list()
 
     def __init__(self, message):
-        super(GameSettingMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.setting_name = self.get_part(1)
-        for idx in range(2, self.part_count):
-            self.values.append(self.get_part(idx))
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(GameSettingMessage, self).__init__(parts)
+        self.setting_name = parts[1]
+        self.values = parts[2:]
 
 class GameConfigMessage(ServerMessage):
     """Messages for custom game settings"""
+    __slots__ = ('server_version', 'game_title', 'map_width', 'map_height', 'settings_count', 'custom_settings')
     prefix = "C"
     message_type = "game config"
     min_part_count = 5
-    custom_settings = list()
 
     def __init__(self, message, socket_manager):
-        super(GameConfigMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.server_version = self.get_part(1)
-        self.game_title = self.get_part(2)
-        self.map_width = int(self.get_part(3))
-        self.map_height = int(self.get_part(4))
-        self.settings_count = int(self.get_part(5))
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(GameConfigMessage, self).__init__(parts)
+        self.server_version = parts[1]
+        self.game_title = parts[2]
+        self.map_width = int(parts[3])
+        self.map_height = int(parts[4])
+        self.settings_count = int(parts[5])
+        self.custom_settings = list()
 
         for _ in range(self.settings_count):
             self.custom_settings.append(GameSettingMessage(socket_manager.receive_message()))
 
 class TurnMessage(ServerMessage):
     """message for turn info"""
-    def __init__(self, prefix, message_type, min_part_count, message):
-        super(TurnMessage, self).__init__(prefix, message_type, min_part_count, message)
-        self.turn_number = int(self.get_part(1))
+    __slots__ = ('turn_number',)
+
+    def __init__(self, parts):
+        super(TurnMessage, self).__init__(parts)
+        self.turn_number = int(parts[1])
 
 class BeginTurnMessage(TurnMessage):
     """Begins turn"""
+    __slots__ = ()
     prefix = "B"
     message_type = "begin turn"
     min_part_count = 2
 
     def __init__(self, message):
-        super(BeginTurnMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(BeginTurnMessage, self).__init__(parts)
 
 class SonarDetectionMessage(TurnMessage):
     """Message recording sonar activations in the turn"""
+    __slots__ = ('location',)
     prefix = "S"
     message_type = "sonar detection"
     min_part_count = 4
 
     def __init__(self, message):
-        super(SonarDetectionMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(SonarDetectionMessage, self).__init__(parts)
+        self.location = Coordinate(int(parts[2]), int(parts[3]))
 
 class DetonationMessage(TurnMessage):
     """Message of detonation that occurred in this turn"""
+    __slots__ = ('location', 'radius')
     prefix = "D"
     message_type = "detonation"
     min_part_count = 5
 
     def __init__(self, message):
-        super(DetonationMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.location = Coordinate(int(self.get_part(2)), int(self.get_part(3)))
-        self.radius = int(self.get_part(4))
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(DetonationMessage, self).__init__(parts)
+        self.location = Coordinate(int(parts[2]), int(parts[3]))
+        self.radius = int(parts[4])
 
 class DiscoveredObjectMessage(TurnMessage):
     """Message notifying of objects discovered by sonar"""
+    __slots__ = ('location', 'size')
     prefix = "O"
     message_type = "discovered object"
     min_part_count = 5
 
     def __init__(self, message):
-        super(DiscoveredObjectMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.location = Coordinate(int(self.get_part(2)), int(self.get_part(3)))
-        self.size = int(self.get_part(4))
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(DiscoveredObjectMessage, self).__init__(parts)
+        self.location = Coordinate(int(parts[2]), int(parts[3]))
+        self.size = int(parts[4])
 
 class TorpedoHitMessage(TurnMessage):
     """Message notifying player of their hits."""
+    __slots__ = ('location', 'damage')
     prefix = "T"
     message_type = "torpedo hit"
     min_part_count = 5
 
     def __init__(self, message):
-        super(TorpedoHitMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.location = Coordinate(self.get_part(2), self.get_part(3))
-        self.damage = int(self.get_part(4))
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(TorpedoHitMessage, self).__init__(parts)
+        self.location = Coordinate(int(parts[2]), int(parts[3]))
+        self.damage = int(parts[4])
 
 class SubmarineInfoMessage(TurnMessage):
     """Message sent to each player to relay status of submarine"""
+    __slots__ = ('sub_id', 'location', 'active', 'dead', 'shield_count', 'size', 'torpedo_count', 'sonar_range',
+                 'max_sonar_charge', 'torpedo_range', 'max_torpedo_charge', 'reactor_damage')
     prefix = "I"
     message_type = "submarine info"
     min_part_count = 6
 
-    dead = False
-    shield_count = 0
-    sonar_range = 0
-    torpedo_range = 0
-    max_sonar_charge = False
-    max_torpedo_charge = False
-
     def __init__(self, message):
-        super(SubmarineInfoMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.sub_id = int(self.get_part(2))
-        self.location = Coordinate(int(self.get_part(3)), int(self.get_part(4)))
-        self.active = (self.get_part(5) == 1)
-
-        for i in range(6, self.part_count):
-            split = self.get_part(i).split('=')
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(SubmarineInfoMessage, self).__init__(parts)
+        self.sub_id = int(parts[2])
+        self.location = Coordinate(int(parts[3]), int(parts[4]))
+        self.active = parts[5] == "1"
+        self.dead = False
+        self.shield_count = 0
+        self.size = 0
+        self.torpedo_count = 0
+        self.sonar_range = 0
+        self.max_sonar_charge = False
+        self.torpedo_range = 0
+        self.max_torpedo_charge = False
+        self.reactor_damage = 0
+
+        for part in parts[6:]:
+            split = part.split('=')
             if len(split) != 2:
                 raise ValueError("invalid submarine info message: {0}".format(message))
             elif split[0] == "shields":
@@ -134,49 +162,55 @@ class SubmarineInfoMessage(TurnMessage):
             elif split[0] == "sonar_range":
                 self.sonar_range = int(split[1])
             elif split[0] == "max_sonar":
-                self.max_sonar_charge = split[1]
+                self.max_sonar_charge = parse_bool(split[1])
             elif split[0] == "torpedo_range":
                 self.torpedo_range = int(split[1])
             elif split[0] == "max_torpedo":
-                self.max_torpedo_charge = split[1]
+                self.max_torpedo_charge = parse_bool(split[1])
             elif split[0] == "reactor_damage":
-                self.reactor_damage = split[1]
+                self.reactor_damage = int(split[1])
             elif split[0] == "dead":
-                self.dead = split[1] == 1
+                self.dead = parse_bool(split[1])
 
 class PlayerScoreMessage(TurnMessage):
     """Notifies player of their score"""
+    __slots__ = ('score',)
     prefix = "H"
     message_type = "player score"
     min_part_count = 3
 
     def __init__(self, message):
-        super(PlayerScoreMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.score = self.get_part(2)
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(PlayerScoreMessage, self).__init__(parts)
+        self.score = parts[2]
 
 class PlayerResultMessage(ServerMessage):
     """Player results"""
+    __slots__ = ('player_name', 'player_score')
     prefix = "P"
     message_type = "player result"
     min_part_count = 3
 
     def __init__(self, message):
-        super(PlayerResultMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.player_name = self.get_part(1)
-        self.player_score = int(self.get_part(2))
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(PlayerResultMessage, self).__init__(parts)
+        self.player_name = parts[1]
+        self.player_score = int(parts[2])
 
 class GameFinishedMessage(ServerMessage):
     """Reports result of the game"""
+    __slots__ = ('player_count', 'turn_count', 'game_state', 'player_results')
     prefix = "F"
     message_type = "game finished"
     min_part_count = 4
-    player_results = list()
 
     def __init__(self, message, socket_manager):
-        super(GameFinishedMessage, self).__init__(self.prefix, self.message_type, self.min_part_count, message)
-        self.player_count = int(self.get_part(1))
-        self.turn_count = int(self.get_part(2))
-        self.game_state = self.get_part(3)
+        parts = split_message(self.prefix, self.message_type, self.min_part_count, message)
+        super(GameFinishedMessage, self).__init__(parts)
+        self.player_count = int(parts[1])
+        self.turn_count = int(parts[2])
+        self.game_state = parts[3]
+        self.player_results = list()
         for _ in range(self.player_count):
             self.player_results.append(PlayerResultMessage(socket_manager.receive_message()))
             
\ No newline at end of file
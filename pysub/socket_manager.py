@@ -1,14 +1,41 @@
 """Module to handle socket connections and messaging"""
 import socket
+from transcript import TranscriptRecorder
+from trace_log import TraceLog, DISABLED, DEBUG
+
+RECEIVE_BUFFER_SIZE = 65536
+
+def encode_messages(messages):
+    """Validates messages and encodes them as newline terminated utf-8"""
+    lines = list()
+    for message in messages:
+        message = str(message)
+        if not message.strip():
+            raise ValueError("Cannot send null or empty message")
+        if "\n" in message:
+            raise ValueError("Cannot send multiline messages")
+        lines.append(message)
+    lines.append("")
+    return "\n".join(lines).encode('utf-8')
 
 class SocketManager():
     """Handles a socket connection"""
     socket = None
+    recorder = None
 
-    def __init__(self, server_address, server_port, verbose):
+    def __init__(self, server_address, server_port, verbose, buffer_size=RECEIVE_BUFFER_SIZE, trace=None):
         self.server_address = server_address
         self.server_port = server_port
         self.verbose = verbose
+        if trace is None:
+            trace = TraceLog.console() if verbose else DISABLED
+        self.trace = trace
+        #received bytes live in _buffer[_start:_end], _scan marks how far we've looked for a newline
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+        self._scan = 0
 
     def is_connected(self):
         """Returns true if currently connected to a socket"""
@@ -31,23 +58,37 @@ class SocketManager():
         if self.socket is not None:
             self.socket.close()
             self.socket = None
+        self._start = self._end = self._scan = 0
+        self.stop_recording()
+
+    def start_recording(self, path):
+        """Appends every received and sent message to the transcript at path"""
+        self.stop_recording()
+        self.recorder = TranscriptRecorder(path)
+
+    def stop_recording(self):
+        """Closes the transcript, if one is being recorded"""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     def send_message(self, message):
         """Sends a message via socket"""
-        message = str(message)
-        if not message.strip():
-            raise ValueError("Cannot send null or empty message")
-        if "\n" in message:
-            raise ValueError("Cannot send multiline messages")
+        self.send_messages((message,))
 
-        message += "\n"
-        byte_message = message.encode('utf-8')
+    def send_messages(self, messages):
+        """Sends several messages with a single write"""
+        byte_message = encode_messages(messages)
         if self.is_connected():
-            if self.verbose:
-                print("SEND: {0}".format(message))
+            if self.recorder is not None:
+                for message in messages:
+                    self.recorder.sent(str(message))
+            if self.trace.level <= DEBUG:
+                self.trace.record(DEBUG, "send", "{0}", byte_message.decode('utf-8').rstrip("\n"))
+            view = memoryview(byte_message)
             total_sent = 0
             while total_sent < len(byte_message):
-                sent = self.socket.send(byte_message[total_sent:])
+                sent = self.socket.send(view[total_sent:])
                 if sent == 0:
                     raise RuntimeError("Socket connection broken")
                 total_sent = total_sent + sent
@@ -58,20 +99,60 @@ class SocketManager():
     def receive_message(self):
         """Receives a message via socket"""
         if self.is_connected():
-            delimiter_received = False
-            message_list = list()
-            while not delimiter_received:
-                message_chunk = self.socket.recv(1).decode('utf-8')
-                if not message_chunk:
+            newline = self._find_newline()
+            while newline == -1:
+                if not self._fill():
+                    #connection closed, hand back whatever partial message is left
+                    message = self._take(self._end)
                     break
-                message_list.append(message_chunk)
-                if "\n" in message_chunk:
-                    delimiter_received = True
-            message = ''.join(message_list).strip()
-            if self.verbose:
-                print("RECV: {0}".format(message))
-            if "\n" in message:
-                raise ValueError("You accidentally got two messages")
+                newline = self._find_newline()
+            else:
+                message = self._take(newline)
+            if self.recorder is not None:
+                self.recorder.received(message)
+            if self.trace.level <= DEBUG:
+                self.trace.record(DEBUG, "recv", message)
             return message
         else:
             raise IOError("Not Connected")
+
+    def receive_messages(self):
+        """Yields the next message followed by every complete message already buffered"""
+        yield self.receive_message()
+        while self.has_buffered_message():
+            yield self.receive_message()
+
+    def has_buffered_message(self):
+        """Returns true if a complete message can be read without touching the socket"""
+        return self._find_newline() != -1
+
+    def _find_newline(self):
+        """Returns the index of the next buffered newline or -1"""
+        newline = self._buffer.find(b"\n", self._scan, self._end)
+        self._scan = self._end if newline == -1 else newline
+        return newline
+
+    def _take(self, stop):
+        """Decodes and consumes buffered bytes up to stop, skipping the delimiter"""
+        message = self._view[self._start:stop].tobytes().decode('utf-8').strip()
+        self._start = self._scan = stop + 1
+        if self._start >= self._end:
+            self._start = self._end = self._scan = 0
+        return message
+
+    def _fill(self):
+        """Reads as much as is available into the buffer. Returns False if the connection closed"""
+        if self._end == len(self._buffer):
+            if self._start > 0:
+                pending = self._end - self._start
+                self._buffer[:pending] = self._view[self._start:self._end].tobytes()
+                self._scan -= self._start
+                self._start, self._end = 0, pending
+            else:
+                #a single message longer than the buffer, so grow it
+                self._view.release()
+                self._buffer.extend(bytes(len(self._buffer)))
+                self._view = memoryview(self._buffer)
+        received = self.socket.recv_into(self._view[self._end:])
+        self._end += received
+        return received > 0
@@ -0,0 +1,65 @@
+"""Bucketed spatial index of points on the map.
+
+Points go into square buckets bucket_size squares on a side, keyed by bucket coordinates in a
+dict, so only buckets that hold something take memory. Chebyshev range queries visit only the
+buckets overlapping the query box, so query cost follows the number of nearby points rather
+than the map size.
+"""
+DEFAULT_BUCKET_SIZE = 8
+
+
+class SpatialIndex():
+    """Grid bucket index of (coordinate, payload) entries"""
+
+    def __init__(self, bucket_size=DEFAULT_BUCKET_SIZE):
+        self.bucket_size = bucket_size
+        self.buckets = dict()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _key(self, x, y):
+        return (x // self.bucket_size, y // self.bucket_size)
+
+    def insert(self, coord, payload=None):
+        """adds an entry at coord"""
+        key = self._key(coord.x, coord.y)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = list()
+        bucket.append((coord, payload))
+        self.count += 1
+
+    def clear(self):
+        """Removes every entry"""
+        self.buckets.clear()
+        self.count = 0
+
+    def within(self, location, radius):
+        """returns [(coordinate, payload)] for entries within Chebyshev distance radius of location"""
+        found = list()
+        (x_low, y_low), (x_high, y_high) = self._key(location.x - radius, location.y - radius), \
+            self._key(location.x + radius, location.y + radius)
+        buckets = self.buckets
+        for bucket_y in range(y_low, y_high + 1):
+            for bucket_x in range(x_low, x_high + 1):
+                bucket = buckets.get((bucket_x, bucket_y))
+                if bucket is None:
+                    continue
+                for entry in bucket:
+                    coord = entry[0]
+                    if abs(coord.x - location.x) <= radius and abs(coord.y - location.y) <= radius:
+                        found.append(entry)
+        return found
+
+    def any_within(self, location, radius):
+        """returns true if any entry is within Chebyshev distance radius of location"""
+        (x_low, y_low), (x_high, y_high) = self._key(location.x - radius, location.y - radius), \
+            self._key(location.x + radius, location.y + radius)
+        for bucket_y in range(y_low, y_high + 1):
+            for bucket_x in range(x_low, x_high + 1):
+                for coord, _ in self.buckets.get((bucket_x, bucket_y), ()):
+                    if abs(coord.x - location.x) <= radius and abs(coord.y - location.y) <= radius:
+                        return True
+        return False
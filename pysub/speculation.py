@@ -0,0 +1,154 @@
+"""Speculative next-turn precomputation.
+
+Once a turn's commands are sent the bot sits blocked on the socket until the next B message.
+Speculator spends that wait on a background thread, building what the next turn will probably
+need for each live sub:
+    * distance fields from the sub's square and each open neighbour, covering the torpedo range
+      the sub could have next turn, along with the squares it could fire at from there
+    * the route toward the sub's destination from each of those squares, unless it's known
+
+The worker only reads the obstacle layer, which is fixed once the game is configured, and never
+touches the bot's caches. prime() installs the results on the main thread at the start of the
+next turn if they were made for the previous turn and the obstacles haven't changed since.
+Anything else is thrown away and the bot computes what it needs as usual.
+"""
+import threading
+from reachability import distance_field
+from targeting import BLAST_RADIUS
+
+#a sub gains at most two charges a turn, by sleeping
+MAX_CHARGE_PER_TURN = 2
+MIN_TORPEDO_RANGE = 2
+
+
+class Speculation():
+    """The work queued for one turn and the results the worker has finished so far"""
+    __slots__ = ('turn_number', 'obstacle_version', 'blocked', 'passable', 'field_jobs', 'route_jobs',
+                 'fields', 'routes')
+
+    def __init__(self, turn_number, obstacle_version, blocked, passable, field_jobs, route_jobs):
+        self.turn_number = turn_number
+        self.obstacle_version = obstacle_version
+        self.blocked = blocked
+        self.passable = passable
+        self.field_jobs = field_jobs
+        self.route_jobs = route_jobs
+        self.fields = list()
+        self.routes = list()
+
+
+class Speculator():
+    """Background thread that precomputes likely next-turn fields and routes for a PySub"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.hits = 0
+        self.misses = 0
+        self._condition = threading.Condition()
+        self._pending = None
+        self._latest = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Starts the worker thread"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._work, name="speculator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the worker thread and drops any queued work"""
+        with self._condition:
+            self._running = False
+            self._pending = None
+            self._latest = None
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def speculate(self):
+        """Queues precomputation for the next turn. Call once this turn's commands are sent"""
+        bot = self.bot
+        game_map, reachability, pathfinder = bot.game_map, bot.reachability, bot.pathfinder
+        field_jobs, route_jobs = list(), list()
+        for sub in bot.subs.values():
+            if sub.dead or sub.location is None or sub.location not in game_map:
+                continue
+            starts = [sub.location]
+            starts.extend(square for _, square in game_map.open_neighbors(sub.location))
+            max_range = sub.torpedo_range + MAX_CHARGE_PER_TURN
+            destination = bot.destinations.get(sub.sub_id)
+            for start in starts:
+                if max_range >= MIN_TORPEDO_RANGE and not reachability.covers(start, max_range):
+                    field_jobs.append((start, max_range))
+                if destination is not None and start != destination \
+                        and not pathfinder.knows_route(start, destination):
+                    route_jobs.append((start, destination))
+
+        speculation = Speculation(bot.turn_number, game_map.obstacle_version, game_map.blocked,
+                                  pathfinder.passable(), field_jobs, route_jobs)
+        with self._condition:
+            self._pending = speculation
+            self._latest = speculation
+            self._condition.notify()
+
+    def prime(self):
+        """Installs whatever the worker finished during the previous turn's wait. The worker drops
+        the rest of that work at its next job but keeps running for the next speculate().
+        Returns true if any of it was used"""
+        with self._condition:
+            speculation, self._latest = self._latest, None
+            if speculation is self._pending:
+                self._pending = None
+        bot = self.bot
+        if speculation is not None and not speculation.field_jobs and not speculation.route_jobs:
+            return False #everything was already cached
+        if speculation is None or speculation.turn_number != bot.turn_number - 1 \
+                or speculation.obstacle_version != bot.game_map.obstacle_version:
+            self.misses += 1
+            return False
+
+        #results are appended one at a time, so a partial list is still good
+        used = False
+        locations = set(sub.location for sub in bot.subs.values() if not sub.dead)
+        for field in list(speculation.fields):
+            if field.origin in locations:
+                used = bot.reachability.add(field, speculation.obstacle_version) or used
+        for cells in list(speculation.routes):
+            bot.pathfinder.remember_route(cells)
+            used = True
+        if used:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return used
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                speculation, self._pending = self._pending, None
+            self._run(speculation)
+
+    def _run(self, speculation):
+        pathfinder = self.bot.pathfinder
+        for origin, max_range in speculation.field_jobs:
+            if self._latest is not speculation: #the turn started or newer work arrived
+                return
+            field = distance_field(speculation.blocked, origin, max_range)
+            for torpedo_range in range(max(MIN_TORPEDO_RANGE, max_range - MAX_CHARGE_PER_TURN), max_range + 1):
+                field.target_mask(torpedo_range, BLAST_RADIUS)
+            speculation.fields.append(field)
+        for start, destination in speculation.route_jobs:
+            if self._latest is not speculation:
+                return
+            cells = pathfinder.search_cells(start, destination, speculation.passable)
+            if cells is not None:
+                speculation.routes.append(cells)
@@ -0,0 +1,100 @@
+"""Vectorized torpedo targeting.
+
+Works on the window of the map a torpedo can reach instead of walking coordinates in Python:
+the reachability mask comes from a reachability.DistanceField, and the Chebyshev (self-damage)
+and foreign object masks and blast values are computed over the same window with NumPy.
+"""
+import numpy as np
+from util import Coordinate
+
+BLAST_RADIUS = 1
+DIRECT_HIT_WEIGHT = 2
+NEAR_MISS_WEIGHT = 1
+
+
+def window_sum(layer, x_min, y_min, rows, cols, radius):
+    """returns the sum of layer over the Chebyshev radius around every square of a window"""
+    height, width = layer.shape
+    top, left = y_min - 1 - radius, x_min - 1 - radius
+    dtype = np.float64 if layer.dtype.kind == 'f' else np.int64
+    padded = np.zeros((rows + 2 * radius, cols + 2 * radius), dtype=dtype)
+    src_top, src_left = max(top, 0), max(left, 0)
+    src_bottom, src_right = min(top + padded.shape[0], height), min(left + padded.shape[1], width)
+    padded[src_top - top:src_bottom - top, src_left - left:src_right - left] = \
+        layer[src_top:src_bottom, src_left:src_right]
+
+    #integral image, so every box sum is four lookups
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=dtype)
+    np.cumsum(np.cumsum(padded, axis=0), axis=1, out=integral[1:, 1:])
+    size = 2 * radius + 1
+    return integral[size:, size:] - integral[:-size, size:] - integral[size:, :-size] + integral[:-size, :-size]
+
+
+def rank_torpedo_targets(game_map, field, location, torpedo_range, blast_radius=BLAST_RADIUS):
+    """Returns [(coordinate, expected blast value)] for every valid target, best first.
+
+    A valid target is reachable within torpedo_range, outside the blast radius of location,
+    and holds only foreign objects."""
+    if torpedo_range <= blast_radius:
+        return list()
+    distance = field.distance
+    rows, cols = distance.shape
+    x_min, y_min = field.x_min, field.y_min
+    window = (slice(y_min - 1, y_min - 1 + rows), slice(x_min - 1, x_min - 1 + cols))
+    foreign = game_map.foreign_object_size[window]
+    objects = game_map.object_size[window]
+
+    #squares in range and clear of our own blast don't depend on this turn's objects, so the field caches them
+    candidates = field.target_mask(torpedo_range, blast_radius) & (foreign >= 1) & (foreign == objects)
+    if not candidates.any():
+        return list()
+
+    #only the window and its blast margin can add to a target's value
+    top, left = max(y_min - 1 - blast_radius, 0), max(x_min - 1 - blast_radius, 0)
+    exposure = np.maximum(game_map.foreign_object_size[top:y_min - 1 + rows + blast_radius,
+                                                       left:x_min - 1 + cols + blast_radius], 0)
+    value = NEAR_MISS_WEIGHT * window_sum(exposure, x_min - left, y_min - top, rows, cols, blast_radius) \
+        + (DIRECT_HIT_WEIGHT - NEAR_MISS_WEIGHT) * exposure[y_min - 1 - top:y_min - 1 - top + rows,
+                                                            x_min - 1 - left:x_min - 1 - left + cols]
+    rows_idx, cols_idx = np.nonzero(candidates)
+    values = value[rows_idx, cols_idx]
+    order = np.argsort(-values, kind='stable')
+    return [(Coordinate(int(x_min + cols_idx[idx]), int(y_min + rows_idx[idx])), int(values[idx])) for idx in order]
+
+
+def rank_belief_targets(belief, field, torpedo_range, threshold, blast_radius=BLAST_RADIUS):
+    """Returns [(coordinate, expected hits)] for valid targets whose blast covers at least threshold
+    of expected enemy occupancy according to an occupancy.OccupancyBelief grid, best first"""
+    if torpedo_range <= blast_radius:
+        return list()
+    rows, cols = field.distance.shape
+    x_min, y_min = field.x_min, field.y_min
+    grid = belief.grid
+    value = NEAR_MISS_WEIGHT * window_sum(grid, x_min, y_min, rows, cols, blast_radius) \
+        + (DIRECT_HIT_WEIGHT - NEAR_MISS_WEIGHT) * belief.window(x_min, y_min, rows, cols)
+    candidates = field.target_mask(torpedo_range, blast_radius) & (value >= threshold)
+    rows_idx, cols_idx = np.nonzero(candidates)
+    values = value[rows_idx, cols_idx]
+    order = np.argsort(-values, kind='stable')
+    return [(Coordinate(int(x_min + cols_idx[idx]), int(y_min + rows_idx[idx])), float(values[idx])) for idx in order]
+
+
+def rank_indexed_targets(index, field, torpedo_range, blast_radius=BLAST_RADIUS):
+    """rank_torpedo_targets for sparse objects, from a spatial_index.SpatialIndex of
+    (coordinate, (foreign object size, only foreign objects there)) entries for squares holding
+    foreign objects. Visits the indexed objects near the sub instead of the whole window"""
+    if torpedo_range <= blast_radius:
+        return list()
+    mask = field.target_mask(torpedo_range, blast_radius)
+    rows, cols = mask.shape
+    ranked = list()
+    for coord, (size, only_foreign) in index.within(field.origin, torpedo_range):
+        row, col = coord.y - field.y_min, coord.x - field.x_min
+        if not only_foreign or not (0 <= row < rows and 0 <= col < cols and mask[row, col]):
+            continue
+        value = NEAR_MISS_WEIGHT * sum(payload[0] for _, payload in index.within(coord, blast_radius)) \
+            + (DIRECT_HIT_WEIGHT - NEAR_MISS_WEIGHT) * size
+        ranked.append((coord, value))
+    #same order as rank_torpedo_targets: best value first, then row by row
+    ranked.sort(key=lambda target: (-target[1], target[0].y, target[0].x))
+    return ranked
@@ -0,0 +1,35 @@
+"""Checks the server_message classes parse turn messages the same way MessageParser does, since
+benchmark.py times one against the other.
+"""
+import pytest
+import server_message
+from message_parser import MessageParser, SAMPLE_TURN
+
+CLASSES = {
+    "S": server_message.SonarDetectionMessage,
+    "D": server_message.DetonationMessage,
+    "T": server_message.TorpedoHitMessage,
+    "O": server_message.DiscoveredObjectMessage,
+    "I": server_message.SubmarineInfoMessage,
+    "H": server_message.PlayerScoreMessage,
+}
+LINES = [line for line in SAMPLE_TURN if line[0] in CLASSES] + [
+    "I|42|1|5|6|0|dead=1",
+    "I|42|0|9|2|1|sonar_range=6|max_sonar=1|torpedo_range=6|max_torpedo=true|reactor_damage=2|dead=0",
+]
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_classes_match_message_parser(line):
+    record = MessageParser().parse(line)
+    message = CLASSES[line[0]](line)
+    for field in record.__slots__:
+        assert getattr(message, field) == getattr(record, field), field
+
+
+def test_submarine_info_flags():
+    message = server_message.SubmarineInfoMessage(LINES[-1])
+    assert message.active is True and message.dead is False
+    assert message.max_sonar_charge is True and message.max_torpedo_charge is True
+    assert message.reactor_damage == 2
+    assert server_message.SubmarineInfoMessage(LINES[-2]).dead is True
@@ -0,0 +1,82 @@
+"""Checks the vectorized torpedo targeting against the square by square reference scan.
+
+Run from this directory with python -m pytest. Every case is seeded, so a failure names the
+seed that reproduces it.
+"""
+import random
+import pytest
+import targeting
+from benchmark import BenchmarkBot, make_bot
+from submarine import Submarine
+
+SEEDS = range(200)
+
+
+@pytest.fixture(autouse=True)
+def no_path_table(monkeypatch):
+    """targeting doesn't move, so skip building the all-pairs path table for every map"""
+    monkeypatch.setattr(BenchmarkBot, "path_table_limit", 0)
+
+
+def scatter_objects(bot, rng, count):
+    """puts foreign objects, some sharing a square with our own, on count random squares"""
+    for _ in range(count):
+        square = bot.game_map[bot.random_square(None)]
+        size = rng.randint(1, 200)
+        square.object_size += size
+        square.foreign_object_size += size
+        if rng.random() < 0.2:
+            square.object_size += rng.randint(1, 200)
+
+
+def expected_value(bot, coord):
+    """the blast value rank_torpedo_targets should give coord, summed square by square"""
+    value = 0
+    for y in range(coord.y - targeting.BLAST_RADIUS, coord.y + targeting.BLAST_RADIUS + 1):
+        for x in range(coord.x - targeting.BLAST_RADIUS, coord.x + targeting.BLAST_RADIUS + 1):
+            if 1 <= x <= bot.map_width and 1 <= y <= bot.map_height:
+                value += targeting.NEAR_MISS_WEIGHT * max(bot.game_map.foreign_object_size[y - 1, x - 1], 0)
+    return value + (targeting.DIRECT_HIT_WEIGHT - targeting.NEAR_MISS_WEIGHT) * \
+        bot.game_map.foreign_object_size[coord.y - 1, coord.x - 1]
+
+
+def random_case(seed):
+    """returns a bot with objects scattered over a random map and a sub somewhere on it"""
+    rng = random.Random(seed)
+    bot = make_bot(rng.randint(6, 40), rng.choice((0.0, 0.1, 0.3)), seed)
+    scatter_objects(bot, rng, rng.randint(1, 40))
+    sub = Submarine(0)
+    sub.location = bot.random_square(None)
+    sub.torpedo_range = rng.randint(2, 9)
+    return bot, sub
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rank_torpedo_targets_matches_reference(seed):
+    bot, sub = random_case(seed)
+    field = bot.reachability.field(sub.location, sub.torpedo_range)
+    ranked = targeting.rank_torpedo_targets(bot.game_map, field, sub.location, sub.torpedo_range)
+    assert sorted(coord for coord, _ in ranked) == sorted(bot.get_torpedo_target_reference(sub))
+    for coord, value in ranked:
+        assert value == expected_value(bot, coord), "seed {0} target {1}".format(seed, coord)
+    values = [value for _, value in ranked]
+    assert values == sorted(values, reverse=True)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_rank_indexed_targets_matches_reference(seed):
+    bot, sub = random_case(seed)
+    field = bot.reachability.field(sub.location, sub.torpedo_range)
+    ranked = targeting.rank_indexed_targets(bot.object_index(), field, sub.torpedo_range)
+    assert ranked == targeting.rank_torpedo_targets(bot.game_map, field, sub.location, sub.torpedo_range)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_get_torpedo_target_picks_a_best_valued_target(seed):
+    bot, sub = random_case(seed)
+    ranked = bot.rank_torpedo_targets(sub)
+    target = bot.get_torpedo_target(sub)
+    if not ranked:
+        assert target is None
+    else:
+        assert target in [coord for coord, value in ranked if value == ranked[0][1]]
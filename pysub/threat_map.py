@@ -0,0 +1,110 @@
+"""Expected damage per square.
+
+ThreatMap keeps a float grid, indexed [y - 1, x - 1] like GameMap, holding roughly how much
+damage a sub on each square should expect from enemy torpedoes over the next turn. Each turn it
+decays, since the enemy moves on, and then adds:
+    * DETONATION_THREAT over every enemy detonation's blast box, widened by a square since its
+      target may have moved. Whoever fired there thinks something is there and may fire again
+    * ENEMY_THREAT over the ENEMY_REACH box around every enemy seen, by sonar pings heard,
+      torpedo hits and foreign objects discovered. Those enemies fire at what they find nearby
+
+Sources with the same radius are scattered into one impulse grid covering their bounding box,
+and the Chebyshev box sum filter from targeting spreads them all in one vectorized pass. Decay
+only touches the part of the grid that has any threat, and queries are bulk NumPy reads, so
+neighbourhoods and target lists are scored in one call.
+"""
+import numpy as np
+from targeting import window_sum
+
+DEFAULT_DECAY = 0.5
+DETONATION_THREAT = 1.0
+ENEMY_THREAT = 0.5
+ENEMY_REACH = 2
+#threat below this is treated as none, so a quiet map settles back to zero
+MIN_THREAT = 0.01
+
+
+class ThreatMap():
+    """Decaying grid of the damage a sub on each square can expect"""
+
+    def __init__(self, width, height, decay=DEFAULT_DECAY):
+        self.width = width
+        self.height = height
+        self.decay = decay
+        self.grid = np.zeros((height, width), dtype=np.float32)
+        #(top, bottom, left, right) bounds of the squares with any threat, or None
+        self._extent = None
+
+    def update(self, detonations, enemies):
+        """Moves the map one turn forward and adds [(location, blast radius)] enemy detonations
+        and [location] enemy sightings"""
+        self._decay()
+        by_radius = dict()
+        for location, radius in detonations:
+            by_radius.setdefault((radius + 1, DETONATION_THREAT), list()).append(location)
+        if enemies:
+            by_radius.setdefault((ENEMY_REACH, ENEMY_THREAT), list()).extend(enemies)
+        for (radius, value), locations in by_radius.items():
+            self.spread(locations, radius, value)
+
+    def spread(self, locations, radius, value):
+        """adds value over the Chebyshev box of radius around each on-map location"""
+        xs = np.fromiter((location.x - 1 for location in locations), np.intp, len(locations))
+        ys = np.fromiter((location.y - 1 for location in locations), np.intp, len(locations))
+        on_map = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        xs, ys = xs[on_map], ys[on_map]
+        if not len(xs):
+            return
+        top, bottom = max(int(ys.min()) - radius, 0), min(int(ys.max()) + radius + 1, self.height)
+        left, right = max(int(xs.min()) - radius, 0), min(int(xs.max()) + radius + 1, self.width)
+        impulse = np.zeros((bottom - top, right - left), dtype=np.float32)
+        np.add.at(impulse, (ys - top, xs - left), value)
+        self.grid[top:bottom, left:right] += window_sum(impulse, 1, 1, bottom - top, right - left, radius)
+        if self._extent is None:
+            self._extent = (top, bottom, left, right)
+        else:
+            old_top, old_bottom, old_left, old_right = self._extent
+            self._extent = (min(top, old_top), max(bottom, old_bottom), min(left, old_left), max(right, old_right))
+
+    def _decay(self):
+        if self._extent is None:
+            return
+        top, bottom, left, right = self._extent
+        active = self.grid[top:bottom, left:right]
+        active *= self.decay
+        if active.max() < MIN_THREAT:
+            active[...] = 0
+            self._extent = None
+
+    def clear(self):
+        """forgets every threat"""
+        self.grid[...] = 0
+        self._extent = None
+
+    def is_quiet(self, location, radius):
+        """returns true if there's no threat within radius of location"""
+        if self._extent is None:
+            return True
+        top, bottom, left, right = self._extent
+        row, col = location.y - 1, location.x - 1
+        if row + radius < top or row - radius >= bottom or col + radius < left or col - radius >= right:
+            return True
+        return not self.neighborhood(location, radius).any()
+
+    def neighborhood(self, location, radius):
+        """returns the (2 * radius + 1) square window of threat centred on location, zero off the map"""
+        window = np.zeros((2 * radius + 1, 2 * radius + 1), dtype=np.float32)
+        top, left = location.y - 1 - radius, location.x - 1 - radius
+        src_top, src_left = max(top, 0), max(left, 0)
+        src_bottom = min(top + window.shape[0], self.height)
+        src_right = min(left + window.shape[1], self.width)
+        if src_bottom > src_top and src_right > src_left:
+            window[src_top - top:src_bottom - top, src_left - left:src_right - left] = \
+                self.grid[src_top:src_bottom, src_left:src_right]
+        return window
+
+    def values(self, coords):
+        """returns the threat at each of a list of on-map coordinates"""
+        xs = np.fromiter((coord.x - 1 for coord in coords), np.intp, len(coords))
+        ys = np.fromiter((coord.y - 1 for coord in coords), np.intp, len(coords))
+        return self.grid[ys, xs]
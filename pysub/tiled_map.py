@@ -0,0 +1,276 @@
+"""Memory-mapped, tiled map storage for very large maps.
+
+TiledMap is a GameMap whose blocked, object_size and foreign_object_size layers live in
+memory-mapped files instead of in-memory arrays. Each file stores its layer tile by tile, so a
+tile_size square of the map is one contiguous run of bytes. The files are sparse, so a fresh
+map takes no disk or memory until squares are written.
+
+Tiles are paged in when something reads them: the square views, is_open, the torpedo range
+and targeting windows, and the path finder. prefetch() asks the kernel to read ahead the
+tiles around a sub. An LRU of max_tiles resident tiles decides what stays. A tile that falls
+off the end is dropped from the process with madvise, and anything written to it stays in the
+file. Resident memory follows the area the subs are working in, not the size of the map.
+
+The layers are array-like, not NumPy arrays. They take [row, col] and [row slice, col slice]
+reads and writes, and a window read returns a NumPy copy. Whole-map features, which are the
+occupancy belief, rollout snapshots and background speculation, need an in-memory GameMap.
+"""
+import mmap
+import os
+import random
+import shutil
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from game_map import GameMap
+
+#64 makes a bool tile exactly one 4 KB page, so tiles can be dropped page by page
+DEFAULT_TILE_SIZE = 64
+DEFAULT_MAX_TILES = 256
+LAYERS = (("blocked", np.bool_), ("object_size", np.int32), ("foreign_object_size", np.int32))
+OBJECT_LAYERS = ("object_size", "foreign_object_size")
+
+
+class TileStore():
+    """The tiles of every layer in memory-mapped files, plus an LRU of the resident tiles"""
+
+    def __init__(self, width, height, directory=None, tile_size=DEFAULT_TILE_SIZE, max_tiles=DEFAULT_MAX_TILES):
+        self.tile_size = tile_size
+        self.max_tiles = max(1, max_tiles)
+        self.tiles_x = -(-width // tile_size)
+        self.tiles_y = -(-height // tile_size)
+        self._owns_directory = directory is None
+        self.directory = tempfile.mkdtemp(prefix="pysub-map-") if directory is None else directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.arrays = dict()
+        self._maps = dict()
+        #each store makes its own files, so stores sharing a directory never overwrite each other
+        self.paths = list()
+        for name, dtype in LAYERS:
+            size = self.tiles_y * self.tiles_x * tile_size * tile_size * np.dtype(dtype).itemsize
+            handle, path = tempfile.mkstemp(prefix=name + "-", suffix=".tiles", dir=self.directory)
+            self.paths.append(path)
+            with os.fdopen(handle, "w+b") as tiles:
+                tiles.truncate(size)
+                self._maps[name] = mmap.mmap(tiles.fileno(), size)
+            self.arrays[name] = np.ndarray((self.tiles_y, self.tiles_x, tile_size, tile_size), dtype=dtype,
+                                           buffer=self._maps[name])
+        self.resident = OrderedDict()
+        #tiles whose object layers were written since the last clear_objects
+        self.written = set()
+        self.loads = 0
+        self.evictions = 0
+
+    def tile(self, name, tile_y, tile_x):
+        """returns a view of one tile of a layer, marking it as recently used"""
+        self.touch(tile_y, tile_x)
+        return self.arrays[name][tile_y, tile_x]
+
+    def touch(self, tile_y, tile_x):
+        """marks a tile as recently used, evicting the least recently used tile if there are too many"""
+        key = (tile_y, tile_x)
+        if key in self.resident:
+            self.resident.move_to_end(key)
+            return
+        self.resident[key] = None
+        self.loads += 1
+        if len(self.resident) > self.max_tiles:
+            old, _ = self.resident.popitem(last=False)
+            self._advise(old, getattr(mmap, "MADV_DONTNEED", None))
+            self.evictions += 1
+
+    def prefetch(self, tile_y_low, tile_x_low, tile_y_high, tile_x_high):
+        """asks for a block of tiles to be read ahead and marks them as recently used"""
+        for tile_y in range(max(0, tile_y_low), min(self.tiles_y - 1, tile_y_high) + 1):
+            for tile_x in range(max(0, tile_x_low), min(self.tiles_x - 1, tile_x_high) + 1):
+                if (tile_y, tile_x) not in self.resident:
+                    self._advise((tile_y, tile_x), getattr(mmap, "MADV_WILLNEED", None))
+                self.touch(tile_y, tile_x)
+
+    def clear_objects(self):
+        """zeroes the object layers of every tile they were written on"""
+        for tile_y, tile_x in self.written:
+            for name in OBJECT_LAYERS:
+                self.arrays[name][tile_y, tile_x].fill(0)
+        self.written.clear()
+
+    def _advise(self, key, advice):
+        if advice is None or not hasattr(mmap.mmap, "madvise"):
+            return
+        index = key[0] * self.tiles_x + key[1]
+        for name, dtype in LAYERS:
+            length = self.tile_size * self.tile_size * np.dtype(dtype).itemsize
+            #madvise works on whole pages, so only the pages entirely inside the tile
+            start = -(-index * length // mmap.PAGESIZE) * mmap.PAGESIZE
+            end = (index + 1) * length // mmap.PAGESIZE * mmap.PAGESIZE
+            if end > start:
+                self._maps[name].madvise(advice, start, end - start)
+
+    def close(self):
+        """Unmaps and deletes the files, and their directory if the store made it"""
+        if not self._maps:
+            return
+        self.arrays.clear()
+        for layer in self._maps.values():
+            layer.close()
+        self._maps.clear()
+        self.resident.clear()
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.paths.clear()
+        if self._owns_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class TiledLayer():
+    """Array-like view of one layer of a TileStore, indexed [y - 1, x - 1] like a GameMap layer"""
+    ndim = 2
+
+    def __init__(self, store, name, dtype, shape):
+        self.store = store
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.shape = shape
+
+    def __getitem__(self, key):
+        rows, cols = key
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            return self._window(rows, cols)
+        row, col = self._square(rows, cols)
+        size = self.store.tile_size
+        return self.store.tile(self.name, row // size, col // size)[row % size, col % size]
+
+    def __setitem__(self, key, value):
+        rows, cols = key
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            self._window(rows, cols, value)
+            return
+        row, col = self._square(rows, cols)
+        size = self.store.tile_size
+        self.store.tile(self.name, row // size, col // size)[row % size, col % size] = value
+        if self.name in OBJECT_LAYERS:
+            self.store.written.add((row // size, col // size))
+
+    def _square(self, row, col):
+        row, col = int(row), int(col)
+        if not (0 <= row < self.shape[0] and 0 <= col < self.shape[1]):
+            raise IndexError("square {0}, {1} is off a {2}x{3} layer".format(row, col, self.shape[1], self.shape[0]))
+        return row, col
+
+    def _window(self, rows, cols, value=None):
+        """copies a window out of the tiles, or writes value into it if given"""
+        rows = rows if isinstance(rows, slice) else slice(int(rows), int(rows) + 1)
+        cols = cols if isinstance(cols, slice) else slice(int(cols), int(cols) + 1)
+        top, bottom, row_step = rows.indices(self.shape[0])
+        left, right, col_step = cols.indices(self.shape[1])
+        if row_step != 1 or col_step != 1:
+            raise IndexError("tiled layers only take contiguous windows")
+        bottom, right = max(bottom, top), max(right, left)
+        out = np.zeros((bottom - top, right - left), dtype=self.dtype) if value is None else None
+        size, store = self.store.tile_size, self.store
+        for tile_y in range(top // size, -(-bottom // size)):
+            row_low, row_high = max(top, tile_y * size), min(bottom, (tile_y + 1) * size)
+            for tile_x in range(left // size, -(-right // size)):
+                col_low, col_high = max(left, tile_x * size), min(right, (tile_x + 1) * size)
+                tile = store.tile(self.name, tile_y, tile_x)
+                inner = (slice(row_low - tile_y * size, row_high - tile_y * size),
+                         slice(col_low - tile_x * size, col_high - tile_x * size))
+                outer = (slice(row_low - top, row_high - top), slice(col_low - left, col_high - left))
+                if value is None:
+                    out[outer] = tile[inner]
+                else:
+                    tile[inner] = value[outer] if np.ndim(value) == 2 else value
+                    if self.name in OBJECT_LAYERS:
+                        store.written.add((tile_y, tile_x))
+        return out
+
+
+class TiledPassable():
+    """The padded open-square layer PathFinder searches, read through the tiles on demand"""
+
+    def __init__(self, tiled_map):
+        self.blocked = tiled_map.blocked
+        self.width = tiled_map.width
+        self.height = tiled_map.height
+        self.stride = tiled_map.width + 2
+
+    def __len__(self):
+        return (self.height + 2) * self.stride
+
+    def __getitem__(self, cell):
+        if not 0 <= cell < len(self):
+            raise IndexError(cell)
+        row, col = divmod(cell, self.stride)
+        if row < 1 or row > self.height or col < 1 or col > self.width:
+            return 0
+        return 0 if self.blocked[row - 1, col - 1] else 1
+
+
+class TiledMap(GameMap):
+    """GameMap backed by memory-mapped tiles, with only the recently used tiles resident"""
+
+    def __init__(self, width, height, directory=None, tile_size=DEFAULT_TILE_SIZE, max_tiles=DEFAULT_MAX_TILES):
+        if width < 1 or height < 1:
+            raise ValueError("Invalid map size {0}x{1}".format(width, height))
+        self.store = TileStore(width, height, directory, tile_size, max_tiles)
+        self._blocked_count = 0
+        super(TiledMap, self).__init__(width, height)
+        #interned coordinates and neighbour tuples for as many squares as the resident tiles hold
+        self.cache_limit = self.store.max_tiles * tile_size * tile_size
+
+    def _create_layers(self):
+        shape = (self.height, self.width)
+        self.blocked, self.object_size, self.foreign_object_size = \
+            [TiledLayer(self.store, name, dtype, shape) for name, dtype in LAYERS]
+
+    def set_blocked(self, coord, blocked=True):
+        """marks the square at coord as blocked or not"""
+        was_blocked = coord in self and bool(self.blocked[coord[1] - 1, coord[0] - 1])
+        super(TiledMap, self).set_blocked(coord, blocked)
+        self._blocked_count += int(bool(blocked)) - int(was_blocked)
+
+    def open_count(self):
+        """returns how many squares are open"""
+        return len(self) - self._blocked_count
+
+    def open_cells(self):
+        """Listing every open square would read the whole map"""
+        raise ValueError("A tiled map doesn't list its open squares")
+
+    def random_open_square(self, exclude=None, rng=random):
+        """returns a random open square other than exclude, drawn from rng"""
+        if self.open_count() == 0 or (self.open_count() == 1 and exclude is not None and self.is_open(exclude)):
+            raise ValueError("No open square to pick other than {0}".format(exclude))
+        while True:
+            square = self.coordinate(rng.randint(1, self.width), rng.randint(1, self.height))
+            if square != exclude and not self.blocked[square.y - 1, square.x - 1]:
+                return square
+
+    def padded_passable(self):
+        """returns the padded open-square layer as an object PathFinder can index like bytes"""
+        return TiledPassable(self)
+
+    def objects_at(self, cells):
+        """returns (object sizes, foreign object sizes) arrays at flat indices, row * width + column"""
+        squares = [divmod(int(cell), self.width) for cell in cells]
+        return (np.array([self.object_size[row, col] for row, col in squares], dtype=np.int32),
+                np.array([self.foreign_object_size[row, col] for row, col in squares], dtype=np.int32))
+
+    def prefetch(self, location, radius):
+        """Reads ahead the tiles within radius of location and marks them as recently used"""
+        size = self.store.tile_size
+        self.store.prefetch((location.y - 1 - radius) // size, (location.x - 1 - radius) // size,
+                            (location.y - 1 + radius) // size, (location.x - 1 + radius) // size)
+
+    def reset(self, full=False):
+        """Clears the per-turn object layers on the tiles they were written to"""
+        self.store.clear_objects()
+        self._dirty.clear()
+        self.generation += 1
+
+    def close(self):
+        """Unmaps the tile files"""
+        self.store.close()
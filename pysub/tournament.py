@@ -0,0 +1,226 @@
+"""Headless tournaments and parameter sweeps.
+
+Every game is a GameSimulation played in-process between two PySub bots with no sockets: a
+candidate bot with one setting of the parameter grid and an opponent with the default
+settings, or the settings given with --opponent. Seats alternate with the seed so neither
+side always moves first. Games are spread over a process pool in chunks of seeds. Scores are
+read from the game's F and P lines through GameFinishedMessage, like a real client reads them.
+
+    python tournament.py --games 1000 --grid ping_spread=4,6,8 sonar_charge_percent=25,33,50
+    python tournament.py --games 500 --grid use_belief=0,1 --output belief.npz
+    python tournament.py --games 500 --grid planner_budget=0.02
+
+One row per game goes to a compressed .npz file of columns: the grid point, the seed, both
+scores, the turn count, the candidate's mean and worst time to answer a B message, the game's
+wall time and one column per swept parameter. The summary reports games per second per core.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import server_message
+from game_simulation import GameSimulation
+from local_server import obstacle_density
+from transcript import ReplaySocketManager
+from PySub import PySub
+
+#PySub settings a grid or --opponent may set
+TUNABLES = {
+    "min_ping_range": int,
+    "ping_spread": int,
+    "sonar_charge_percent": int,
+    "use_belief": lambda value: bool(int(value)),
+    "use_threat": lambda value: bool(int(value)),
+    "path_table_limit": int,
+    "planner_budget": float,
+}
+#tunables set by calling a PySub method instead of setting an attribute
+ENABLERS = {"planner_budget": "enable_planner"}
+#applied to both bots unless overridden. Building the all-pairs path table costs more than a
+#whole short game, and routes found by search are just as short
+HEADLESS_DEFAULTS = {"path_table_limit": 0}
+CANDIDATE = "candidate"
+OPPONENT = "opponent"
+DEFAULT_GAMES = 200
+DEFAULT_SEEDS_PER_JOB = 10
+DEFAULT_MAP_SIZE = 20
+DEFAULT_OBSTACLES = 0.05
+DEFAULT_TURNS = 200
+COLUMNS = ("point", "seed", "score", "opponent_score", "turns", "decide_mean_ms", "decide_max_ms", "seconds")
+
+
+def parse_setting(text):
+    """parses name=value[,value...] into (name, [values])"""
+    name, equals, values = text.partition("=")
+    if not equals or name not in TUNABLES:
+        raise ValueError("Unknown setting {0}, expected one of {1}".format(text, ", ".join(sorted(TUNABLES))))
+    return name, [TUNABLES[name](value) for value in values.split(",")]
+
+
+def parameter_grid(settings):
+    """returns every combination of [(name, [values])] as a list of dicts"""
+    names = [name for name, _ in settings]
+    return [dict(zip(names, values)) for values in itertools.product(*(values for _, values in settings))]
+
+
+def make_bot(name, params, manager):
+    """returns a PySub playing through manager with HEADLESS_DEFAULTS and then params applied"""
+    bot = PySub(name, "tournament", 0, False, manager)
+    for key, value in itertools.chain(HEADLESS_DEFAULTS.items(), params.items()):
+        if key in ENABLERS:
+            getattr(bot, ENABLERS[key])(value)
+        else:
+            setattr(bot, key, value)
+    return bot
+
+
+def play_game(params, opponent_params, seed, map_size=DEFAULT_MAP_SIZE, obstacles=DEFAULT_OBSTACLES,
+              max_turns=DEFAULT_TURNS):
+    """Plays one seeded game and returns its row of COLUMNS, less the grid point"""
+    start = time.perf_counter()
+    random.seed(seed)
+    simulation = GameSimulation(map_size, map_size, obstacles, seed=seed, max_turns=max_turns)
+    seats = [(CANDIDATE, params), (OPPONENT, opponent_params)]
+    if seed % 2:
+        seats.reverse()
+
+    bots = dict()
+    for name, settings in seats:
+        manager = ReplaySocketManager(simulation.config_lines())
+        bot = make_bot(name, settings, manager)
+        bot.configure(server_message.GameConfigMessage(manager.receive_message(), manager))
+        player, _ = simulation.join(bot.join_message())
+        bots[player] = bot
+
+    clock = time.perf_counter
+    decide = list()
+    while not simulation.is_finished():
+        begin = simulation.begin_turn()
+        commands = dict()
+        for player, bot in bots.items():
+            manager = bot.socket_manager
+            manager.sent.clear()
+            started = clock()
+            bot.handle_turn_message(begin)
+            if player.name == CANDIDATE:
+                decide.append(clock() - started)
+            commands[player] = list(manager.sent)
+        results = simulation.play_turn(commands)
+        for player, bot in bots.items():
+            for line in results[player]:
+                bot.handle_turn_message(line)
+
+    lines = simulation.result_lines()
+    finished = server_message.GameFinishedMessage(lines[0], ReplaySocketManager(lines[1:]))
+    for bot in bots.values():
+        bot.handle_game_finished_message(finished)
+        bot.close()
+    scores = dict((result.player_name, result.player_score) for result in finished.player_results)
+    return (seed, scores[CANDIDATE], scores[OPPONENT], finished.turn_count,
+            1000.0 * sum(decide) / len(decide) if decide else 0.0, 1000.0 * max(decide, default=0.0),
+            time.perf_counter() - start)
+
+
+def _play_chunk(job):
+    point, params, opponent_params, seeds, options = job
+    rows = list()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for seed in seeds:
+            rows.append((point,) + play_game(params, opponent_params, seed, *options))
+    return rows
+
+
+def run_tournament(grid, opponent_params=None, games=DEFAULT_GAMES, first_seed=0, processes=None,
+                   seeds_per_job=DEFAULT_SEEDS_PER_JOB, map_size=DEFAULT_MAP_SIZE, obstacles=DEFAULT_OBSTACLES,
+                   max_turns=DEFAULT_TURNS):
+    """Plays games seeded games at every grid point and returns (rows, wall seconds, processes).
+    Each grid point plays the same seeds, so points are compared on the same maps"""
+    processes = processes or os.cpu_count() or 1
+    opponent_params = opponent_params or dict()
+    options = (map_size, obstacles, max_turns)
+    seeds = list(range(first_seed, first_seed + games))
+    jobs = [(point, params, opponent_params, seeds[idx:idx + seeds_per_job], options)
+            for point, params in enumerate(grid) for idx in range(0, len(seeds), seeds_per_job)]
+    start = time.perf_counter()
+    rows = list()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for chunk in pool.map(_play_chunk, jobs):
+            rows.extend(chunk)
+    return rows, time.perf_counter() - start, processes
+
+
+def columns(rows, grid):
+    """returns the rows as a dict of NumPy columns, with one param_<name> column per swept parameter"""
+    table = np.array(rows, dtype=np.float64).reshape(-1, len(COLUMNS))
+    data = dict((name, table[:, idx]) for idx, name in enumerate(COLUMNS))
+    for name in ("point", "seed", "score", "opponent_score", "turns"):
+        data[name] = data[name].astype(np.int32)
+    points = data["point"]
+    for name in sorted(set(key for params in grid for key in params)):
+        values = np.array([float(params.get(name, np.nan)) for params in grid])
+        data["param_" + name] = values[points]
+    return data
+
+
+def summarize(data, grid):
+    """returns [(params, games, mean score margin, win rate, mean decide ms)] per grid point"""
+    summary = list()
+    for point, params in enumerate(grid):
+        chosen = data["point"] == point
+        margin = data["score"][chosen] - data["opponent_score"][chosen]
+        summary.append((params, int(chosen.sum()), float(margin.mean()) if margin.size else 0.0,
+                        float((margin > 0).mean()) if margin.size else 0.0,
+                        float(data["decide_mean_ms"][chosen].mean()) if margin.size else 0.0))
+    return summary
+
+
+def parse_args(args=None):
+    """Parses command line options"""
+    parser = argparse.ArgumentParser(description="Headless PySub tournaments and parameter sweeps")
+    parser.add_argument("--grid", nargs="*", default=[], help="name=value,value... settings to sweep")
+    parser.add_argument("--opponent", nargs="*", default=[], help="name=value settings for the opponent")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="games per grid point")
+    parser.add_argument("--seed", type=int, default=0, help="first seed")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--chunk", type=int, default=DEFAULT_SEEDS_PER_JOB, help="games per job")
+    parser.add_argument("--size", type=int, default=DEFAULT_MAP_SIZE, help="map width and height")
+    parser.add_argument("--obstacles", type=obstacle_density, default=DEFAULT_OBSTACLES, help="fraction of squares blocked")
+    parser.add_argument("--turns", type=int, default=DEFAULT_TURNS, help="maximum turns per game")
+    parser.add_argument("--output", help="write the per game columns to this .npz file")
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """command line entry point"""
+    options = parse_args(args)
+    try:
+        grid = parameter_grid([parse_setting(setting) for setting in options.grid])
+        opponent = dict((name, values[0]) for name, values in (parse_setting(setting) for setting in options.opponent))
+    except ValueError as error:
+        print(error)
+        return 2
+
+    rows, elapsed, processes = run_tournament(grid, opponent, options.games, options.seed, options.processes,
+                                              options.chunk, options.size, options.obstacles, options.turns)
+    data = columns(rows, grid)
+    if options.output:
+        np.savez_compressed(options.output, **data)
+
+    for params, games, margin, win_rate, decide_ms in summarize(data, grid):
+        print("{0:50} {1:6} games  margin {2:+6.2f}  wins {3:5.1%}  decide {4:6.3f} ms".format(
+            ", ".join("{0}={1}".format(key, value) for key, value in sorted(params.items())) or "defaults",
+            games, margin, win_rate, decide_ms))
+    print("{0} games in {1:.2f}s on {2} processes: {3:.2f} games/s/core, {4:.2f} games per CPU second".format(
+        len(rows), elapsed, processes, len(rows) / elapsed / processes if elapsed else 0.0,
+        len(rows) / data["seconds"].sum() if len(rows) else 0.0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+"""Buffered structured trace logging.
+
+TraceLog.record appends a (time, level, kind, template, args) tuple to an in-memory ring buffer
+and returns. A background thread drains the buffer in batches, formats each record as one line
+
+    <unix time> <LEVEL> <kind> <text>
+
+and writes the batch to a file or stream with a single write, so tracing every message never
+waits on the disk or the terminal. Formatting happens on the drain thread, so args should be
+values that won't change afterwards rather than containers that get reused.
+
+Records below the log's level are dropped on the spot, and so are all but one in every
+sample_every records below WARNING. With the level set to OFF, hot paths that check
+trace.level before calling record pay for one attribute comparison. When the buffer is full
+the oldest records are overwritten and counted in dropped.
+
+Verbose socket managers share one console log per process, so any number of bots run one
+drain thread between them. It is flushed and stopped at exit.
+"""
+import atexit
+import collections
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING", ERROR: "ERROR"}
+DEFAULT_CAPACITY = 65536
+DEFAULT_FLUSH_INTERVAL = 0.25
+_console = None
+_console_lock = threading.Lock()
+
+
+def parse_level(name):
+    """returns the level for a name such as "debug" or a number"""
+    if name.isdigit():
+        return int(name)
+    for level, level_name in LEVEL_NAMES.items():
+        if level_name == name.upper():
+            return level
+    if name.upper() == "OFF":
+        return OFF
+    raise ValueError("Unknown trace level {0}".format(name))
+
+
+def format_record(record):
+    """returns a record as one line of text"""
+    timestamp, level, kind, template, args = record
+    text = template.format(*args) if args else template
+    return "{0:.6f} {1} {2} {3}\n".format(timestamp, LEVEL_NAMES.get(level, level), kind,
+                                          text.replace("\n", "\\n"))
+
+
+class TraceLog():
+    """Ring buffered trace records drained to a file or stream by a background thread"""
+
+    def __init__(self, output=None, level=INFO, sample_every=1, capacity=DEFAULT_CAPACITY,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.level = level if output is not None else OFF
+        self.sample_every = max(1, sample_every)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.written = 0
+        #deque appends and pops are atomic, so the ring needs no lock
+        self._ring = collections.deque(maxlen=capacity)
+        self._sampled = 0
+        self._owns_output = isinstance(output, str)
+        self._output = open(output, "a", encoding="utf-8") if self._owns_output else output
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def console(cls):
+        """returns the process's shared DEBUG log to stdout, starting it on first use"""
+        global _console
+        with _console_lock:
+            if _console is None or _console.level >= OFF:
+                _console = cls(sys.stdout, DEBUG).start()
+                atexit.register(_console.close)
+            return _console
+
+    def start(self):
+        """Starts the drain thread"""
+        if self._thread is None and self.level < OFF:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._drain_loop, name="trace-log", daemon=True)
+            self._thread.start()
+        return self
+
+    def record(self, level, kind, template, *args):
+        """Queues a record. template is formatted with args on the drain thread"""
+        if level < self.level:
+            return
+        if level < WARNING and self.sample_every > 1:
+            self._sampled += 1
+            if self._sampled % self.sample_every:
+                return
+        ring = self._ring
+        if len(ring) == ring.maxlen:
+            self.dropped += 1
+        ring.append((time.time(), level, kind, template, args))
+
+    def flush(self):
+        """Writes everything queued so far"""
+        ring = self._ring
+        #held while popping too, so batches from the drain thread and a caller stay in order
+        with self._write_lock:
+            lines = list()
+            while True:
+                try:
+                    lines.append(format_record(ring.popleft()))
+                except IndexError:
+                    break
+            if lines and self._output is not None:
+                self._output.write("".join(lines))
+                self._output.flush()
+                self.written += len(lines)
+
+    def close(self):
+        """Stops the drain thread, writes what's left and closes the output if the log opened it"""
+        if self._thread is not None:
+            self._stopping = True
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        if self._owns_output and self._output is not None:
+            self._output.close()
+            self._output = None
+        self.level = OFF
+
+    def _drain_loop(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+#shared do-nothing log for code that wasn't given one
+DISABLED = TraceLog()
@@ -0,0 +1,184 @@
+"""Wire transcript recording and offline replay.
+
+A transcript is an append-only text file, gzip compressed if its name ends in .gz, with one
+record per line:
+
+    <R|S> <microseconds since previous record> <message>
+
+R records were received from the server and S records were sent by the bot. Replaying feeds
+the R records back through PySub.play with a fake socket manager, so the parser and
+issue_command can be profiled and benchmarked at full speed with no network.
+
+    python transcript.py game1.txt.gz game2.txt.gz --processes 4 --seed 0
+"""
+import argparse
+import contextlib
+import gzip
+import io
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+RECEIVED = "R"
+SENT = "S"
+
+
+def open_transcript(path, mode):
+    """opens a transcript for text reading or appending, through gzip for .gz files"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class TranscriptRecorder():
+    """Appends every received and sent line to a transcript"""
+
+    def __init__(self, path):
+        self.path = path
+        self.transcript = open_transcript(path, "a")
+        self.last = time.perf_counter()
+
+    def _write(self, direction, message):
+        now = time.perf_counter()
+        self.transcript.write("{0} {1} {2}\n".format(direction, int((now - self.last) * 1e6), message))
+        self.last = now
+
+    def received(self, message):
+        """records a line received from the server"""
+        self._write(RECEIVED, message)
+
+    def sent(self, message):
+        """records a line sent to the server"""
+        self._write(SENT, message)
+
+    def close(self):
+        """Flushes and closes the transcript"""
+        if self.transcript is not None:
+            self.transcript.close()
+            self.transcript = None
+
+
+def read_transcript(path):
+    """returns [(direction, microseconds since previous record, message)]"""
+    records = list()
+    with open_transcript(path, "r") as transcript:
+        for line in transcript:
+            direction, delta, message = line.rstrip("\n").split(" ", 2)
+            records.append((direction, int(delta), message))
+    return records
+
+
+class ReplaySocketManager():
+    """Socket manager stand-in that serves recorded lines and collects what the bot sends"""
+
+    def __init__(self, received):
+        self.received = list(received)
+        self.position = 0
+        self.sent = list()
+        self.verbose = False
+
+    def is_connected(self):
+        """Always connected"""
+        return True
+
+    def connect(self):
+        """Nothing to connect to"""
+
+    def disconnect(self):
+        """Nothing to disconnect from"""
+
+    def send_message(self, message):
+        """collects a sent message"""
+        self.sent.append(str(message))
+
+    def send_messages(self, messages):
+        """collects several sent messages"""
+        self.sent.extend(str(message) for message in messages)
+
+    def receive_message(self):
+        """returns the next recorded message, or None once the transcript is used up"""
+        if self.position >= len(self.received):
+            return None
+        message = self.received[self.position]
+        self.position += 1
+        return message
+
+    def receive_messages(self):
+        """yields the next recorded message"""
+        message = self.receive_message()
+        if message is not None:
+            yield message
+
+    def has_buffered_message(self):
+        """returns true while recorded messages remain"""
+        return self.position < len(self.received)
+
+
+def username_of(records):
+    """returns the username the recorded bot joined as"""
+    for direction, _, message in records:
+        if direction == SENT and message.startswith("J|"):
+            return message.split("|")[1]
+    raise ValueError("Transcript has no join message")
+
+
+def replay(path, seed=0, quiet=True):
+    """Plays a transcript back through PySub and returns timing and divergence figures.
+
+    random is seeded so a replay with the same seed always makes the same decisions."""
+    #PySub imports socket_manager, which imports this module
+    from PySub import PySub
+
+    records = read_transcript(path)
+    received = [message for direction, _, message in records if direction == RECEIVED]
+    recorded_sent = [message for direction, _, message in records if direction == SENT]
+    manager = ReplaySocketManager(received)
+
+    random.seed(seed)
+    bot = PySub(username_of(records), "replay", 1, False, manager)
+    output = io.StringIO() if quiet else None
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        try:
+            bot.login()
+            bot.play()
+        finally:
+            bot.close()
+    elapsed = time.perf_counter() - start
+
+    #commands depend on our own random choices, so count how often the replay decided differently
+    diverged = sum(1 for ours, recorded in zip(manager.sent, recorded_sent) if ours != recorded)
+    diverged += abs(len(manager.sent) - len(recorded_sent))
+    return {
+        "path": path,
+        "seed": seed,
+        "received": len(received),
+        "sent": len(manager.sent),
+        "diverged": diverged,
+        "turns": bot.turn_number,
+        "seconds": elapsed,
+        "messages_per_second": len(received) / elapsed if elapsed else 0.0,
+    }
+
+
+def _replay_job(job):
+    path, seed = job
+    return replay(path, seed)
+
+
+def replay_many(paths, seed=0, processes=None):
+    """Replays transcripts in parallel across a process pool"""
+    jobs = [(path, seed) for path in paths]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_replay_job, jobs))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay PySub wire transcripts")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None)
+    options = parser.parse_args()
+    for result in replay_many(options.paths, options.seed, options.processes):
+        print("{path}: {turns} turns, {received} messages in {seconds:.3f}s "
+              "({messages_per_second:.0f} msg/s), {diverged} commands diverged".format(**result))
@@ -0,0 +1,280 @@
+"""Profiling for chosen turns.
+
+TurnProfiler.run(turn, decide) calls decide, PySub.issue_commands, and profiles it if the turn
+is selected. Turns are selected two ways:
+
+    a turn range, first to last, whose turns run under cProfile, or under the sampler
+    a threshold in seconds. A watchdog thread is armed at the start of every other turn, and
+    if decide is still running when the threshold passes it samples the deciding thread's stack
+    every interval until decide returns. Fast turns are never captured
+
+Every capture writes two files to the profiler's directory:
+
+    turn-<n>.prof      pstats data, for pstats, snakeviz and friends
+    turn-<n>.folded    one "frame;frame;frame count" line per stack, for flamegraph.pl or speedscope
+
+cProfile only keeps caller to callee edges, so its folded stacks are rebuilt from those edges
+and counted in microseconds. Sampled folded stacks are counted in samples, and their .prof
+counts samples as calls. Turns outside the range pay for one comparison, plus arming and
+disarming the watchdog when there's a threshold. Without a profiler PySub pays for nothing.
+"""
+import cProfile
+import collections
+import marshal
+import os
+import queue
+import sys
+import threading
+import time
+import trace_log
+
+CPROFILE = "cprofile"
+SAMPLE = "sample"
+MODES = (CPROFILE, SAMPLE)
+DEFAULT_INTERVAL = 0.001
+#branches of a rebuilt cProfile stack worth less than this many microseconds are left out
+MIN_FOLDED_MICROS = 1
+
+
+def parse_turns(text):
+    """parses "12" or "10-20" into (first turn, last turn)"""
+    first, dash, last = text.partition("-")
+    try:
+        first = int(first)
+        last = int(last) if dash else first
+    except ValueError:
+        raise ValueError("Invalid turn range {0}, expected N or FIRST-LAST".format(text))
+    if last < first:
+        raise ValueError("Invalid turn range {0}, the last turn comes before the first".format(text))
+    return first, last
+
+
+def frame_label(func):
+    """returns "name (file:line)" for a pstats function key"""
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return "{0} ({1}:{2})".format(name, os.path.basename(filename), line)
+
+
+def folded_from_stats(stats):
+    """returns {stack: microseconds} rebuilt from cProfile stats by walking caller to callee edges
+    from the functions nobody called, splitting each function's time across the paths into it"""
+    callees = collections.defaultdict(list)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller].append((func, edge[3]))
+    folded = collections.Counter()
+    pending = [((func,), entry[3]) for func, entry in stats.items() if not entry[4]]
+    while pending:
+        path, seconds = pending.pop()
+        _, _, own, total, _ = stats[path[-1]]
+        share = seconds / total if total else 0.0
+        micros = int(own * share * 1e6)
+        if micros >= MIN_FOLDED_MICROS:
+            folded[path] += micros
+        for callee, edge_seconds in callees[path[-1]]:
+            #recursion folds into the outermost call
+            if callee not in path and edge_seconds * share * 1e6 >= MIN_FOLDED_MICROS:
+                pending.append((path + (callee,), edge_seconds * share))
+    return folded
+
+
+def stats_from_samples(samples, interval):
+    """returns pstats data for {stack: sample count}, where a stack is a root first tuple of function keys"""
+    stats = dict()
+    for stack, count in samples.items():
+        seconds = count * interval
+        seen = set()
+        for depth, func in enumerate(stack):
+            calls, _, own, total, callers = stats.get(func, (0, 0, 0.0, 0.0, dict()))
+            leaf = depth == len(stack) - 1
+            if func not in seen:
+                calls += count
+                total += seconds
+            if leaf:
+                own += seconds
+            stats[func] = (calls, calls, own, total, callers)
+            if depth and (stack[depth - 1], func) not in seen:
+                edge = callers.get(stack[depth - 1], (0, 0, 0.0, 0.0))
+                callers[stack[depth - 1]] = (edge[0] + count, edge[1] + count,
+                                             edge[2] + (seconds if leaf else 0.0), edge[3] + seconds)
+                seen.add((stack[depth - 1], func))
+            seen.add(func)
+    return stats
+
+
+def trim_samples(samples, code):
+    """returns samples with every frame down to the innermost call of code cut off each stack"""
+    key = (code.co_filename, code.co_firstlineno, code.co_name)
+    trimmed = collections.Counter()
+    for stack, count in samples.items():
+        if key in stack:
+            stack = stack[len(stack) - stack[::-1].index(key):]
+        if stack:
+            trimmed[stack] += count
+    return trimmed
+
+
+def write_capture(directory, turn, stats, folded):
+    """Writes a turn's .prof and .folded files and returns their paths"""
+    base = os.path.join(directory, "turn-{0}".format(turn))
+    with open(base + ".prof", "wb") as prof:
+        marshal.dump(stats, prof)
+    with open(base + ".folded", "w", encoding="utf-8") as out:
+        for stack, count in sorted(folded.items()):
+            out.write("{0} {1}\n".format(";".join(frame_label(func) for func in stack), count))
+    return base + ".prof", base + ".folded"
+
+
+class Capture():
+    """One armed turn of the sampler"""
+    __slots__ = ('thread_id', 'delay', 'done', 'lock', 'samples', 'started', 'seconds')
+
+    def __init__(self, thread_id, delay):
+        self.thread_id = thread_id
+        self.delay = delay
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.samples = collections.Counter()
+        #when sampling started and how long it went on for
+        self.started = None
+        self.seconds = 0.0
+
+
+class StackSampler():
+    """Background thread that samples another thread's stack while a capture is armed"""
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self._captures = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """Starts the sampling thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample_loop, name="turn-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def arm(self, thread_id, delay=0.0):
+        """Starts sampling thread_id once delay seconds pass, unless disarm is called first"""
+        capture = Capture(thread_id, delay)
+        self._captures.put(capture)
+        return capture
+
+    def disarm(self, capture):
+        """Stops a capture and returns it, with no samples if it never started"""
+        capture.done.set()
+        with capture.lock:
+            if capture.started is not None:
+                capture.seconds = time.perf_counter() - capture.started
+            return capture
+
+    def stop(self):
+        """Stops the sampling thread"""
+        if self._thread is not None:
+            self._captures.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _sample_loop(self):
+        while True:
+            capture = self._captures.get()
+            if capture is None:
+                return
+            if capture.done.wait(capture.delay):
+                continue
+            #the deciding thread only gives up the GIL every switch interval, 5ms by default
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(switch_interval, self.interval / 4))
+            try:
+                self._sample(capture)
+            finally:
+                sys.setswitchinterval(switch_interval)
+
+    def _sample(self, capture):
+        with capture.lock:
+            capture.started = time.perf_counter()
+        while True:
+            with capture.lock:
+                if capture.done.is_set():
+                    break
+                frame = sys._current_frames().get(capture.thread_id)
+                stack = list()
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                if stack:
+                    capture.samples[tuple(reversed(stack))] += 1
+            capture.done.wait(self.interval)
+
+
+class TurnProfiler():
+    """Profiles the decisions of a range of turns, and of turns slower than a threshold"""
+
+    def __init__(self, directory, turns=None, threshold=None, mode=CPROFILE, interval=DEFAULT_INTERVAL,
+                 trace=trace_log.DISABLED):
+        if mode not in MODES:
+            raise ValueError("Unknown profiler mode {0}, expected one of {1}".format(mode, ", ".join(MODES)))
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.first_turn, self.last_turn = turns if turns is not None else (1, 0)
+        self.threshold = threshold
+        self.mode = mode
+        self.interval = interval
+        self.trace = trace
+        #(turn, seconds, .prof path, .folded path) for every capture written
+        self.captures = list()
+        self.sampler = None
+        if threshold is not None or mode == SAMPLE:
+            self.sampler = StackSampler(interval).start()
+
+    def run(self, turn, decide):
+        """Calls decide, profiling it if turn is selected"""
+        if self.first_turn <= turn <= self.last_turn:
+            if self.mode == CPROFILE:
+                return self._run_cprofile(turn, decide)
+            return self._run_sampled(turn, decide, 0.0)
+        if self.threshold is None:
+            return decide()
+        return self._run_sampled(turn, decide, self.threshold)
+
+    def _run_cprofile(self, turn, decide):
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            return decide()
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            profile.create_stats()
+            self._record(turn, elapsed, write_capture(self.directory, turn, profile.stats,
+                                                      folded_from_stats(profile.stats)))
+
+    def _run_sampled(self, turn, decide, delay):
+        start = time.perf_counter()
+        capture = self.sampler.arm(threading.get_ident(), delay)
+        try:
+            return decide()
+        finally:
+            self.sampler.disarm(capture)
+            samples = trim_samples(capture.samples, TurnProfiler._run_sampled.__code__)
+            if samples:
+                elapsed = time.perf_counter() - start
+                #samples come less often than interval when the deciding thread holds on to the GIL
+                per_sample = capture.seconds / sum(capture.samples.values())
+                self._record(turn, elapsed, write_capture(self.directory, turn,
+                                                          stats_from_samples(samples, per_sample), samples))
+
+    def _record(self, turn, elapsed, paths):
+        self.captures.append((turn, elapsed) + paths)
+        self.trace.record(trace_log.WARNING, "profile", "turn {0} took {1:.3f}s, written to {2}",
+                          turn, elapsed, paths[0])
+
+    def close(self):
+        """Stops the sampling thread"""
+        if self.sampler is not None:
+            self.sampler.stop()
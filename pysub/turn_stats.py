@@ -0,0 +1,132 @@
+"""Per-turn latency instrumentation.
+
+TurnStats accumulates how long each phase of a turn took (socket wait, parsing, deciding and
+sending) and, at each turn boundary, records the per-turn totals into fixed-size log2
+histograms. It also counts messages and bytes per message type in each direction.
+Results export as JSON or as Prometheus text exposition format.
+
+PySub only touches this module when stats are enabled, so it costs nothing otherwise.
+"""
+import json
+
+PHASES = ("receive", "parse", "decide", "send", "turn")
+#bucket upper bounds in seconds: 1us, 2us, 4us ... ~16.8s
+BUCKET_BOUNDS = tuple(2.0 ** exponent * 1e-6 for exponent in range(25))
+
+
+class Histogram():
+    """Fixed-size log2 histogram of durations in seconds"""
+    __slots__ = ('counts', 'count', 'total', 'maximum')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def record(self, seconds):
+        """adds one observation"""
+        micros = int(seconds * 1e6)
+        bucket = min(micros.bit_length(), len(BUCKET_BOUNDS))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def quantile(self, fraction):
+        """returns the upper bound of the bucket holding the given quantile"""
+        if not self.count:
+            return 0.0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                return BUCKET_BOUNDS[bucket] if bucket < len(BUCKET_BOUNDS) else self.maximum
+        return self.maximum
+
+    def as_dict(self):
+        """returns the histogram as plain data"""
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.maximum,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(["{0:g}".format(bound) for bound in BUCKET_BOUNDS] + ["+Inf"], self.counts)),
+        }
+
+
+class TurnStats():
+    """Per-phase turn timings and per-type message counters"""
+
+    def __init__(self):
+        self.histograms = dict((phase, Histogram()) for phase in PHASES)
+        self.current = dict((phase, 0.0) for phase in PHASES)
+        self.turns = 0
+        self.in_turn = False
+        self.messages = {"recv": dict(), "send": dict()}
+        self.bytes = {"recv": dict(), "send": dict()}
+
+    def add(self, phase, seconds):
+        """adds time spent in a phase during the current turn"""
+        self.current[phase] += seconds
+
+    def count_message(self, direction, kind, size):
+        """counts one message of the given type and size in bytes"""
+        messages = self.messages[direction]
+        messages[kind] = messages.get(kind, 0) + 1
+        sizes = self.bytes[direction]
+        sizes[kind] = sizes.get(kind, 0) + size
+
+    def end_turn(self):
+        """records the current turn's phase totals and starts a new turn"""
+        if self.in_turn:
+            current = self.current
+            current["turn"] = current["receive"] + current["parse"] + current["decide"] + current["send"]
+            for phase, seconds in current.items():
+                self.histograms[phase].record(seconds)
+                current[phase] = 0.0
+            self.turns += 1
+        self.in_turn = True
+
+    def as_dict(self):
+        """returns all stats as plain data"""
+        return {
+            "turns": self.turns,
+            "phases": dict((phase, histogram.as_dict()) for phase, histogram in self.histograms.items()),
+            "messages": self.messages,
+            "bytes": self.bytes,
+        }
+
+    def to_json(self):
+        """returns the stats as JSON"""
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+    def to_prometheus(self):
+        """returns the stats in Prometheus text exposition format"""
+        lines = ["# HELP pysub_turns_total Turns played.", "# TYPE pysub_turns_total counter",
+                 "pysub_turns_total {0}".format(self.turns),
+                 "# HELP pysub_phase_seconds Time spent per turn in each phase.",
+                 "# TYPE pysub_phase_seconds histogram"]
+        for phase, histogram in self.histograms.items():
+            cumulative = 0
+            for bound, count in zip(BUCKET_BOUNDS, histogram.counts):
+                cumulative += count
+                lines.append('pysub_phase_seconds_bucket{{phase="{0}",le="{1:g}"}} {2}'.format(phase, bound, cumulative))
+            lines.append('pysub_phase_seconds_bucket{{phase="{0}",le="+Inf"}} {1}'.format(phase, histogram.count))
+            lines.append('pysub_phase_seconds_sum{{phase="{0}"}} {1!r}'.format(phase, histogram.total))
+            lines.append('pysub_phase_seconds_count{{phase="{0}"}} {1}'.format(phase, histogram.count))
+        for name, counters in (("messages", self.messages), ("message_bytes", self.bytes)):
+            lines.append("# TYPE pysub_{0}_total counter".format(name))
+            for direction, kinds in sorted(counters.items()):
+                for kind, value in sorted(kinds.items()):
+                    lines.append('pysub_{0}_total{{direction="{1}",type="{2}"}} {3}'.format(name, direction, kind, value))
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """writes the stats to path, as JSON unless the file name ends in .prom or .txt"""
+        text = self.to_prometheus() if path.endswith((".prom", ".txt")) else self.to_json()
+        with open(path, "w") as stats_file:
+            stats_file.write(text)